@@ -0,0 +1,284 @@
+import bisect
+import Decoder, Disassembler
+
+# Static Control-Flow Analysis
+# Walks the code a loaded image can reach from its entry point, without
+# running any of it, and splits it into basic blocks joined by their branch
+# and jump edges.  The targets of calls are the functions, and every block
+# belongs to the function that reaches it without following a call.
+#
+# A call is a jal or jalr that links into ra (x1) or t0 (x5), like the
+# profiler counts them.  A jalr's target is only known when the instruction
+# before it set its base with auipc or lui, which is how far calls and jumps
+# are made.  Any other jalr is a return if it goes through ra or t0 without
+# linking, and an indirect jump otherwise, and the walk can't follow either.
+#
+# Walking stops at EBREAK, words that aren't instructions, the end of memory,
+# and words of all zeros, which RISC-V keeps as an illegal instruction so
+# that running into empty memory is caught.  Without that, the walk would
+# decode all of an empty memory as "lb x0, 0(x0)".
+
+# Registers the calling convention links through.
+LINK_REGISTERS = (1, 5)
+
+# Edges between blocks.
+# FALL_EDGE goes on to the next instruction, BRANCH_EDGE is a taken branch,
+# JUMP_EDGE a jump that doesn't link, and CALL_EDGE goes into a function,
+# whose return comes back along the FALL_EDGE of the same block.
+FALL_EDGE = 'fall'
+BRANCH_EDGE = 'branch'
+JUMP_EDGE = 'jump'
+CALL_EDGE = 'call'
+
+# How a block ends, when it doesn't just run into the next block.
+RETURN_EXIT = 'return'
+INDIRECT_EXIT = 'indirect'
+STOP_EXIT = 'stop'
+
+
+# Work out where an Instruction can go
+def transfers(pc, word, decoded, previous):
+    # Returns (edges, exit) for the instruction at pc, where edges is a list
+    # of (kind, target) and exit is None for an instruction that just goes
+    # on to pc + 4.  previous is (word, decoded) of the instruction before
+    # it in the same walk, or None.
+    if decoded is None:
+        return [], STOP_EXIT
+    major = (word >> 2) & 0x1F
+    entry, rd, rs1, rs2, imm = decoded
+    if major == Decoder.BRANCH:
+        return [(BRANCH_EDGE, (pc + imm) & 0xFFFFFFFF), (FALL_EDGE, pc + 4)], BRANCH_EDGE
+    elif major == Decoder.JAL:
+        target = (pc + imm) & 0xFFFFFFFF
+    elif major == Decoder.JALR:
+        target = baseTarget(rs1, imm, pc, previous)
+    else:
+        return [], None
+
+    if rd in LINK_REGISTERS:
+        if target is None:
+            return [(FALL_EDGE, pc + 4)], CALL_EDGE
+        return [(CALL_EDGE, target), (FALL_EDGE, pc + 4)], CALL_EDGE
+    if target is not None:
+        return [(JUMP_EDGE, target)], JUMP_EDGE
+    if rd == 0 and rs1 in LINK_REGISTERS:
+        return [], RETURN_EXIT
+    return [], INDIRECT_EXIT
+
+
+# Work out a jalr's Target from the Instruction before it
+def baseTarget(rs1, imm, pc, previous):
+    # Returns the target, or None if the base register wasn't just set by
+    # an auipc or lui.
+    if previous is None or previous[1] is None or rs1 == 0:
+        return None
+    word, (entry, rd, _, _, upper) = previous
+    if rd != rs1:
+        return None
+    major = (word >> 2) & 0x1F
+    if major == Decoder.AUIPC:
+        base = pc - 4 + (upper << 12)
+    elif major == Decoder.LUI:
+        base = upper << 12
+    else:
+        return None
+    return (base + imm) & 0xFFFFFFFE
+
+
+# Decode the Word at an Address for the Walk
+def decodeAt(bus, pc):
+    # Returns (word, decoded), with decoded None for anything that stops the
+    # walk, or None if there is no word there.
+    if pc < 0 or pc > bus.size - 4:
+        return None
+    word = bus.fetch(pc)
+    if word == 0:
+        return (word, None)
+    return (word, Decoder.decode(word))
+
+
+# Basic Block
+class BasicBlock:
+
+    def __init__(self, start):
+        # The instructions from start up to end, not including end.
+        self.start = start
+        self.end = start
+        # (kind, target) for each block control can go to next.
+        self.edges = []
+        # How the block ends: one of the edge kinds for a branch, jump or
+        # call, an exit, or FALL_EDGE when it runs into the next block.
+        self.exit = FALL_EDGE
+        # Start of the function the block belongs to.
+        self.function = None
+
+
+# Control-Flow Graph
+class ControlFlowGraph:
+
+    def __init__(self, entry):
+        self.entry = entry
+        # start -> BasicBlock
+        self.blocks = {}
+        # function start -> sorted starts of its blocks
+        self.functions = {}
+        # pc -> (word, decoded) of every instruction reached, and the
+        # lowest and highest addresses they cover.
+        self.instructions = {}
+        self.low = 0
+        self.high = 0
+        self.starts = []
+
+    # Find the Block holding an Address, or None
+    def blockAt(self, pc):
+        index = bisect.bisect_right(self.starts, pc) - 1
+        if index < 0:
+            return None
+        block = self.blocks[self.starts[index]]
+        if pc >= block.end:
+            return None
+        return block
+
+    # Find the Function holding an Address, or None
+    def functionOf(self, pc):
+        block = self.blockAt(pc)
+        if block is None:
+            return None
+        return block.function
+
+    # Whether Changed Memory overlaps any of the Code
+    def overlaps(self, address, length):
+        # An instruction starting up to 3 bytes before the address still
+        # contains the changed bytes.
+        if address + length <= self.low or address - 3 >= self.high:
+            return False
+        instructions = self.instructions
+        if length + 3 > len(instructions):
+            return any(address - 3 <= pc < address + length for pc in instructions)
+        return any(pc in instructions for pc in range(address - 3, address + length))
+
+    # Describe the Graph
+    def describe(self):
+        # Returns the functions, each with its blocks as "start.last" and
+        # where each block goes.
+        lines = ['Blocks: {}  Functions: {}  Instructions: {}'.format(
+            len(self.blocks), len(self.functions), len(self.instructions))]
+        for function, starts in sorted(self.functions.items()):
+            lines.append(' Function {:05X}'.format(function))
+            for start in starts:
+                block = self.blocks[start]
+                edges = ', '.join('{} {:05X}'.format(kind, target) for kind, target in block.edges)
+                if block.exit in (RETURN_EXIT, INDIRECT_EXIT, STOP_EXIT):
+                    edges = (edges + ', ' if edges else '') + block.exit
+                lines.append('  {:05X}.{:05X}  {}'.format(start, block.end - 4, edges))
+        return lines
+
+    # Graphviz DOT for the Graph
+    def toDot(self):
+        # Returns the graph as DOT text, with each function in its own box,
+        # each block labelled with its disassembly, and calls dashed.
+        lines = ['digraph cfg {', '  node [shape=box, fontname="monospace"];']
+        for function, starts in sorted(self.functions.items()):
+            lines.append('  subgraph cluster_{:05X} {{'.format(function))
+            lines.append('    label="{:05X}";'.format(function))
+            for start in starts:
+                block = self.blocks[start]
+                text = []
+                for pc in range(start, block.end, 4):
+                    word, decoded = self.instructions[pc]
+                    assembly = Disassembler.disassembleWord(word) if word else None
+                    text.append('{:05X}: {}\\l'.format(pc, (assembly or '.word 0x{:08X}'.format(word)).strip()))
+                if block.exit in (RETURN_EXIT, INDIRECT_EXIT, STOP_EXIT):
+                    text.append(block.exit + '\\l')
+                lines.append('    "{:05X}" [label="{}"];'.format(start, ''.join(text)))
+            lines.append('  }')
+        for start in sorted(self.blocks):
+            for kind, target in self.blocks[start].edges:
+                style = ', style=dashed' if kind == CALL_EDGE else ''
+                lines.append('  "{:05X}" -> "{:05X}" [label="{}"{}];'.format(start, target, kind, style))
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+
+# Analyze the Code reachable from an Entry Point
+def analyze(bus, entry):
+    # Returns the ControlFlowGraph of everything reachable from entry,
+    # reading memory through the bus.  Nothing is run or written.
+    graph = ControlFlowGraph(entry)
+    instructions = graph.instructions
+    # Where blocks have to start, and where each instruction that ends one
+    # goes.
+    leaders = {entry}
+    functions = {entry}
+    exits = {}
+
+    # Decode everything reachable, one straight run of code at a time.
+    work = [entry]
+    while work:
+        pc = work.pop()
+        previous = None
+        while pc not in instructions:
+            fetched = decodeAt(bus, pc)
+            if fetched is None:
+                break
+            instructions[pc] = fetched
+            edges, ending = transfers(pc, fetched[0], fetched[1], previous)
+            if ending is not None:
+                exits[pc] = (edges, ending)
+                for kind, target in edges:
+                    leaders.add(target)
+                    if kind == CALL_EDGE:
+                        functions.add(target)
+                    work.append(target)
+                break
+            previous = fetched
+            pc += 4
+
+    # Split the code into blocks at the leaders and after every transfer.
+    for start in sorted(leaders):
+        if start not in instructions:
+            continue
+        block = BasicBlock(start)
+        pc = start
+        while True:
+            if pc in exits:
+                block.edges, block.exit = exits[pc]
+                pc += 4
+                break
+            pc += 4
+            if pc not in instructions:
+                # The end of memory.
+                block.exit = STOP_EXIT
+                break
+            if pc in leaders:
+                block.edges = [(FALL_EDGE, pc)]
+                break
+        block.end = pc
+        graph.blocks[start] = block
+
+    # A target that couldn't be decoded has no block, so edges into it go.
+    for block in graph.blocks.values():
+        block.edges = [(kind, target) for kind, target in block.edges if target in graph.blocks]
+
+    # Every function keeps its own first block, and gets the other blocks
+    # it reaches without a call that no function before it has.
+    roots = sorted(function for function in functions if function in graph.blocks)
+    for function in roots:
+        graph.blocks[function].function = function
+    for function in roots:
+        starts = [function]
+        work = [target for kind, target in graph.blocks[function].edges if kind != CALL_EDGE]
+        while work:
+            block = graph.blocks[work.pop()]
+            if block.function is not None:
+                continue
+            block.function = function
+            starts.append(block.start)
+            work.extend(target for kind, target in block.edges if kind != CALL_EDGE)
+        graph.functions[function] = sorted(starts)
+
+    graph.starts = sorted(graph.blocks)
+    if instructions:
+        graph.low = min(instructions)
+        graph.high = max(instructions) + 4
+    return graph
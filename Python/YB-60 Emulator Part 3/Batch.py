@@ -0,0 +1,138 @@
+import sys, json, time, hashlib, argparse
+import concurrent.futures
+import Loader, ImageCache, Machine, SaveState
+
+# Batch Runner
+# Runs many jobs over a pool of processes and streams a JSON line for each
+# one as soon as it finishes.  A job is a dict:
+#   file     the object file to load
+#   state    a save state to resume instead of a file
+#   start    hex start address, the file's entry point if left out (a
+#            state carries on from where it was saved)
+#   patches  editMemory-style patches applied after loading, "300: 13 05 10 00"
+#   limit    instruction limit, DEFAULT_LIMIT if left out
+#   time     time limit in seconds, none if left out
+#   hash     memory ranges to hash after the run, "400.40F" (inclusive)
+#   save     a save state to write after the run, to carry on from later
+#   name     a name to report the job by, the file if left out
+#
+#   python Batch.py collatz.obj test1.obj --start 300 --limit 100000
+#   python Batch.py --jobs jobs.jsonl -j 8
+
+# Every job stops after this many instructions unless it says otherwise, so
+# a program that never ends can't hold on to a worker forever.
+DEFAULT_LIMIT = 10000000
+
+
+# Parse an editMemory-style Patch
+def parsePatch(patch):
+    # "300: 13 05 10 00" -> (0x300, b'\x13\x05\x10\x00')
+    inputTuple = patch.partition(':')
+    return int(inputTuple[0], 16), bytes(int(byte, 16) for byte in inputTuple[2].split())
+
+
+# Parse a Memory Range
+def parseRange(memoryRange):
+    # "400.40F" -> (0x400, 0x40F)
+    inputTuple = memoryRange.partition('.')
+    return int(inputTuple[0], 16), int(inputTuple[2], 16)
+
+
+# Run one Job
+def runJob(job):
+    # Returns the job's result record.  Anything that goes wrong is reported
+    # in the record's error field instead of being raised, so one bad job
+    # doesn't stop the batch.
+    result = {'name': job.get('name', job.get('file', job.get('state')))}
+    startTime = time.perf_counter()
+    try:
+        if 'state' in job:
+            machine = SaveState.load(job['state'], ImageCache.openImageCache())
+        else:
+            machine = Machine.Machine(imageCache=ImageCache.openImageCache(), **Machine.memoryOptions())
+            machine.load(job['file'])
+        for patch in job.get('patches', ()):
+            address, data = parsePatch(patch)
+            machine.edit(address, data)
+
+        start = job.get('start')
+        limit = job.get('limit', DEFAULT_LIMIT)
+        timeLimit = job.get('time')
+        if start is None and 'state' in job:
+            count = machine.resume(limit, timeLimit)
+        else:
+            start = machine.entryPoint if start is None else int(start, 16)
+            count = machine.runTranslated(start, limit, timeLimit)
+        if 'save' in job:
+            SaveState.save(machine, job['save'])
+
+        result['instructions'] = count
+        result['pc'] = machine.registers[32]
+        result['reason'] = machine.stopReason(count, limit)
+        # Registers are reported as the 32-bit words the YB-60 would hold.
+        result['registers'] = machine.registers[:32]
+        hashes = {}
+        for memoryRange in job.get('hash', ()):
+            first, last = parseRange(memoryRange)
+            hashes[memoryRange] = hashlib.sha256(machine.memory[first:last + 1]).hexdigest()
+        result['hashes'] = hashes
+    except Loader.FormatError as error:
+        result['error'] = 'Format error input file: ' + str(error)
+    except Exception as error:
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+    result['time'] = time.perf_counter() - startTime
+    return result
+
+
+# Run a Batch of Jobs
+def runBatch(jobs, workers=None, stream=None):
+    # Writes each result to stream as a JSON line, in the order the jobs
+    # finish, and returns how many jobs reported an error.
+    if stream is None:
+        stream = sys.stdout
+    errors = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(runJob, job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if 'error' in result:
+                errors += 1
+            stream.write(json.dumps(result) + '\n')
+            stream.flush()
+    return errors
+
+
+# Read Jobs from a JSON Lines File
+def readJobs(fileName):
+    jobs = []
+    with open(fileName) as jobFile:
+        for line in jobFile:
+            line = line.strip()
+            if line:
+                jobs.append(json.loads(line))
+    return jobs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run YB-60 programs in parallel.')
+    parser.add_argument('files', nargs='*', help='object files to run as jobs')
+    parser.add_argument('--jobs', help='JSON lines file of jobs')
+    parser.add_argument('--start', help='hex start address for the object files')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help='instruction limit for the object files')
+    parser.add_argument('--time', type=float, help='time limit in seconds for the object files')
+    parser.add_argument('--hash', action='append', default=[], help='memory range to hash, e.g. 400.40F')
+    parser.add_argument('--patch', action='append', default=[], help='memory patch, e.g. "400: 1B 00 00 00"')
+    parser.add_argument('-j', '--workers', type=int, help='number of worker processes')
+    arguments = parser.parse_args()
+
+    jobs = readJobs(arguments.jobs) if arguments.jobs else []
+    for fileName in arguments.files:
+        job = {'file': fileName, 'limit': arguments.limit, 'hash': arguments.hash, 'patches': arguments.patch}
+        if arguments.time is not None:
+            job['time'] = arguments.time
+        if arguments.start is not None:
+            job['start'] = arguments.start
+        jobs.append(job)
+    if not jobs:
+        parser.error('no jobs given')
+    sys.exit(1 if runBatch(jobs, arguments.workers) else 0)
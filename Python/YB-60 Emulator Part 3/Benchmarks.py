@@ -0,0 +1,295 @@
+import io, os, time, tempfile
+import Loader, ImageCache, Machine, Memory, Lockstep, Profiler, CacheSim
+
+# Benchmarks
+# Run with "python Benchmarks.py" to time the emulator's hot spots.
+
+
+# Time a Function
+def timeIt(function, repeat=3):
+    # Best of repeat runs, in seconds.
+    best = None
+    for i in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - startTime
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+# Make an Intel HEX Image
+def makeHexImage(size, recordLength=16):
+    # Fills size bytes of memory with a repeating pattern, using extended
+    # address records every 64 KB like a real multi-megabyte image would.
+    lines = []
+    address = 0
+    while address < size:
+        if address % 0x10000 == 0:
+            segment = address >> 4
+            record = bytes([2, 0, 0, 2, segment >> 8, segment & 0xFF])
+            lines.append(':' + (record + bytes([-sum(record) & 0xFF])).hex().upper())
+        offset = address & 0xFFFF
+        data = bytearray((address + i) & 0xFF for i in range(recordLength))
+        record = bytes([recordLength, offset >> 8, offset & 0xFF, 0]) + data
+        if sum(record) & 0xFF == 0:
+            # The legacy loader wrongly rejects a checksum of 00.
+            data[-1] = (data[-1] + 1) & 0xFF
+            record = bytes([recordLength, offset >> 8, offset & 0xFF, 0]) + data
+        lines.append(':' + (record + bytes([-sum(record) & 0xFF])).hex().upper())
+        address += recordLength
+    lines.append(':00000001FF')
+    return '\n'.join(lines) + '\n'
+
+
+# The Loader from before Loader.loadHex, kept to compare against.
+def legacyLoadProgram(objectFile, memory):
+    currentExtend = 0
+    while True:
+        currentLine = objectFile.readline()
+        currentLine = currentLine.lstrip()
+        if currentLine[:1] == ':':
+            currentLine = currentLine.lstrip(':').rstrip("\n")
+            if legacyChecksum(currentLine) == False:
+                raise Loader.FormatError(currentLine)
+            recordType = currentLine[6:8]
+            if recordType == "01":
+                break
+            elif recordType == "02":
+                currentExtend = int(currentLine[8:12], 16)
+            elif recordType != "00":
+                raise Loader.FormatError(currentLine)
+            else:
+                numberOfBytes = int(currentLine[:2], 16)
+                currentAddress = int(currentLine[2:6], 16)
+                dataBytes = currentLine[8:]
+                addressIndex = (currentExtend * 16) + currentAddress
+                while numberOfBytes != 0:
+                    firstByte = int(dataBytes[:2], 16)
+                    dataBytes = dataBytes[2:]
+                    memory[addressIndex] = firstByte
+                    numberOfBytes -= 1
+                    addressIndex += 1
+
+
+def legacyChecksum(currentLine):
+    givenChecksum = int(currentLine[len(currentLine) - 2:], 16)
+    dataBytes = currentLine[:len(currentLine) - 2]
+    dataSum = 0
+    byteBuffer = bytearray(1)
+    while dataBytes:
+        buffer = int(dataBytes[:2], 16)
+        dataSum += buffer
+        dataBytes = dataBytes[2:]
+    hexBuffer = str(hex(dataSum))
+    hexBuffer = hexBuffer[2:]
+    hexBuffer = hexBuffer[len(hexBuffer) - 2:]
+    calculatedChecksum = int(hexBuffer, 16)
+    byteBuffer[0] = calculatedChecksum
+    temp = byteBuffer[0] - (1 << 8)
+    calculatedChecksum = temp * -1
+    return calculatedChecksum == givenChecksum
+
+
+# Benchmark the HEX Loader
+def benchmarkLoader(size=1048576):
+    text = makeHexImage(size)
+    legacyMemory = bytearray(1048576)
+    fastMemory = bytearray(1048576)
+    legacyTime = timeIt(lambda: legacyLoadProgram(io.StringIO(text), legacyMemory), 1)
+    fastTime = timeIt(lambda: Loader.loadHex(text, fastMemory))
+    if legacyMemory != fastMemory:
+        print("Loader mismatch!")
+    print("HEX loader, {:.1f} MB image".format(len(text) / 1048576))
+    print("  legacy loadProgram: {:.3f} s".format(legacyTime))
+    print("  Loader.loadHex:     {:.3f} s  ({:.0f}x)".format(fastTime, legacyTime / fastTime))
+
+
+# Benchmark the Image Cache
+def benchmarkImageCache(size=1048576):
+    text = makeHexImage(size)
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'image.obj')
+        with open(fileName, 'w') as objectFile:
+            objectFile.write(text)
+        cache = ImageCache.ImageCache(os.path.join(directory, 'cache'), predecoded=False)
+        parsedMemory = bytearray(1048576)
+        cachedMemory = bytearray(1048576)
+        parseTime = timeIt(lambda: Loader.loadHex(open(fileName).read(), parsedMemory))
+        written = []
+        Loader.loadHex(open(fileName).read(), parsedMemory, written)
+        key = cache.keyFor(fileName, len(parsedMemory))
+        cache.store(key, parsedMemory, 0, written)
+        cacheTime = timeIt(lambda: cache.load(cache.keyFor(fileName, len(cachedMemory)), cachedMemory))
+    if parsedMemory != cachedMemory:
+        print("Image cache mismatch!")
+    print("Image cache, {:.1f} MB image".format(len(text) / 1048576))
+    print("  Loader.loadHex:   {:.3f} s".format(parseTime))
+    print("  ImageCache.load:  {:.3f} s  ({:.0f}x)".format(cacheTime, parseTime / cacheTime))
+
+
+# Benchmark Lockstep against one Machine per Input
+def benchmarkLockstep(lanes=256, budget=200):
+    if Lockstep.numpy is None:
+        print("Lockstep: NumPy isn't installed, skipped")
+        return
+    # Every 16th lane ends by reading instret and loading from outside of
+    # memory instead of storing the result, so it leaves lockstep at the
+    # CSR read and faults after running it.
+    ending = b''.join(word.to_bytes(4, 'little') for word in (0xC02023F3, 0xFFC02383))
+    inputs = [[(0x400, bytes([lane % 250 + 1, 0, 0, 0]))] for lane in range(lanes)]
+    for lane in range(0, lanes, 16):
+        inputs[lane].append((0x334, ending))
+    startTime = time.perf_counter()
+    lockstep = Lockstep.runLockstep('collatz.obj', inputs, 0x300, budget)
+    lockstepTime = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    mismatches = 0
+    for lane, patches in enumerate(inputs):
+        machine = Machine.Machine()
+        machine.load('collatz.obj')
+        for address, data in patches:
+            machine.edit(address, data)
+        faulted = False
+        try:
+            machine.runTranslated(0x300, budget)
+        except Memory.MemoryAccessError:
+            faulted = True
+        count = machine.retired
+        if (count != lockstep.counts[lane] or faulted != (lane in lockstep.errors)
+                or machine.registers[:Machine.REGISTER_COUNT] != lockstep.laneRegisters(lane)
+                or machine.memory != lockstep.laneMemory(lane)):
+            mismatches += 1
+    scalarTime = time.perf_counter() - startTime
+    if mismatches:
+        print("Lockstep mismatch in {} lanes!".format(mismatches))
+    print("Lockstep, collatz.obj x {} lanes, {} instructions each".format(lanes, budget))
+    print("  one Machine per lane: {:.3f} s".format(scalarTime))
+    print("  Lockstep:             {:.3f} s  ({:.1f}x, {} lanes left lockstep)".format(
+        lockstepTime, scalarTime / lockstepTime, len(lockstep.machines)))
+
+
+# Benchmark Paged Memory against a flat bytearray
+def benchmarkPagedMemory(budget=300000):
+    # A loop adding one to every 68th word of a 64 KB array forever, so
+    # the whole budget runs, and every pass loads and stores.
+    program = [
+        0x000104B7,  # lui x9, 0x10
+        0x000105B7,  # lui x11, 0x10
+        0xFFC58593,  # addi x11, x11, -4
+        0x00548533,  # add x10, x9, x5
+        0x00052383,  # lw x7, 0(x10)
+        0x00138393,  # addi x7, x7, 1
+        0x00752023,  # sw x7, 0(x10)
+        0x04428293,  # addi x5, x5, 68
+        0x00B2F2B3,  # and x5, x5, x11
+        0xFE9FF06F,  # jal x0, -24
+    ]
+    results = []
+    for paged in (False, True):
+        machine = Machine.Machine(paged=paged)
+        machine.edit(0x300, b''.join(word.to_bytes(4, 'little') for word in program))
+        elapsed = timeIt(lambda: machine.runTranslated(0x300, budget))
+        results.append((elapsed, list(machine.registers), machine.retired, bytes(machine.memory[0x10000:0x20000])))
+    if results[0][1:] != results[1][1:] or results[0][2] != budget:
+        print("Paged memory mismatch!")
+    big = Machine.Machine(memorySize=1 << 32, paged=True)
+    big.load('collatz.obj')
+    print("Paged memory, a load and store loop for {} instructions".format(budget))
+    print("  flat bytearray: {:.3f} s".format(results[0][0]))
+    print("  PagedMemory:    {:.3f} s  ({:.2f}x)".format(results[1][0], results[0][0] / results[1][0]))
+    print("  4 GB PagedMemory holds {} KiB after loading".format(big.memory.residentBytes() // 1024))
+
+
+# Benchmark Restoring a Checkpoint against Loading again
+def benchmarkCheckpoint(runs=200, budget=200):
+    # A reset and rerun loop, like a fuzzer's, on a 4 GB paged memory.
+    machine = Machine.Machine(memorySize=1 << 32, paged=True)
+
+    def reload():
+        for i in range(runs):
+            machine.load('ex2_3.obj')
+            machine.runTranslated(0x300, budget)
+    loadTime = timeIt(reload)
+
+    machine.load('ex2_3.obj')
+    checkpoint = machine.checkpoint()
+
+    def restore():
+        for i in range(runs):
+            machine.restore(checkpoint)
+            machine.runTranslated(0x300, budget)
+    restoreTime = timeIt(restore)
+    print("Checkpoints, ex2_3.obj run {} times".format(runs))
+    print("  load every run:    {:.3f} s".format(loadTime))
+    print("  restore every run: {:.3f} s  ({:.1f}x)".format(restoreTime, loadTime / restoreTime))
+
+
+# Benchmark the Cost per Instruction over a Long Run
+def benchmarkRegisterWidth(windows=5, window=200000):
+    # A loop that doubles a register and squares it forever.  With
+    # registers masked to 32 bits each window should cost the same, where
+    # unmasked registers would grow and make every window slower.
+    program = [
+        0x00100293,  # addi x5, x0, 1
+        0x00129293,  # slli x5, x5, 1
+        0x00128293,  # addi x5, x5, 1
+        0x02528333,  # mul x6, x5, x5
+        0x006383B3,  # add x7, x7, x6
+        0xFF1FF06F,  # jal x0, -16
+    ]
+    machine = Machine.Machine()
+    machine.edit(0x300, b''.join(word.to_bytes(4, 'little') for word in program))
+    machine.clearRegisters()
+    machine.registers[32] = 0x300
+    print("Register width, {} windows of {} instructions".format(windows, window))
+    times = []
+    for i in range(windows):
+        startTime = time.perf_counter()
+        machine.resume(window)
+        times.append(time.perf_counter() - startTime)
+        print("  window {}: {:.1f} ns per instruction".format(i + 1, times[-1] / window * 1e9))
+    print("  last / first window: {:.2f}x".format(times[-1] / times[0]))
+
+
+# Benchmark the Cache Simulator
+def benchmarkCacheSim(budget=1000000):
+    # A loop loading every 68th byte of a 64 KB array, which misses the
+    # D-cache on almost every load, next to the profiler's run loop as the
+    # cost of an instrumented run without any caches.
+    program = [
+        0x000104B7,  # lui x9, 0x10
+        0x000105B7,  # lui x11, 0x10
+        0xFFF58593,  # addi x11, x11, -1
+        0x00548533,  # add x10, x9, x5
+        0x00052383,  # lw x7, 0(x10)
+        0x00740433,  # add x8, x8, x7
+        0x04428293,  # addi x5, x5, 68
+        0x00B2F2B3,  # and x5, x5, x11
+        0xFEDFF06F,  # jal x0, -20
+    ]
+    machine = Machine.Machine()
+    machine.edit(0x300, b''.join(word.to_bytes(4, 'little') for word in program))
+    profileTime = timeIt(lambda: Profiler.Profiler().run(machine, 0x300, budget))
+    simulators = []
+
+    def simulate():
+        simulators.append(CacheSim.CacheSimulator())
+        simulators[-1].run(machine, 0x300, budget)
+    cacheTime = timeIt(simulate)
+    dcache = simulators[-1].dcache
+    print("Cache simulator, {} instructions".format(budget))
+    print("  profiler:        {:.1f} ns per instruction".format(profileTime / budget * 1e9))
+    print("  cache simulator: {:.1f} ns per instruction  (D-cache miss rate {:.2f}%)".format(
+        cacheTime / budget * 1e9, 100 * dcache.misses / dcache.accesses))
+
+
+if __name__ == '__main__':
+    benchmarkLoader()
+    benchmarkImageCache()
+    benchmarkLockstep()
+    benchmarkPagedMemory()
+    benchmarkCheckpoint()
+    benchmarkRegisterWidth()
+    benchmarkCacheSim()
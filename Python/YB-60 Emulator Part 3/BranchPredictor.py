@@ -0,0 +1,164 @@
+# Branch Predictors
+# Models of how well hardware could guess the conditional branches a
+# program takes, from the taken or not taken outcome of each one.  They
+# plug into Pipeline.Pipeline, which feeds them every branch it sees and
+# charges the branch penalty only when the guess was wrong.
+#
+# Every predictor guesses with predict and learns with update, and observe
+# does both and keeps the counts per branch PC.  The table predictors use
+# 2-bit saturating counters, where 0 and 1 predict not taken and 2 and 3
+# taken, all starting at 1.
+
+# Table sizes, as the number of bits of index.
+DEFAULT_TABLE_BITS = 12
+MAX_TABLE_BITS = 24
+# Names of the predictors, for makePredictor.
+STATIC_TAKEN = 'taken'
+STATIC_NOT_TAKEN = 'not-taken'
+BIMODAL = 'bimodal'
+GSHARE = 'gshare'
+PREDICTORS = (STATIC_TAKEN, STATIC_NOT_TAKEN, BIMODAL, GSHARE)
+
+
+class Predictor:
+
+    def __init__(self):
+        # {pc: [executions, mispredicts, taken]} for each branch.
+        self.pcCounts = {}
+        self.branches = 0
+        self.mispredicts = 0
+
+    # Predict, Learn and Count one Branch
+    def observe(self, pc, taken):
+        # Returns whether the prediction was right.
+        predicted = self.predict(pc)
+        self.update(pc, taken)
+        counts = self.pcCounts.get(pc)
+        if counts is None:
+            counts = self.pcCounts[pc] = [0, 0, 0]
+        counts[0] += 1
+        self.branches += 1
+        if taken:
+            counts[2] += 1
+        if predicted != taken:
+            counts[1] += 1
+            self.mispredicts += 1
+            return False
+        return True
+
+    def predict(self, pc):
+        return False
+
+    def update(self, pc, taken):
+        pass
+
+    def describe(self):
+        return STATIC_NOT_TAKEN
+
+    # Report the Predictions
+    def report(self, top=20):
+        # Returns the report as lines: the overall accuracy, then the
+        # branches that were mispredicted most.
+        correct = self.branches - self.mispredicts
+        lines = ['Predictor: {}'.format(self.describe())]
+        lines.append('Branches: {}  Mispredicts: {}  Accuracy: {:.2f}%'.format(
+            self.branches, self.mispredicts, 100 * correct / (self.branches or 1)))
+        lines.append('')
+        lines.append('     PC  Executions  Mispredicts  Miss %  Taken %')
+        branches = sorted(self.pcCounts.items(), key=lambda item: (-item[1][1], item[0]))
+        for pc, (executions, mispredicts, taken) in branches[:top]:
+            lines.append('  {:05X}  {:10d}  {:11d}  {:6.2f}  {:7.2f}'.format(
+                pc, executions, mispredicts, 100 * mispredicts / executions, 100 * taken / executions))
+        return lines
+
+
+# Static Predictor
+class StaticPredictor(Predictor):
+    # Always guesses the same way.
+
+    def __init__(self, taken=False):
+        Predictor.__init__(self)
+        self.taken = taken
+
+    def predict(self, pc):
+        return self.taken
+
+    def describe(self):
+        return STATIC_TAKEN if self.taken else STATIC_NOT_TAKEN
+
+
+# Bimodal Predictor
+class BimodalPredictor(Predictor):
+    # One counter per table entry, picked by the branch's PC.
+
+    def __init__(self, tableBits=DEFAULT_TABLE_BITS):
+        Predictor.__init__(self)
+        self.tableBits = tableBits
+        self.mask = (1 << tableBits) - 1
+        self.counters = bytearray([1]) * (1 << tableBits)
+
+    def index(self, pc):
+        return (pc >> 2) & self.mask
+
+    def predict(self, pc):
+        return self.counters[self.index(pc)] >= 2
+
+    def update(self, pc, taken):
+        index = self.index(pc)
+        counter = self.counters[index]
+        if taken:
+            if counter < 3:
+                self.counters[index] = counter + 1
+        elif counter > 0:
+            self.counters[index] = counter - 1
+
+    def describe(self):
+        return '{} ({} entries)'.format(BIMODAL, 1 << self.tableBits)
+
+
+# Gshare Predictor
+class GsharePredictor(BimodalPredictor):
+    # Like bimodal, but the PC is XORed with the outcomes of the last
+    # historyBits branches, so a branch that depends on the branches before
+    # it gets a counter for each way they went.
+
+    def __init__(self, tableBits=DEFAULT_TABLE_BITS, historyBits=None):
+        BimodalPredictor.__init__(self, tableBits)
+        self.historyBits = tableBits if historyBits is None else historyBits
+        self.history = 0
+
+    def index(self, pc):
+        return ((pc >> 2) ^ self.history) & self.mask
+
+    def update(self, pc, taken):
+        BimodalPredictor.update(self, pc, taken)
+        self.history = ((self.history << 1) | taken) & ((1 << self.historyBits) - 1)
+
+    def describe(self):
+        return '{} ({} entries, {} bits of history)'.format(GSHARE, 1 << self.tableBits, self.historyBits)
+
+
+# Make a Predictor from Options
+def makePredictor(words):
+    # "gshare bits=10 history=8", "bimodal bits=14", "taken" or "not-taken",
+    # gshare if no predictor is named.  Raises ValueError for anything else.
+    name = GSHARE
+    tableBits = DEFAULT_TABLE_BITS
+    historyBits = None
+    for word in words:
+        option, _, value = word.lower().partition('=')
+        if option in PREDICTORS and not value:
+            name = option
+        elif option == 'bits' and value:
+            tableBits = int(value, 0)
+        elif option == 'history' and value:
+            historyBits = int(value, 0)
+        else:
+            raise ValueError('Bad predictor option: ' + word)
+    if not 0 <= tableBits <= MAX_TABLE_BITS or historyBits is not None and not 0 <= historyBits <= MAX_TABLE_BITS:
+        raise ValueError('Table bits must be from 0 to {}'.format(MAX_TABLE_BITS))
+    if name == GSHARE:
+        return GsharePredictor(tableBits, historyBits)
+    elif name == BIMODAL:
+        return BimodalPredictor(tableBits)
+    return StaticPredictor(name == STATIC_TAKEN)
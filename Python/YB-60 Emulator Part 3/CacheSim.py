@@ -0,0 +1,279 @@
+import random, collections
+import Decoder, Machine
+
+# Cache Simulator
+# Runs a program the way Machine.run does, and feeds every instruction
+# fetch and every load and store through a model of the caches, to see how
+# well the program's code and data layout use them.  Like the profiler it
+# has its own copy of the run loop, so running without it costs nothing.
+#
+# The caches are set associative, with a size, number of ways, line size
+# and replacement policy, and are either split into an I-cache and a
+# D-cache or one unified cache.  Stores allocate lines like loads do.  Only
+# hits and misses are counted, the data itself always comes from memory.
+#
+# The run loop only writes down each access, and every CHUNK_SIZE
+# instructions the accesses are run through the caches in one go.  Fetches
+# hit the line the last access did most of the time, and those are skipped
+# over without looking at the sets at all.
+
+# Replacement policies.
+LRU = 'lru'
+FIFO = 'fifo'
+RANDOM = 'random'
+POLICIES = (LRU, FIFO, RANDOM)
+# Instructions run between passes through the caches.
+CHUNK_SIZE = 65536
+
+
+# Cache
+class Cache:
+
+    def __init__(self, size=8192, ways=2, lineSize=32, policy=LRU, seed=0):
+        # size and lineSize are in bytes, and have to be powers of 2 that
+        # give a whole number of sets.  seed picks the victims for RANDOM.
+        # Raises ValueError for a cache that can't be built.
+        if lineSize <= 0 or lineSize & (lineSize - 1):
+            raise ValueError('Line size must be a power of 2: {}'.format(lineSize))
+        if ways <= 0 or size % (ways * lineSize):
+            raise ValueError('Size must be a multiple of ways x line size: {}'.format(size))
+        setCount = size // (ways * lineSize)
+        if setCount & (setCount - 1):
+            raise ValueError('Size must give a power of 2 sets: {}'.format(size))
+        if policy not in POLICIES:
+            raise ValueError('Unknown replacement policy: {}'.format(policy))
+        self.size = size
+        self.ways = ways
+        self.lineSize = lineSize
+        self.policy = policy
+        self.lineBits = lineSize.bit_length() - 1
+        self.setMask = setCount - 1
+        # The line numbers held by each set, oldest (or least recently
+        # used) first.
+        self.sets = [[] for i in range(setCount)]
+        self.random = random.Random(seed)
+        # The line the last access was to, which is always in the cache.
+        self.lastLine = None
+        # Totals, and accesses and misses per PC of the instruction that
+        # made them.
+        self.accesses = 0
+        self.misses = 0
+        self.writeMisses = 0
+        self.pcAccesses = collections.Counter()
+        self.pcMisses = {}
+
+    # Look a Line up, and bring it in if it Misses
+    def lookup(self, line):
+        # Returns whether it hit.
+        self.lastLine = line
+        lines = self.sets[line & self.setMask]
+        if line in lines:
+            if self.policy == LRU and lines[-1] != line:
+                lines.remove(line)
+                lines.append(line)
+            return True
+        if len(lines) == self.ways:
+            if self.policy == RANDOM:
+                del lines[self.random.randrange(self.ways)]
+            else:
+                del lines[0]
+        lines.append(line)
+        return False
+
+    # Access the Bytes from address to last
+    def access(self, pc, address, last, write=False):
+        # An access that straddles two lines looks both of them up, and
+        # counts as a miss if either misses.
+        self.accesses += 1
+        self.pcAccesses[pc] += 1
+        first = address >> self.lineBits
+        hit = first == self.lastLine or self.lookup(first)
+        if last >> self.lineBits != first:
+            hit = self.lookup(last >> self.lineBits) and hit
+        if not hit:
+            self.misses += 1
+            self.pcMisses[pc] = self.pcMisses.get(pc, 0) + 1
+            if write:
+                self.writeMisses += 1
+
+    # Fetch the Instructions at a List of PCs
+    def fetchAll(self, pcs):
+        # The same as access for each PC, but the accesses were already
+        # counted, and fetches from the last line skip the lookup.
+        lineBits = self.lineBits
+        lookup = self.lookup
+        pcMisses = self.pcMisses
+        lastLine = self.lastLine
+        misses = 0
+        for pc in pcs:
+            line = pc >> lineBits
+            if line == lastLine:
+                continue
+            lastLine = line
+            if not lookup(line):
+                misses += 1
+                pcMisses[pc] = pcMisses.get(pc, 0) + 1
+        self.misses += misses
+
+    # Describe the Cache
+    def describe(self):
+        return '{} bytes, {}-way, {} byte lines, {}'.format(self.size, self.ways, self.lineSize, self.policy)
+
+
+# Parse Cache Options
+def parseOptions(words):
+    # "size=4096", "ways=4", "line=64", "policy=fifo" and "unified" turn into
+    # keyword arguments for CacheSimulator.  Raises ValueError for anything
+    # else.
+    options = {}
+    names = {'size': 'size', 'ways': 'ways', 'line': 'lineSize'}
+    for word in words:
+        name, _, value = word.lower().partition('=')
+        if name == 'unified' and not value:
+            options['unified'] = True
+        elif name == 'policy' and value in POLICIES:
+            options['policy'] = value
+        elif name in names and value:
+            options[names[name]] = int(value, 0)
+        else:
+            raise ValueError('Bad cache option: ' + word)
+    return options
+
+
+class CacheSimulator:
+
+    def __init__(self, size=8192, ways=2, lineSize=32, policy=LRU, unified=False):
+        # Split caches are each the given size.  A unified cache is one
+        # cache of that size, which is both the I-cache and the D-cache.
+        self.icache = Cache(size, ways, lineSize, policy)
+        self.dcache = self.icache if unified else Cache(size, ways, lineSize, policy)
+        self.instructions = 0
+
+    # Run a Program under the Cache Simulator
+    def run(self, machine, startAddress, budget=None):
+        # Clears the registers and runs from startAddress until an EBREAK,
+        # an instruction we can't decode, the end of memory, or budget
+        # instructions.  Returns the number of instructions run, whose
+        # accesses are added to the caches' counts.
+        machine.clearRegisters()
+        registers = machine.registers
+        registers[32] = startAddress
+        decodeCache = machine.decodeCache
+        end = len(machine.memory)
+        if budget is None:
+            budget = -1
+        loadSizes = Machine.LOAD_SIZES
+        storeSizes = Machine.STORE_SIZES
+        # The PC of every instruction, and (index of the instruction in
+        # fetches, address, last byte, write) for every load and store.
+        fetches = []
+        data = []
+        flushAt = CHUNK_SIZE
+        retired = machine.retired
+        count = 0
+
+        try:
+            while registers[32] != end and count != budget:
+                if count == flushAt:
+                    self.simulate(fetches, data)
+                    fetches = []
+                    data = []
+                    flushAt += CHUNK_SIZE
+                pc = registers[32]
+                record = decodeCache.get(pc)
+                if record is None:
+                    record = machine.decodeInstruction(pc)
+                kind = record[0]
+                if kind == Decoder.STOP_KIND:
+                    break
+                fetches.append(pc)
+
+                if kind == Decoder.NEXT_KIND:
+                    size = loadSizes.get(record[1])
+                    if size is not None:
+                        address = (registers[record[3]] + record[4]) & 0xFFFFFFFF
+                        data.append((len(fetches) - 1, address, address + size - 1, False))
+                    record[1](*record[2])
+                    registers[32] = pc + 4
+                elif kind == Decoder.JUMP_KIND:
+                    record[1](*record[2])
+                elif kind == Decoder.STORE_KIND:
+                    address = (registers[record[3]] + record[4]) & 0xFFFFFFFF
+                    size = storeSizes[record[1]]
+                    data.append((len(fetches) - 1, address, address + size - 1, True))
+                    record[1](*record[2])
+                    machine.invalidateDecodeCache(address, size)
+                    registers[32] = pc + 4
+                else:
+                    # A CSR read sees the instructions before this one.
+                    machine.retired = retired + count
+                    record[1](*record[2])
+                    registers[32] = pc + 4
+                count += 1
+        finally:
+            machine.retired = retired + count
+            # A load or store that faulted was fetched, but its access
+            # never happened.
+            if data and data[-1][0] == count - (flushAt - CHUNK_SIZE):
+                data.pop()
+            self.simulate(fetches, data)
+            self.instructions += count
+        return count
+
+    # Run a Chunk of Accesses through the Caches
+    def simulate(self, fetches, data):
+        icache = self.icache
+        dcache = self.dcache
+        icache.accesses += len(fetches)
+        icache.pcAccesses.update(fetches)
+        if icache is not dcache:
+            # Split caches don't see each other's accesses, so the order
+            # between fetches and data doesn't matter.
+            icache.fetchAll(fetches)
+            for index, address, last, write in data:
+                dcache.access(fetches[index], address, last, write)
+            return
+        # A unified cache needs them in the order they happened, each load
+        # or store just after its own fetch.
+        start = 0
+        for index, address, last, write in data:
+            icache.fetchAll(fetches[start:index + 1])
+            start = index + 1
+            dcache.access(fetches[index], address, last, write)
+        icache.fetchAll(fetches[start:])
+
+    # Report the Cache Counts
+    def report(self, top=20, graph=None):
+        # Returns the report as lines: the totals for each cache, then the
+        # PCs with the most misses, and with a control-flow graph the
+        # accesses and misses of each function.
+        lines = ['Instructions: {}'.format(self.instructions)]
+        if self.icache is self.dcache:
+            caches = [('Unified', self.icache)]
+        else:
+            caches = [('I-cache', self.icache), ('D-cache', self.dcache)]
+        for name, cache in caches:
+            lines.append('')
+            lines.append('{}: {}'.format(name, cache.describe()))
+            lines.append('  Accesses: {}  Misses: {}  Miss Rate: {:.2f}%  Write Misses: {}'.format(
+                cache.accesses, cache.misses, 100 * cache.misses / (cache.accesses or 1), cache.writeMisses))
+
+            lines.append('     PC    Accesses      Misses  Miss %')
+            pcs = sorted(cache.pcMisses.items(), key=lambda item: (-item[1], item[0]))
+            for pc, misses in pcs[:top]:
+                accesses = cache.pcAccesses[pc]
+                lines.append('  {:05X}  {:10d}  {:10d}  {:6.2f}'.format(pc, accesses, misses, 100 * misses / accesses))
+
+            if graph is not None:
+                functions = {}
+                for pc, accesses in cache.pcAccesses.items():
+                    function = graph.functionOf(pc)
+                    counts = functions.setdefault(function, [0, 0])
+                    counts[0] += accesses
+                    counts[1] += cache.pcMisses.get(pc, 0)
+                lines.append('  Function    Accesses      Misses  Miss %')
+                for function, (accesses, misses) in sorted(functions.items(), key=lambda item: -item[1][1]):
+                    label = '?????' if function is None else '{:05X}'.format(function)
+                    lines.append('  {}     {:10d}  {:10d}  {:6.2f}'.format(label, accesses, misses,
+                                                                         100 * misses / accesses))
+        return lines
@@ -0,0 +1,224 @@
+import operator, time
+import Decoder, Machine
+
+# Debugger
+# Breakpoints, watchpoints and "run until", for getting to the part of a
+# long run that matters without stepping there one instruction at a time.
+#
+# Breakpoints are PCs, each with an optional condition on a register, like
+# "x10 == 5".  With only breakpoints set, the program runs on the block
+# translator, which is given the breakpoints as stops so they can only come
+# up between blocks.  Watchpoints need to see every load and store, so with
+# any set the debugger runs its own copy of the run loop instead.  Either
+# way, the plain run loops never look at any of this.
+#
+# Every run carries on from the registers as they are, and always runs the
+# instruction it starts at, so continuing from a breakpoint doesn't stop at
+# it again straight away.
+
+# Comparisons a condition can use.
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt,
+             '>=': operator.ge}
+
+
+# Parse a Breakpoint Condition
+def parseCondition(text):
+    # "x10 == 5", "x5 >= 0x100" or "pc != 300" turns into (register, operator
+    # text, value), where the PC is register 32.  Registers are compared
+    # unsigned, so "x5 == -1" means x5 is 0xFFFFFFFF.  Raises ValueError if
+    # the condition doesn't make sense.
+    words = text.split()
+    if len(words) != 3 or words[1] not in OPERATORS:
+        raise ValueError('Bad condition: ' + text)
+    name = words[0].lower()
+    if name == 'pc':
+        register = 32
+    elif name.startswith('x') and name[1:].isdigit() and int(name[1:]) < 32:
+        register = int(name[1:])
+    else:
+        raise ValueError('Bad register: ' + words[0])
+    return (register, words[1], int(words[2], 0) & 0xFFFFFFFF)
+
+
+# Format a Breakpoint Condition
+def formatCondition(condition):
+    register, comparison, value = condition
+    return '{} {} {}'.format('pc' if register == 32 else 'x%d' % register, comparison, value)
+
+
+class Debugger:
+
+    def __init__(self):
+        # PC -> condition, or None to always stop.
+        self.breakpoints = {}
+        # (start, end, access) for the bytes start to end - 1, where access
+        # is 'r', 'w' or 'rw'.
+        self.watchpoints = []
+        # Why the last run stopped, if it was for a breakpoint, watchpoint
+        # or until address, otherwise None.
+        self.hit = None
+
+    # Add a Breakpoint
+    def addBreakpoint(self, pc, condition=None):
+        self.breakpoints[pc] = condition
+
+    # Add a Watchpoint
+    def addWatchpoint(self, start, end, access='w'):
+        self.watchpoints.append((start, end, access))
+
+    # Delete the Breakpoints and Watchpoints at an Address
+    def delete(self, address=None):
+        # Deletes everything with no address.  Returns how many went.
+        if address is None:
+            count = len(self.breakpoints) + len(self.watchpoints)
+            self.breakpoints.clear()
+            self.watchpoints.clear()
+            return count
+        count = len(self.watchpoints)
+        self.watchpoints = [watch for watch in self.watchpoints if watch[0] != address]
+        count -= len(self.watchpoints)
+        if address in self.breakpoints:
+            del self.breakpoints[address]
+            count += 1
+        return count
+
+    # List the Breakpoints and Watchpoints
+    def describe(self):
+        lines = []
+        for pc, condition in sorted(self.breakpoints.items()):
+            if condition is None:
+                lines.append('break {:05X}'.format(pc))
+            else:
+                lines.append('break {:05X} if {}'.format(pc, formatCondition(condition)))
+        for start, end, access in self.watchpoints:
+            lines.append('watch {:05X}.{:05X} {}'.format(start, end - 1, access))
+        return lines
+
+    # Whether a Breakpoint's Condition holds
+    def conditionHolds(self, pc, registers):
+        condition = self.breakpoints.get(pc)
+        if condition is None:
+            return True
+        register, comparison, value = condition
+        return OPERATORS[comparison](registers[register], value)
+
+    # Run until something Stops it
+    def run(self, machine, budget=None, timeLimit=None, progress=None, until=None):
+        # Carries on from the machine's registers until a breakpoint whose
+        # condition holds, a watchpoint, the until address, or anything
+        # that stops a plain run.  Returns how many instructions were run,
+        # and leaves why in self.hit.
+        self.hit = None
+        stops = set(self.breakpoints)
+        if until is not None:
+            stops.add(until)
+        if self.watchpoints:
+            return self.runWatched(machine, stops, budget, timeLimit, progress, until)
+
+        machine.translator.setStops(stops)
+        startTime = time.perf_counter()
+        count = 0
+        try:
+            while True:
+                remaining = None if budget is None else budget - count
+                timeLeft = None if timeLimit is None else timeLimit - (time.perf_counter() - startTime)
+                executed = machine.resume(remaining, timeLeft, progress, stops)
+                count += executed
+                pc = machine.registers[32]
+                if not executed or pc not in stops or machine.timedOut:
+                    break
+                if pc == until:
+                    self.hit = 'Reached'
+                    break
+                if self.conditionHolds(pc, machine.registers):
+                    self.hit = self.breakpointHit(pc)
+                    break
+                # A condition that doesn't hold carries on from the
+                # breakpoint, unless that was the last of the budget.
+                if budget is not None and count >= budget:
+                    break
+        finally:
+            # Plain runs after this one shouldn't split their blocks at
+            # the breakpoints.
+            machine.translator.setStops(())
+        return count
+
+    # Run with Watchpoints
+    def runWatched(self, machine, stops, budget, timeLimit, progress, until):
+        # Machine.run's loop, checking every instruction against the stops
+        # and every load and store against the watchpoints.  A watchpoint
+        # stops the run after the instruction that hit it.
+        registers = machine.registers
+        decodeCache = machine.decodeCache
+        end = len(machine.memory)
+        if budget is None:
+            budget = -1
+        clock = Machine.RunClock(timeLimit, progress)
+        checkAt = Machine.CHECK_INTERVAL if clock.active() else -1
+        retired = machine.retired
+        machine.timedOut = False
+        count = 0
+
+        try:
+            while registers[32] != end and count != budget:
+                if count == checkAt:
+                    if not clock.check(count):
+                        machine.timedOut = True
+                        break
+                    checkAt += Machine.CHECK_INTERVAL
+                pc = registers[32]
+                if count and pc in stops:
+                    if pc == until:
+                        self.hit = 'Reached'
+                        break
+                    if self.conditionHolds(pc, registers):
+                        self.hit = self.breakpointHit(pc)
+                        break
+                record = decodeCache.get(pc)
+                if record is None:
+                    record = machine.decodeInstruction(pc)
+                kind = record[0]
+
+                if kind == Decoder.NEXT_KIND:
+                    size = Machine.LOAD_SIZES.get(record[1])
+                    if size is not None:
+                        loadAddress = (registers[record[3]] + record[4]) & 0xFFFFFFFF
+                        self.hit = self.watchpointHit(loadAddress, size, 'r', pc)
+                    record[1](*record[2])
+                    registers[32] = pc + 4
+                elif kind == Decoder.JUMP_KIND:
+                    record[1](*record[2])
+                elif kind == Decoder.STORE_KIND:
+                    storeAddress = (registers[record[3]] + record[4]) & 0xFFFFFFFF
+                    size = Machine.STORE_SIZES[record[1]]
+                    self.hit = self.watchpointHit(storeAddress, size, 'w', pc)
+                    record[1](*record[2])
+                    machine.invalidateDecodeCache(storeAddress, size)
+                    registers[32] = pc + 4
+                elif kind == Decoder.CSR_KIND:
+                    machine.retired = retired + count
+                    record[1](*record[2])
+                    registers[32] = pc + 4
+                else:
+                    break
+                count += 1
+                if self.hit is not None:
+                    break
+        finally:
+            machine.retired = retired + count
+        return count
+
+    # Describe a Breakpoint that was Hit
+    def breakpointHit(self, pc):
+        condition = self.breakpoints[pc]
+        if condition is None:
+            return 'Breakpoint'
+        return 'Breakpoint if ' + formatCondition(condition)
+
+    # Describe the Watchpoint an Access hits, or None
+    def watchpointHit(self, address, size, access, pc):
+        for start, end, watched in self.watchpoints:
+            if access in watched and address < end and start < address + size:
+                kind = 'read' if access == 'r' else 'write'
+                return 'Watchpoint {} of {:05X} by {:05X}'.format(kind, address, pc)
+        return None
@@ -0,0 +1,169 @@
+import Instructions
+
+# Instruction Decoding
+# Every instruction is picked out of one dispatch table, indexed by an
+# integer key built from the major opcode (bits 6:2), funct3 and funct7.
+# Running, stepping and disassembling all decode through here, so they
+# always agree on what an instruction is.
+
+# The EBREAK instruction, which stops the program.
+EBREAK_WORD = 0x00100073
+
+# Major opcodes, bits 6:2 of the instruction.
+LOAD = 0b00000
+OP_IMM = 0b00100
+AUIPC = 0b00101
+STORE = 0b01000
+OP = 0b01100
+LUI = 0b01101
+BRANCH = 0b11000
+JALR = 0b11001
+JAL = 0b11011
+SYSTEM = 0b11100
+
+# Instruction formats, and how many bits wide each format's imm is.
+R_FORMAT = 'R'
+I_FORMAT = 'I'
+S_FORMAT = 'S'
+SB_FORMAT = 'SB'
+U_FORMAT = 'U'
+UJ_FORMAT = 'UJ'
+IMM_BITS = {R_FORMAT: 0, I_FORMAT: 12, S_FORMAT: 12, SB_FORMAT: 13, U_FORMAT: 20, UJ_FORMAT: 21}
+
+# How an instruction moves the PC once it has executed.
+# NEXT_KIND goes on to PC + 4, JUMP_KIND sets the PC itself,
+# STORE_KIND goes on to PC + 4 after writing memory.
+# CSR_KIND goes on to PC + 4, but reads the machine's counters, so the run
+# loops bring those up to date first.
+NEXT_KIND = 0
+JUMP_KIND = 1
+STORE_KIND = 2
+STOP_KIND = 3
+CSR_KIND = 4
+
+# The dispatch table.  Each entry is (mnemonic, format, handler, kind, signed),
+# where signed says whether the handler takes its imm sign-extended.
+# Keys that don't name an instruction hold None.
+dispatchTable = [None] * (1 << 15)
+
+
+# Build the Dispatch Key for an Instruction Word
+def dispatchKey(word):
+    # major opcode in bits 4:0, funct3 in bits 7:5, funct7 in bits 14:8
+    return ((word >> 2) & 0x1F) | ((word >> 7) & 0xE0) | ((word >> 17) & 0x7F00)
+
+
+# Add an Instruction to the Dispatch Table
+def register(major, funct3, funct7, mnemonic, format, handler, kind=NEXT_KIND, signed=False):
+    # A funct3 or funct7 of None means the instruction doesn't use that
+    # field, so every value of it selects the same entry.
+    entry = (mnemonic, format, handler, kind, signed)
+    for f3 in (range(8) if funct3 is None else (funct3,)):
+        for f7 in (range(128) if funct7 is None else (funct7,)):
+            dispatchTable[major | (f3 << 5) | (f7 << 8)] = entry
+
+
+# Load Instructions, I format
+register(LOAD, 0b000, None, 'LB', I_FORMAT, Instructions.lbInt, signed=True)
+register(LOAD, 0b001, None, 'LH', I_FORMAT, Instructions.lhInt, signed=True)
+register(LOAD, 0b010, None, 'LW', I_FORMAT, Instructions.lwInt, signed=True)
+register(LOAD, 0b100, None, 'LBU', I_FORMAT, Instructions.lbuInt, signed=True)
+register(LOAD, 0b101, None, 'LHU', I_FORMAT, Instructions.lhuInt, signed=True)
+
+# Store Instructions, S format
+register(STORE, 0b000, None, 'SB', S_FORMAT, Instructions.sbInt, STORE_KIND, True)
+register(STORE, 0b001, None, 'SH', S_FORMAT, Instructions.shInt, STORE_KIND, True)
+register(STORE, 0b010, None, 'SW', S_FORMAT, Instructions.swInt, STORE_KIND, True)
+
+# Branch Instructions, SB format
+# SB format imm's are signed (-4096 to 4095), bgeu and bltu included, only
+# their comparison is unsigned.
+register(BRANCH, 0b000, None, 'BEQ', SB_FORMAT, Instructions.beqInt, JUMP_KIND, True)
+register(BRANCH, 0b001, None, 'BNE', SB_FORMAT, Instructions.bneInt, JUMP_KIND, True)
+register(BRANCH, 0b100, None, 'BLT', SB_FORMAT, Instructions.bltInt, JUMP_KIND, True)
+register(BRANCH, 0b101, None, 'BGE', SB_FORMAT, Instructions.bgeInt, JUMP_KIND, True)
+register(BRANCH, 0b110, None, 'BLTU', SB_FORMAT, Instructions.bltuInt, JUMP_KIND, True)
+register(BRANCH, 0b111, None, 'BGEU', SB_FORMAT, Instructions.bgeuInt, JUMP_KIND, True)
+
+# Jump Instructions
+register(JALR, None, None, 'JALR', I_FORMAT, Instructions.jalrInt, JUMP_KIND, True)
+register(JAL, None, None, 'JAL', UJ_FORMAT, Instructions.jalInt, JUMP_KIND, True)
+
+# OP-Imm Instructions, I format
+# The imm is signed, sltiu's too.  The shifts use the top 7 bits of the imm
+# as a funct7, and the bottom 5 as the shift amount.
+register(OP_IMM, 0b000, None, 'ADDI', I_FORMAT, Instructions.addiInt, signed=True)
+register(OP_IMM, 0b010, None, 'SLTI', I_FORMAT, Instructions.sltiInt, signed=True)
+register(OP_IMM, 0b011, None, 'SLTIU', I_FORMAT, Instructions.sltiuInt, signed=True)
+register(OP_IMM, 0b100, None, 'XORI', I_FORMAT, Instructions.xoriInt, signed=True)
+register(OP_IMM, 0b110, None, 'ORI', I_FORMAT, Instructions.oriInt, signed=True)
+register(OP_IMM, 0b111, None, 'ANDI', I_FORMAT, Instructions.andiInt, signed=True)
+register(OP_IMM, 0b001, 0b0000000, 'SLLI', I_FORMAT, Instructions.slliInt)
+register(OP_IMM, 0b101, 0b0000000, 'SRLI', I_FORMAT, Instructions.srliInt)
+register(OP_IMM, 0b101, 0b0100000, 'SRAI', I_FORMAT, Instructions.sraiInt)
+
+# OP Instructions, R format
+register(OP, 0b000, 0b0000000, 'ADD', R_FORMAT, Instructions.addInt)
+register(OP, 0b001, 0b0000000, 'SLL', R_FORMAT, Instructions.sllInt)
+register(OP, 0b010, 0b0000000, 'SLT', R_FORMAT, Instructions.sltInt)
+register(OP, 0b011, 0b0000000, 'SLTU', R_FORMAT, Instructions.sltuInt)
+register(OP, 0b100, 0b0000000, 'XOR', R_FORMAT, Instructions.xorInt)
+register(OP, 0b101, 0b0000000, 'SRL', R_FORMAT, Instructions.srlInt)
+register(OP, 0b110, 0b0000000, 'OR', R_FORMAT, Instructions.orInt)
+register(OP, 0b111, 0b0000000, 'AND', R_FORMAT, Instructions.andInt)
+register(OP, 0b000, 0b0100000, 'SUB', R_FORMAT, Instructions.subInt)
+register(OP, 0b101, 0b0100000, 'SRA', R_FORMAT, Instructions.sraInt)
+register(OP, 0b000, 0b0000001, 'MUL', R_FORMAT, Instructions.mulInt)
+register(OP, 0b001, 0b0000001, 'MULH', R_FORMAT, Instructions.mulhInt)
+register(OP, 0b010, 0b0000001, 'MULHSU', R_FORMAT, Instructions.mulhsuInt)
+register(OP, 0b011, 0b0000001, 'MULHU', R_FORMAT, Instructions.mulhuInt)
+register(OP, 0b100, 0b0000001, 'DIV', R_FORMAT, Instructions.divInt)
+register(OP, 0b101, 0b0000001, 'DIVU', R_FORMAT, Instructions.divuInt)
+register(OP, 0b110, 0b0000001, 'REM', R_FORMAT, Instructions.remInt)
+register(OP, 0b111, 0b0000001, 'REMU', R_FORMAT, Instructions.remuInt)
+
+# Upper Immediate Instructions, U format
+register(AUIPC, None, None, 'AUIPC', U_FORMAT, Instructions.auipcInt)
+register(LUI, None, None, 'LUI', U_FORMAT, Instructions.luiInt)
+
+# System Instructions, I format
+# Only CSRRS, which rdcycle, rdtime and rdinstret are.  The imm is the CSR.
+register(SYSTEM, 0b010, None, 'CSRRS', I_FORMAT, Instructions.csrrsInt, CSR_KIND)
+
+
+# Sign Extend an Immediate that is the given number of bits wide
+def signExtend(value, bits):
+    if value >= 1 << (bits - 1):
+        value = value - (1 << bits)
+    return value
+
+
+# Extract the Unsigned imm for a Format
+def extractImmediate(word, format):
+    if format == I_FORMAT:
+        return word >> 20
+    elif format == S_FORMAT:
+        return ((word >> 25) << 5) | ((word >> 7) & 0x1F)
+    elif format == SB_FORMAT:
+        return (((word >> 31) << 12) | (((word >> 7) & 0x1) << 11)
+                | (((word >> 25) & 0x3F) << 5) | (((word >> 8) & 0xF) << 1))
+    elif format == U_FORMAT:
+        return word >> 12
+    elif format == UJ_FORMAT:
+        return (((word >> 31) << 20) | (((word >> 12) & 0xFF) << 12)
+                | (((word >> 20) & 0x1) << 11) | (((word >> 21) & 0x3FF) << 1))
+    return 0
+
+
+# Decode an Instruction Word
+def decode(word):
+    # Returns (entry, rd, rs1, rs2, imm) with imm sign-extended if the
+    # handler wants it that way, or None if the word isn't an instruction
+    # we know.  EBREAK is checked for separately, by EBREAK_WORD.
+    entry = dispatchTable[dispatchKey(word)]
+    if entry is None:
+        return None
+    imm = extractImmediate(word, entry[1])
+    if entry[4]:
+        imm = signExtend(imm, IMM_BITS[entry[1]])
+    return entry, (word >> 7) & 0x1F, (word >> 15) & 0x1F, (word >> 20) & 0x1F, imm
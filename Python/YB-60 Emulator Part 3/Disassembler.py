@@ -0,0 +1,102 @@
+import struct
+import Decoder
+
+# Disassembler
+# Turns instruction words back into RISC-V assembly.  Disassembling only
+# ever reads memory, it never runs anything, so it can be pointed at any
+# range without changing the machine.
+#
+# The text for a word only depends on the word, so it is cached by word.
+# Memory that hasn't changed is made of the same words, and comes straight
+# out of the cache the next time, and memory that has changed can never get
+# stale text.  Code reuses a small number of words, so the cache stays small.
+
+# Most words we remember the text of before starting over.
+MAX_CACHED_WORDS = 1 << 16
+# Little-endian instruction words, for reading a whole range at once.
+WORD = struct.Struct('<I')
+# Bytes of memory a range is read in at a time.
+CHUNK_SIZE = 1 << 16
+
+# word -> text, or None for words that aren't instructions.
+wordCache = {}
+
+
+# Disassemble one Instruction Word
+def disassembleWord(opcode):
+    # Returns the assembly for the word, 'ebreak' for an EBREAK, or None
+    # if it isn't an instruction we know.
+    text = wordCache.get(opcode, False)
+    if text is False:
+        if len(wordCache) >= MAX_CACHED_WORDS:
+            wordCache.clear()
+        text = formatWord(opcode)
+        wordCache[opcode] = text
+    return text
+
+
+# Work out the Assembly for a Word
+def formatWord(opcode):
+    if opcode == Decoder.EBREAK_WORD:
+        return 'ebreak'
+    # Look the instruction up in the same table the run loop uses.
+    decoded = Decoder.decode(opcode)
+    if decoded is None:
+        return None
+    entry, rd, rs1, rs2, imm = decoded
+    major = (opcode >> 2) & 0x1F
+    inst = entry[0].lower().rjust(6)
+    format = entry[1]
+    # Immediates are shown signed, except for the shifts, U format and CSRs,
+    # which the decoder leaves unsigned.
+
+    if major == Decoder.LOAD or major == Decoder.JALR:
+        return inst + ' x{}, {}(x{})'.format(rd, imm, rs1)
+    elif major == Decoder.STORE:
+        return inst + ' x{}, {}(x{})'.format(rs2, imm, rs1)
+    elif major == Decoder.BRANCH:
+        return inst + ' x{}, x{}, {}'.format(rs1, rs2, imm)
+    elif major == Decoder.SYSTEM:
+        return inst + ' x{}, 0x{:03X}, x{}'.format(rd, opcode >> 20, rs1)
+    elif format == Decoder.I_FORMAT:
+        return inst + ' x{}, x{}, {}'.format(rd, rs1, imm)
+    elif format == Decoder.R_FORMAT:
+        return inst + ' x{}, x{}, x{}'.format(rd, rs1, rs2)
+    return inst + ' x{}, {}'.format(rd, imm)
+
+
+# Disassemble from an Address to an EBREAK
+def disassembleFrom(bus, startAddress):
+    # Returns one line per instruction from startAddress to an EBREAK or
+    # the end of memory, fetching through the bus.  Words that aren't
+    # instructions are skipped.
+    lines = []
+    end = bus.size
+    currentAddress = startAddress
+    while currentAddress != end:
+        text = disassembleWord(bus.fetch(currentAddress))
+        if text is not None:
+            lines.append(text)
+            if text == 'ebreak':
+                break
+        currentAddress = currentAddress + 4
+    return lines
+
+
+# Disassemble a Range of Memory
+def disassembleRange(memory, startAddress, endAddress):
+    # Yields a line for every word starting from startAddress to
+    # endAddress, with its address and the word itself.  Words that aren't
+    # instructions are shown as .word.  memory is the machine's memory,
+    # which is read CHUNK_SIZE bytes at a time, and only whole words in it
+    # are shown.
+    endAddress = min(endAddress, len(memory) - 4)
+    address = max(startAddress, 0)
+    while address <= endAddress:
+        length = min((endAddress - address) // 4 + 1, CHUNK_SIZE // 4) * 4
+        for opcode, in WORD.iter_unpack(memory[address:address + length]):
+            text = disassembleWord(opcode)
+            if text is None:
+                text = '  .word 0x{:08X}'.format(opcode)
+            yield ' {:05X} {:08X} {}'.format(address, opcode, text)
+            address += 4
@@ -0,0 +1,208 @@
+import os, mmap, struct, hashlib, tempfile
+import Decoder
+
+# Parsed Image Cache
+# Loading the same object file again and again doesn't need to parse it
+# every time.  After a file is loaded, the memory it filled in is saved as a
+# sparse image under a cache directory, named by a hash of the file, and the
+# next load of the same file just copies the image back into memory.
+# Only what the loader wrote goes into the image, never whatever was in
+# memory before, so loading over another program caches the same image as
+# loading into empty memory.
+# The cache is off unless the YB60_IMAGE_CACHE environment variable names a
+# directory for it.
+#
+# An image file is a header, then each run of memory the loader wrote as a
+# segment (address, length, then the bytes), then optionally the predecoded
+# instructions found in those segments.
+
+CACHE_MAGIC = b'YB60IMG3'
+# magic, memory size, entry point, segment count, predecoded count
+HEADER = struct.Struct('<8sQIII')
+# address, length
+SEGMENT = struct.Struct('<II')
+# pc, word, dispatch key, rd, rs1, rs2, imm
+PREDECODED = struct.Struct('<IIHBBBxi')
+# Cache size, once it's bigger than this the least recently used images go.
+DEFAULT_MAX_BYTES = 64 * 1048576
+IMAGE_SUFFIX = '.img'
+
+
+# Open the Image Cache named by the Environment, or None
+def openImageCache():
+    directory = os.environ.get('YB60_IMAGE_CACHE')
+    if not directory:
+        return None
+    maxBytes = int(os.environ.get('YB60_IMAGE_CACHE_SIZE', DEFAULT_MAX_BYTES))
+    return ImageCache(directory, maxBytes)
+
+
+# Join the Ranges a Loader wrote into Segments
+def mergeSegments(written):
+    # Returns (address, length) for each run of the written ranges, in
+    # address order, with ranges that overlap or touch joined together.
+    segments = []
+    for address, length in sorted(written):
+        if not length:
+            continue
+        if segments and address <= segments[-1][0] + segments[-1][1]:
+            start, previous = segments[-1]
+            segments[-1] = (start, max(previous, address + length - start))
+        else:
+            segments.append((address, length))
+    return segments
+
+
+# Decode the Instructions in the Segments
+def predecode(memory, segments):
+    # Returns (pc, word, decoded) for every word that decodes.  Data words
+    # that happen to decode are harmless, they are only used if reached.
+    instructions = []
+    for address, length in segments:
+        for pc in range(address & ~3, address + length - 3, 4):
+            word = int.from_bytes(memory[pc:pc + 4], 'little')
+            decoded = Decoder.decode(word)
+            if decoded is not None:
+                instructions.append((pc, word, decoded))
+    return instructions
+
+
+# Image Cache
+class ImageCache:
+
+    def __init__(self, directory, maxBytes=DEFAULT_MAX_BYTES, predecoded=True):
+        # predecoded says whether images also hold the decoded instructions.
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.predecoded = predecoded
+        os.makedirs(directory, exist_ok=True)
+
+    # Hash an Object File into a Cache Key
+    def keyFor(self, fileName, memorySize):
+        # The memory size is part of the key, since it decides which
+        # records fit.
+        digest = hashlib.sha256(CACHE_MAGIC + memorySize.to_bytes(8, 'little'))
+        with open(fileName, 'rb') as objectFile:
+            for block in iter(lambda: objectFile.read(1048576), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def pathFor(self, key):
+        return os.path.join(self.directory, key + IMAGE_SUFFIX)
+
+    # Copy a Cached Image into Memory
+    def load(self, key, memory, written=None):
+        # Returns (entry point, predecoded instructions), or None if there is
+        # no usable image for the key.  Predecoded instructions are
+        # (pc, word, decoded) like predecode returns.  written, if given,
+        # gets (address, length) of every segment copied into memory, like
+        # the loaders fill it in.
+        path = self.pathFor(key)
+        try:
+            imageFile = open(path, 'rb')
+        except OSError:
+            return None
+        with imageFile:
+            try:
+                image = mmap.mmap(imageFile.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return None
+        with image:
+            if len(image) < HEADER.size:
+                return None
+            magic, memorySize, entryPoint, segmentCount, decodedCount = HEADER.unpack_from(image, 0)
+            if magic != CACHE_MAGIC or memorySize != len(memory):
+                return None
+
+            # Check the whole image is there before touching memory.
+            offset = HEADER.size
+            segments = []
+            for i in range(segmentCount):
+                if offset + SEGMENT.size > len(image):
+                    return None
+                address, length = SEGMENT.unpack_from(image, offset)
+                offset += SEGMENT.size
+                if offset + length > len(image) or address + length > memorySize:
+                    return None
+                segments.append((address, offset, length))
+                offset += length
+            if offset + decodedCount * PREDECODED.size != len(image):
+                return None
+
+            view = memoryview(image)
+            try:
+                for address, start, length in segments:
+                    memory[address:address + length] = view[start:start + length]
+                    if written is not None:
+                        written.append((address, length))
+            finally:
+                view.release()
+
+            instructions = []
+            table = Decoder.dispatchTable
+            for pc, word, dispatchKey, rd, rs1, rs2, imm in PREDECODED.iter_unpack(image[offset:]):
+                instructions.append((pc, word, (table[dispatchKey], rd, rs1, rs2, imm)))
+
+        # Mark the image as just used, for eviction.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entryPoint, instructions
+
+    # Save freshly Loaded Memory as an Image
+    def store(self, key, memory, entryPoint, written):
+        # written is the (address, length) of everything the loader wrote,
+        # which the loaders fill in when given a list.
+        segments = mergeSegments(written)
+        instructions = predecode(memory, segments) if self.predecoded else []
+
+        parts = [HEADER.pack(CACHE_MAGIC, len(memory), entryPoint, len(segments), len(instructions))]
+        for address, length in segments:
+            parts.append(SEGMENT.pack(address, length))
+            parts.append(bytes(memory[address:address + length]))
+        for pc, word, decoded in instructions:
+            entry, rd, rs1, rs2, imm = decoded
+            parts.append(PREDECODED.pack(pc, word, Decoder.dispatchKey(word), rd, rs1, rs2, imm))
+
+        # Write to a temporary file and rename it into place, so a reader
+        # (or another writer of the same image) never sees half a file.
+        try:
+            handle, temporaryPath = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, 'wb') as imageFile:
+                imageFile.write(b''.join(parts))
+            os.replace(temporaryPath, self.pathFor(key))
+        except OSError:
+            try:
+                os.remove(temporaryPath)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    # Remove the Least Recently Used Images until the Cache fits
+    def evict(self):
+        images = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(IMAGE_SUFFIX):
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                # Another process evicted it first.
+                continue
+            images.append((status.st_mtime, status.st_size, name))
+            total += status.st_size
+        images.sort()
+        for mtime, size, name in images:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
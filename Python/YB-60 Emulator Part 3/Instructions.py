@@ -1,419 +1,413 @@
+# Binary String Instructions
+# The original instructions, where rd/rs1/rs2/imm are the instruction's
+# fields as strings of binary digits.  They turn the fields into integers
+# and run the integer version below, so both always do the same thing.
+# The register list they are given has no sink for x0 (see below), so x0 is
+# put back to 0 afterwards instead.
+
+# Read a Binary String Field as a Signed Number
+def signedField(field):
+    # The field's length is its width, so "111111111111" is -1.
+    value = int(field, 2)
+    if value >= 1 << (len(field) - 1):
+        value = value - (1 << len(field))
+    return value
+
 def add(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] + registers[source2]
+    addInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def addi(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    if immediate > 2047:
-        immediate = immediate - 4096
-    registers[destination] = registers[source1] + immediate
+    addiInt(registers, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def andFunc(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] & registers[source2]
+    andInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def andi(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    if immediate > 2047:
-        immediate = immediate - 4096
-    registers[destination] = registers[source1] & immediate
+    andiInt(registers, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def auipc(registers, rd, imm):
-    destination = int(rd, 2)
-    immediate = int(imm, 2)
-    registers[destination] = registers[32] + (immediate << 12)
+    auipcInt(registers, int(rd, 2), int(imm, 2))
+    registers[0] = 0
 
 def beq(registers, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    if immediate > 4095:
-        immediate = immediate - 8192
-    if registers[source1] == registers[source2]:
-        registers[32] = registers[32] + immediate
-    else:
-        registers[32] = registers[32] + 4
+    beqInt(registers, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def bge(registers, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    if immediate > 4095:
-        immediate = immediate - 8192
-    if registers[source1] >= registers[source2]:
-        registers[32] = registers[32] + immediate
-    else:
-        registers[32] = registers[32] + 4
+    bgeInt(registers, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def bgeu(registers, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    if registers[source1] >= registers[source2]:
-        registers[32] = registers[32] + immediate
-    else:
-        registers[32] = registers[32] + 4
+    bgeuInt(registers, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def blt(registers, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    if immediate > 4095:
-        immediate = immediate - 8192
-    if registers[source1] < registers[source2]:
-        registers[32] = registers[32] + immediate
-    else:
-        registers[32] = registers[32] + 4
+    bltInt(registers, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def bltu(registers, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    if registers[source1] < registers[source2]:
-        registers[32] = registers[32] + immediate
-    else:
-        registers[32] = registers[32] + 4
+    bltuInt(registers, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def bne(registers, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    if immediate > 4095:
-        immediate = immediate - 8192
-    if registers[source1] != registers[source2]:
-        registers[32] = registers[32] + immediate
-    else:
-        registers[32] = registers[32] + 4
+    bneInt(registers, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def jal(registers, rd, imm):
-    destination = int(rd, 2)
-    immediate = int(imm, 2)
-    # UJ format imm's are signed (-1048576 to 1048575)
-    if immediate > 1048575:
-        immediate = immediate - 2097152
-    registers[destination] = registers[32] + 4
-    registers[32] = registers[32] + immediate
+    jalInt(registers, int(rd, 2), signedField(imm))
+    registers[0] = 0
 
 def jalr(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    # I format imm's are signed (-2048 to 2047)
-    if immediate > 2047:
-        immediate = immediate - 4096
-    registers[destination] = registers[32] + 4
-    registers[32] = registers[source1] + immediate
+    jalrInt(registers, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def lb(registers, memory, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    result = memory[memLocation]
-    # Only use 8 bits (one byte) in this instruction.
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    registers[destination] = int(bitResult, 2)
+    lbInt(registers, memory, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def lbu(registers, memory, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    result = memory[memLocation]
-    # Only use 8 bits (one byte) in this instruction.
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    registers[destination] = int(bitResult, 2)
+    lbuInt(registers, memory, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def lh(registers, memory, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    lsResult = memory[memLocation]
-    msResult = memory[memLocation + 1]
-    # Only use 16 bits (two bytes) in this instruction.
-    combinedResult = msResult << 8
-    combinedResult = combinedResult + lsResult
-    bitResult = bin(combinedResult)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    registers[destination] = int(bitResult, 2)
+    lhInt(registers, memory, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def lhu(registers, memory, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    lsResult = memory[memLocation]
-    msResult = memory[memLocation + 1]
-    # Only use 16 bits (two bytes) in this instruction.
-    combinedResult = msResult << 8
-    combinedResult = combinedResult + lsResult
-    bitResult = bin(combinedResult)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    registers[destination] = int(bitResult, 2)
+    lhuInt(registers, memory, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def lui(registers, rd, imm):
-    destination = int(rd, 2)
-    immediate = int(imm, 2)
-    immediate = immediate << 12
-    registers[destination] = immediate
+    luiInt(registers, int(rd, 2), int(imm, 2))
+    registers[0] = 0
 
 def lw(registers, memory, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    lsResult = memory[memLocation]
-    ssResult = memory[memLocation + 1]
-    tsResult = memory[memLocation + 2]
-    msResult = memory[memLocation + 3]
-    # Use 32 bits (four bytes) in this instruction.
-    combinedResult = msResult << 8
-    combinedResult = combinedResult + tsResult
-    combinedResult = combinedResult << 8
-    combinedResult = combinedResult + ssResult
-    combinedResult = combinedResult << 8
-    combinedResult = combinedResult + lsResult
-    bitResult = bin(combinedResult)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    registers[destination] = int(bitResult, 2)
+    lwInt(registers, memory, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def orFunc(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] | registers[source2]
+    orInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def ori(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    registers[destination] = registers[source1] | immediate
+    oriInt(registers, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def sb(registers, memory, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    result = registers[source2]
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    memory[memLocation] = int(bitResult[24:], 2)
+    sbInt(registers, memory, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def sh(registers, memory, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    result = registers[source2]
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    memory[memLocation] = int(bitResult[24:], 2)
-    memory[memLocation + 1] = int(bitResult[16:24], 2)
+    shInt(registers, memory, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def sll(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] << registers[source2]
+    sllInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def slli(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    registers[destination] = registers[source1] << immediate
+    slliInt(registers, int(rd, 2), int(rs1, 2), int(imm, 2))
+    registers[0] = 0
 
 def slt(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    if registers[source1] < registers[source2]:
-        registers[destination] = 1
-    else:
-        registers[destination] = 0
+    sltInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def slti(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    if registers[source1] < immediate:
-        registers[destination] = 1
-    else:
-        registers[destination] = 0
+    sltiInt(registers, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def sltiu(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    if registers[source1] < immediate:
-        registers[destination] = 1
-    else:
-        registers[destination] = 0
+    sltiuInt(registers, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def sltu(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    if registers[source1] < registers[source2]:
-        registers[destination] = 1
-    else:
-        registers[destination] = 0
+    sltuInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def sra(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] >> registers[source2]
+    sraInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def srai(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    registers[destination] = registers[source1] >> immediate
+    sraiInt(registers, int(rd, 2), int(rs1, 2), int(imm, 2))
+    registers[0] = 0
 
 def srl(registers, rd, rs1, rs2):
-    # From what I read, Python only has an arithmetic right shift.
-    # So this one gets to be more *fun*.
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    i = 0
-    temp = registers[source1]
-    while i < registers[source2]:
-        temp = temp // 2
-        i += 1
-    registers[destination] = temp
+    srlInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def srli(registers, rd, rs1, imm):
-    # From what I read, Python only has an arithmetic right shift.
-    # So this one gets to be more *fun*.
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    i = 0
-    temp = registers[source1]
-    while i < immediate:
-        temp = temp // 2
-        i += 1
-    registers[destination] = temp
+    srliInt(registers, int(rd, 2), int(rs1, 2), int(imm, 2))
+    registers[0] = 0
 
 def sub(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] - registers[source2]
+    subInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def sw(registers, memory, rs1, rs2, imm):
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    immediate = int(imm, 2)
-    memLocation = registers[source1] + immediate
-    result = registers[source2]
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 32:
-        bitResult = '0' + bitResult
-    memory[memLocation] = int(bitResult[24:], 2)
-    memory[memLocation + 1] = int(bitResult[16:24], 2)
-    memory[memLocation + 2] = int(bitResult[8:16], 2)
-    memory[memLocation + 3] = int(bitResult[:8], 2)
+    swInt(registers, memory, int(rs1, 2), int(rs2, 2), signedField(imm))
 
 def xor(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] ^ registers[source2]
+    xorInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def xori(registers, rd, rs1, imm):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    immediate = int(imm, 2)
-    registers[destination] = registers[source1] ^ immediate
+    xoriInt(registers, int(rd, 2), int(rs1, 2), signedField(imm))
+    registers[0] = 0
 
 def mul(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    result = registers[source1] * registers[source2]
-    # Only use lower 32 bits in this instruction.
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 64:
-        bitResult = '0' + bitResult
-    lowerBits = bitResult[32:]
-    registers[destination] = int(lowerBits, 2)
+    mulInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def mulh(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    result = registers[source1] * registers[source2]
-    # Only use upper 32 bits in this instruction.
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 64:
-        bitResult = '0' + bitResult
-    upperBits = bitResult[:32]
-    registers[destination] = int(upperBits, 2)
+    mulhInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def mulhsu(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    result = registers[source1] * registers[source2]
-    # Only use upper 32 bits in this instruction.
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 64:
-        bitResult = '0' + bitResult
-    upperBits = bitResult[:32]
-    registers[destination] = int(upperBits, 2)
+    mulhsuInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def mulhu(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    result = registers[source1] * registers[source2]
-    # Only use upper 32 bits in this instruction.
-    bitResult = bin(result)[2:]
-    while len(bitResult) < 64:
-        bitResult = '0' + bitResult
-    upperBits = bitResult[:32]
-    registers[destination] = int(upperBits, 2)
+    mulhuInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def div(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] // registers[source2]
+    divInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def divu(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] // registers[source2]
+    divuInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def rem(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] % registers[source2]
+    remInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
 
 def remu(registers, rd, rs1, rs2):
-    destination = int(rd, 2)
-    source1 = int(rs1, 2)
-    source2 = int(rs2, 2)
-    registers[destination] = registers[source1] % registers[source2]
\ No newline at end of file
+    remuInt(registers, int(rd, 2), int(rs1, 2), int(rs2, 2))
+    registers[0] = 0
+
+
+# Integer Operand Instructions
+# Same instructions as above, but rd/rs1/rs2 are register numbers and imm is
+# already extracted (and sign-extended where the instruction uses it signed),
+# so nothing has to be converted from a binary string while running.
+# Loads and stores take a Memory.Memory, and go through its typed accessors.
+#
+# Registers always hold 32 bits, as a number from 0 to 0xFFFFFFFF, and
+# everything written back is masked to that.  Signed operations reinterpret
+# their operands explicitly: x ^ 0x80000000 puts signed numbers in unsigned
+# order for comparing, and (x ^ 0x80000000) - 0x80000000 is the signed value.
+# x0 is never written here, the Machine points writes to it at a spare
+# register instead (see Machine.ZERO_SINK).
+
+def addInt(registers, rd, rs1, rs2):
+    registers[rd] = (registers[rs1] + registers[rs2]) & 0xFFFFFFFF
+
+def addiInt(registers, rd, rs1, imm):
+    registers[rd] = (registers[rs1] + imm) & 0xFFFFFFFF
+
+def andInt(registers, rd, rs1, rs2):
+    registers[rd] = registers[rs1] & registers[rs2]
+
+def andiInt(registers, rd, rs1, imm):
+    registers[rd] = registers[rs1] & imm
+
+def auipcInt(registers, rd, imm):
+    registers[rd] = (registers[32] + (imm << 12)) & 0xFFFFFFFF
+
+def beqInt(registers, rs1, rs2, imm):
+    if registers[rs1] == registers[rs2]:
+        registers[32] = (registers[32] + imm) & 0xFFFFFFFF
+    else:
+        registers[32] = registers[32] + 4
+
+def bgeInt(registers, rs1, rs2, imm):
+    if registers[rs1] ^ 0x80000000 >= registers[rs2] ^ 0x80000000:
+        registers[32] = (registers[32] + imm) & 0xFFFFFFFF
+    else:
+        registers[32] = registers[32] + 4
+
+def bgeuInt(registers, rs1, rs2, imm):
+    if registers[rs1] >= registers[rs2]:
+        registers[32] = (registers[32] + imm) & 0xFFFFFFFF
+    else:
+        registers[32] = registers[32] + 4
+
+def bltInt(registers, rs1, rs2, imm):
+    if registers[rs1] ^ 0x80000000 < registers[rs2] ^ 0x80000000:
+        registers[32] = (registers[32] + imm) & 0xFFFFFFFF
+    else:
+        registers[32] = registers[32] + 4
+
+def bltuInt(registers, rs1, rs2, imm):
+    if registers[rs1] < registers[rs2]:
+        registers[32] = (registers[32] + imm) & 0xFFFFFFFF
+    else:
+        registers[32] = registers[32] + 4
+
+def bneInt(registers, rs1, rs2, imm):
+    if registers[rs1] != registers[rs2]:
+        registers[32] = (registers[32] + imm) & 0xFFFFFFFF
+    else:
+        registers[32] = registers[32] + 4
+
+# The counters are read only, so only the read half of CSRRS is done.
+# counters is the Machine, which knows their values.
+def csrrsInt(registers, counters, rd, rs1, csr):
+    registers[rd] = counters.readCsr(csr)
+
+def jalInt(registers, rd, imm):
+    registers[rd] = (registers[32] + 4) & 0xFFFFFFFF
+    registers[32] = (registers[32] + imm) & 0xFFFFFFFF
+
+def jalrInt(registers, rd, rs1, imm):
+    # The target is worked out first, since rd may be rs1.
+    target = (registers[rs1] + imm) & 0xFFFFFFFE
+    registers[rd] = (registers[32] + 4) & 0xFFFFFFFF
+    registers[32] = target
+
+def lbInt(registers, memory, rd, rs1, imm):
+    registers[rd] = ((memory.readU8((registers[rs1] + imm) & 0xFFFFFFFF) ^ 0x80) - 0x80) & 0xFFFFFFFF
+
+def lbuInt(registers, memory, rd, rs1, imm):
+    registers[rd] = memory.readU8((registers[rs1] + imm) & 0xFFFFFFFF)
+
+def lhInt(registers, memory, rd, rs1, imm):
+    registers[rd] = ((memory.readU16((registers[rs1] + imm) & 0xFFFFFFFF) ^ 0x8000) - 0x8000) & 0xFFFFFFFF
+
+def lhuInt(registers, memory, rd, rs1, imm):
+    registers[rd] = memory.readU16((registers[rs1] + imm) & 0xFFFFFFFF)
+
+def luiInt(registers, rd, imm):
+    registers[rd] = (imm << 12) & 0xFFFFFFFF
+
+def lwInt(registers, memory, rd, rs1, imm):
+    registers[rd] = memory.readU32((registers[rs1] + imm) & 0xFFFFFFFF)
+
+def orInt(registers, rd, rs1, rs2):
+    registers[rd] = registers[rs1] | registers[rs2]
+
+def oriInt(registers, rd, rs1, imm):
+    registers[rd] = (registers[rs1] | imm) & 0xFFFFFFFF
+
+def sbInt(registers, memory, rs1, rs2, imm):
+    memory.writeU8((registers[rs1] + imm) & 0xFFFFFFFF, registers[rs2])
+
+def shInt(registers, memory, rs1, rs2, imm):
+    memory.writeU16((registers[rs1] + imm) & 0xFFFFFFFF, registers[rs2])
+
+# Shifts only use the bottom 5 bits of the shift amount.
+def sllInt(registers, rd, rs1, rs2):
+    registers[rd] = (registers[rs1] << (registers[rs2] & 31)) & 0xFFFFFFFF
+
+def slliInt(registers, rd, rs1, imm):
+    registers[rd] = (registers[rs1] << (imm & 31)) & 0xFFFFFFFF
+
+def sltInt(registers, rd, rs1, rs2):
+    if registers[rs1] ^ 0x80000000 < registers[rs2] ^ 0x80000000:
+        registers[rd] = 1
+    else:
+        registers[rd] = 0
+
+def sltiInt(registers, rd, rs1, imm):
+    if (registers[rs1] ^ 0x80000000) - 0x80000000 < imm:
+        registers[rd] = 1
+    else:
+        registers[rd] = 0
+
+def sltiuInt(registers, rd, rs1, imm):
+    # The imm is sign-extended, then compared unsigned.
+    if registers[rs1] < imm & 0xFFFFFFFF:
+        registers[rd] = 1
+    else:
+        registers[rd] = 0
+
+def sltuInt(registers, rd, rs1, rs2):
+    if registers[rs1] < registers[rs2]:
+        registers[rd] = 1
+    else:
+        registers[rd] = 0
+
+def sraInt(registers, rd, rs1, rs2):
+    registers[rd] = (((registers[rs1] ^ 0x80000000) - 0x80000000) >> (registers[rs2] & 31)) & 0xFFFFFFFF
+
+def sraiInt(registers, rd, rs1, imm):
+    # The imm still has the funct7 in its top bits.
+    registers[rd] = (((registers[rs1] ^ 0x80000000) - 0x80000000) >> (imm & 31)) & 0xFFFFFFFF
+
+def srlInt(registers, rd, rs1, rs2):
+    registers[rd] = registers[rs1] >> (registers[rs2] & 31)
+
+def srliInt(registers, rd, rs1, imm):
+    registers[rd] = registers[rs1] >> (imm & 31)
+
+def subInt(registers, rd, rs1, rs2):
+    registers[rd] = (registers[rs1] - registers[rs2]) & 0xFFFFFFFF
+
+def swInt(registers, memory, rs1, rs2, imm):
+    memory.writeU32((registers[rs1] + imm) & 0xFFFFFFFF, registers[rs2])
+
+def xorInt(registers, rd, rs1, rs2):
+    registers[rd] = registers[rs1] ^ registers[rs2]
+
+def xoriInt(registers, rd, rs1, imm):
+    registers[rd] = (registers[rs1] ^ imm) & 0xFFFFFFFF
+
+def mulInt(registers, rd, rs1, rs2):
+    # Only use lower 32 bits in this instruction.
+    registers[rd] = (registers[rs1] * registers[rs2]) & 0xFFFFFFFF
+
+def mulhInt(registers, rd, rs1, rs2):
+    # Only use upper 32 bits in this instruction.
+    registers[rd] = ((((registers[rs1] ^ 0x80000000) - 0x80000000)
+                      * ((registers[rs2] ^ 0x80000000) - 0x80000000)) >> 32) & 0xFFFFFFFF
+
+def mulhsuInt(registers, rd, rs1, rs2):
+    registers[rd] = ((((registers[rs1] ^ 0x80000000) - 0x80000000) * registers[rs2]) >> 32) & 0xFFFFFFFF
+
+def mulhuInt(registers, rd, rs1, rs2):
+    registers[rd] = (registers[rs1] * registers[rs2]) >> 32
+
+def divInt(registers, rd, rs1, rs2):
+    registers[rd] = divide(registers[rs1], registers[rs2])
+
+def divuInt(registers, rd, rs1, rs2):
+    # Dividing by zero gives all ones.
+    if registers[rs2]:
+        registers[rd] = registers[rs1] // registers[rs2]
+    else:
+        registers[rd] = 0xFFFFFFFF
+
+def remInt(registers, rd, rs1, rs2):
+    registers[rd] = remainder(registers[rs1], registers[rs2])
+
+def remuInt(registers, rd, rs1, rs2):
+    # The remainder of dividing by zero is the dividend.
+    if registers[rs2]:
+        registers[rd] = registers[rs1] % registers[rs2]
+    else:
+        registers[rd] = registers[rs1]
+
+
+# Signed Division of two Registers
+def divide(dividend, divisor):
+    # Rounds towards zero.  Dividing by zero gives -1, and -2^31 / -1
+    # overflows back to -2^31.
+    if not divisor:
+        return 0xFFFFFFFF
+    dividend = (dividend ^ 0x80000000) - 0x80000000
+    divisor = (divisor ^ 0x80000000) - 0x80000000
+    quotient = abs(dividend) // abs(divisor)
+    if (dividend < 0) != (divisor < 0):
+        quotient = -quotient
+    return quotient & 0xFFFFFFFF
+
+# Signed Remainder of two Registers
+def remainder(dividend, divisor):
+    # Has the sign of the dividend.  The remainder of dividing by zero is
+    # the dividend.
+    if not divisor:
+        return dividend
+    dividend = (dividend ^ 0x80000000) - 0x80000000
+    result = abs(dividend) % abs((divisor ^ 0x80000000) - 0x80000000)
+    if dividend < 0:
+        result = -result
+    return result & 0xFFFFFFFF
@@ -0,0 +1,107 @@
+import mmap, struct
+
+# Program Loaders
+# Reads object files into memory.
+
+# ELF files start with these bytes, anything else is treated as Intel HEX.
+ELF_MAGIC = b'\x7fELF'
+# ELF32 little-endian header fields we need: e_ident, e_type, e_machine,
+# e_version, e_entry, e_phoff, e_shoff, e_flags, e_ehsize, e_phentsize, e_phnum
+ELF_HEADER = struct.Struct('<16sHHIIIIIHHH')
+# Program header: p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz,
+# p_flags, p_align
+PROGRAM_HEADER = struct.Struct('<IIIIIIII')
+EM_RISCV = 0xF3
+PT_LOAD = 1
+
+
+# Raised when an object file can't be loaded.
+class FormatError(ValueError):
+    pass
+
+
+# Load an Intel HEX Program
+def loadHex(text, memory, written=None):
+    # Each record is decoded to bytes in one go, checked by summing every
+    # byte (a valid record, checksum included, sums to 0 mod 256), and its
+    # data is copied into memory with a single slice assignment.
+    # Supports record types 00 (data), 01 (EOF) and 02 (extended address).
+    # written, if given, is a list that gets (address, length) of every
+    # record copied into memory.
+    currentExtend = 0
+    memorySize = len(memory)
+
+    for currentLine in text.splitlines():
+        # Skip anything that isn't a record.
+        currentLine = currentLine.strip()
+        if currentLine[:1] != ':':
+            continue
+        try:
+            record = bytes.fromhex(currentLine.lstrip(':'))
+        except ValueError:
+            raise FormatError('Record is not hex: ' + currentLine)
+
+        # byte count, 2 address bytes, record type, data, checksum
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise FormatError('Record has the wrong length: ' + currentLine)
+        if sum(record) & 0xFF:
+            raise FormatError('Checksum does not match: ' + currentLine)
+
+        recordType = record[3]
+        if recordType == 0x01:
+            break
+        elif recordType == 0x02:
+            currentExtend = (record[4] << 8) | record[5]
+        elif recordType != 0x00:
+            raise FormatError('Unknown record type: ' + currentLine)
+        else:
+            addressIndex = (currentExtend * 16) + ((record[1] << 8) | record[2])
+            if addressIndex + record[0] > memorySize:
+                raise FormatError('Record is outside of memory: ' + currentLine)
+            memory[addressIndex:addressIndex + record[0]] = record[4:-1]
+            if written is not None:
+                written.append((addressIndex, record[0]))
+
+
+# Load an ELF32 RISC-V Executable
+def loadElf(fileName, memory, written=None):
+    # The file is memory-mapped, and every PT_LOAD segment is copied
+    # straight into memory, with the rest of the segment past the file
+    # data (.bss) zeroed.  Returns the entry point, e_entry.  written is
+    # filled in like loadHex's, with each segment's .bss included.
+    with open(fileName, 'rb') as elfFile:
+        try:
+            image = mmap.mmap(elfFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise FormatError('File is empty: ' + fileName)
+    with image:
+        if len(image) < ELF_HEADER.size:
+            raise FormatError('File is too short for an ELF header: ' + fileName)
+        (ident, fileType, machine, version, entry, phoff, shoff, flags,
+         ehsize, phentsize, phnum) = ELF_HEADER.unpack_from(image, 0)
+        # EI_CLASS 1 is 32-bit, EI_DATA 1 is little-endian.
+        if ident[:4] != ELF_MAGIC or ident[4] != 1 or ident[5] != 1:
+            raise FormatError('Not a little-endian ELF32 file: ' + fileName)
+        if machine != EM_RISCV:
+            raise FormatError('Not a RISC-V executable: ' + fileName)
+        if phoff + phnum * phentsize > len(image) or (phnum and phentsize < PROGRAM_HEADER.size):
+            raise FormatError('Program headers are outside of the file: ' + fileName)
+
+        view = memoryview(image)
+        try:
+            for i in range(phnum):
+                (segmentType, offset, address, physicalAddress, fileSize, memorySize,
+                 segmentFlags, align) = PROGRAM_HEADER.unpack_from(image, phoff + i * phentsize)
+                if segmentType != PT_LOAD:
+                    continue
+                if offset + fileSize > len(image) or fileSize > memorySize:
+                    raise FormatError('Segment is outside of the file: ' + fileName)
+                if address + memorySize > len(memory):
+                    raise FormatError('Segment is outside of memory: ' + fileName)
+                memory[address:address + fileSize] = view[offset:offset + fileSize]
+                memory[address + fileSize:address + memorySize] = bytes(memorySize - fileSize)
+                if written is not None:
+                    written.append((address, memorySize))
+        finally:
+            view.release()
+    return entry
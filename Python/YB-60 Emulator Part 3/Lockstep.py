@@ -0,0 +1,418 @@
+import Decoder, Machine
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Lockstep Execution
+# Runs the same program on many machines ("lanes") at once, for jobs like
+# running collatz.obj over thousands of starting values.  The lanes' register
+# files are the rows of one 2-D array and their memories the rows of
+# another, and every lane at the same PC runs that instruction together as a
+# handful of NumPy operations.
+#
+# Lanes at different PCs (after a branch goes different ways) are kept in
+# groups by PC, and the group with the lowest PC always runs next, which is
+# usually where diverged lanes meet up again.  A lane leaves lockstep and
+# carries on as its own scalar Machine when:
+#   - its lanes have drifted into more than maxGroups different PCs,
+#   - it would touch memory outside of the memory, so the scalar machine
+#     raises the error,
+#   - it stores into code that has already been run, or runs code that isn't
+#     the same in every lane,
+#   - it reads the counters with a CSR instruction.
+# Either way every lane ends up in the same state runProgram would leave it.
+#
+# Without NumPy every lane is simply its own scalar Machine.
+
+# How many different PCs the lanes can be spread over before the smallest
+# groups are sent off to run one at a time.
+MAX_GROUPS = 16
+MASK = 0xFFFFFFFF
+LOAD_SIZES = {'LB': 1, 'LBU': 1, 'LH': 2, 'LHU': 2, 'LW': 4}
+STORE_SIZES = {'SB': 1, 'SH': 2, 'SW': 4}
+
+
+# Run a Program over many Inputs
+def runLockstep(fileName, inputs, startAddress=None, budget=None):
+    # inputs holds one list of (address, data) patches per lane.  Returns
+    # the Lockstep after the run, with lockstep.counts holding how many
+    # instructions each lane ran.
+    lockstep = Lockstep(len(inputs))
+    lockstep.load(fileName)
+    for lane, patches in enumerate(inputs):
+        for address, data in patches:
+            lockstep.patch(lane, address, data)
+    lockstep.run(startAddress, budget)
+    return lockstep
+
+
+# Lockstep Machines
+class Lockstep:
+
+    def __init__(self, lanes, memorySize=Machine.MEMORY_SIZE, maxGroups=MAX_GROUPS):
+        self.lanes = lanes
+        self.memorySize = memorySize
+        self.maxGroups = maxGroups
+        self.entryPoint = 0
+        self.counts = [0] * lanes
+        # Lanes that are run by their own scalar Machine, by lane number.
+        self.machines = {}
+        # Exceptions raised by lanes (like reading outside of memory), by
+        # lane number.  Those lanes stop where the exception happened.
+        self.errors = {}
+        if numpy is not None:
+            # Column 32 of the registers is the PC, like Machine.registers.
+            # Registers are 32 bits, so uint32 arithmetic wraps around the
+            # same way the Machine's masking does.
+            self.registers = numpy.zeros((lanes, Machine.REGISTER_COUNT), dtype=numpy.uint32)
+            self.memory = numpy.zeros((lanes, memorySize), dtype=numpy.uint8)
+        else:
+            self.registers = None
+            self.memory = None
+            for lane in range(lanes):
+                self.machines[lane] = Machine.Machine(memorySize)
+
+    # Load the same Object File into every Lane
+    def load(self, fileName):
+        machine = Machine.Machine(self.memorySize)
+        machine.load(fileName)
+        self.entryPoint = machine.entryPoint
+        if self.memory is not None:
+            self.memory[:] = numpy.frombuffer(machine.memory, dtype=numpy.uint8)
+        else:
+            for lane in self.machines:
+                self.machines[lane].edit(0, machine.memory)
+
+    # Write Bytes into one Lane's Memory
+    def patch(self, lane, address, data):
+        if self.memory is not None:
+            self.memory[lane, address:address + len(data)] = numpy.frombuffer(bytes(data), dtype=numpy.uint8)
+        else:
+            self.machines[lane].edit(address, data)
+
+    # A Lane's Registers, x0 to x31 then the PC
+    def laneRegisters(self, lane):
+        if lane in self.machines:
+            return self.machines[lane].registers[:Machine.REGISTER_COUNT]
+        return self.registers[lane].tolist()
+
+    # A Lane's Memory
+    def laneMemory(self, lane):
+        if self.memory is not None:
+            return self.memory[lane].tobytes()
+        return bytes(self.machines[lane].memory)
+
+    # Run every Lane
+    def run(self, startAddress=None, budget=None):
+        # Clears the registers and runs every lane from startAddress (the
+        # entry point if None) until it stops or has run budget
+        # instructions.  Returns the instruction count of each lane.
+        if startAddress is None:
+            startAddress = self.entryPoint
+        self.errors = {}
+        if self.memory is None:
+            for lane, machine in self.machines.items():
+                try:
+                    machine.runTranslated(startAddress, budget)
+                except Exception as error:
+                    self.errors[lane] = error
+                finally:
+                    # retired still counts the instructions before an error.
+                    self.counts[lane] = machine.retired
+            return self.counts
+
+        self.machines = {}
+        registers = self.registers
+        registers[:] = 0
+        registers[:, 2] = self.memorySize - 1
+        registers[:, 32] = startAddress
+        counts, ejected = self.runVector(startAddress, budget)
+        self.counts = counts.tolist()
+
+        # Finish the lanes that left lockstep one at a time.
+        for lane in ejected:
+            machine = Machine.Machine(self.memorySize)
+            machine.memory[:] = self.memory[lane].tobytes()
+            machine.registers[:Machine.REGISTER_COUNT] = registers[lane].tolist()
+            machine.retired = self.counts[lane]
+            remaining = None if budget is None else budget - self.counts[lane]
+            try:
+                machine.resume(remaining)
+            except Exception as error:
+                self.errors[lane] = error
+            finally:
+                # The machine started from the lane's count, and retired
+                # still counts the instructions before an error.
+                self.counts[lane] = machine.retired
+            self.memory[lane] = numpy.frombuffer(machine.memory, dtype=numpy.uint8)
+            self.machines[lane] = machine
+        return self.counts
+
+    # Run the Lanes in Lockstep
+    def runVector(self, startAddress, budget):
+        # Returns the instruction count of every lane, and the lanes that
+        # have to be finished by a scalar Machine.  Each lane's PC is left
+        # in its registers.
+        registers = self.registers
+        memory = self.memory
+        end = self.memorySize
+        counts = numpy.zeros(self.lanes, dtype=numpy.int64)
+        ejected = []
+
+        # Words that aren't the same in every lane, which are checked lane
+        # by lane before they are run, and words that have been run, which
+        # a lane can't store into without leaving lockstep.
+        words = (end >> 2) + 2
+        varies = numpy.zeros(words * 4, dtype=bool)
+        for lane in range(1, self.lanes):
+            varies[:end] |= memory[lane] != memory[0]
+        variesWord = varies.reshape(words, 4).any(axis=1)
+        isCode = numpy.zeros(words, dtype=bool)
+        decodedAt = {}
+
+        # Lanes waiting to run, by the PC they are at.
+        groups = {startAddress: numpy.arange(self.lanes)}
+
+        while groups:
+            if len(groups) > self.maxGroups:
+                # Too far apart, send the smallest groups off on their own.
+                bySize = sorted(groups, key=lambda pc: len(groups[pc]))
+                for pc in bySize[:len(groups) - self.maxGroups]:
+                    ejected.extend(groups.pop(pc).tolist())
+
+            pc = min(groups)
+            lanes = groups.pop(pc)
+            if budget is not None:
+                lanes = lanes[counts[lanes] < budget]
+            if pc == end or lanes.size == 0:
+                # Ran off the end of memory, or out of budget.
+                continue
+            if pc < 0 or pc > end - 4:
+                ejected.extend(lanes.tolist())
+                continue
+
+            # Decode the instruction, and check it is the same in every lane
+            # if it might not be.
+            if variesWord[pc >> 2] or variesWord[(pc + 3) >> 2]:
+                words = self.fetchWords(lanes, pc)
+                word = int(words[0])
+                same = words == word
+                if not same.all():
+                    ejected.extend(lanes[~same].tolist())
+                    lanes = lanes[same]
+                info = (word, Decoder.decode(word))
+            else:
+                info = decodedAt.get(pc)
+                if info is None:
+                    word = int(self.fetchWords(lanes[:1], pc)[0])
+                    info = (word, Decoder.decode(word))
+                    decodedAt[pc] = info
+            isCode[pc >> 2] = True
+            isCode[(pc + 3) >> 2] = True
+
+            decoded = info[1]
+            if decoded is None:
+                # EBREAK or an instruction we can't decode, either way we stop.
+                continue
+            if decoded[0][3] == Decoder.CSR_KIND:
+                # The counters are read one lane at a time.
+                ejected.extend(lanes.tolist())
+                continue
+            lanes, nextPC = self.execute(lanes, pc, decoded, variesWord, isCode, ejected)
+            if lanes.size == 0:
+                continue
+            counts[lanes] += 1
+            registers[lanes, 32] = nextPC
+
+            # Put the lanes back in the group for their new PC.
+            if isinstance(nextPC, int):
+                targets = ((nextPC, lanes),)
+            else:
+                targets = ((int(target), lanes[nextPC == target]) for target in numpy.unique(nextPC))
+            for target, group in targets:
+                waiting = groups.get(target)
+                groups[target] = group if waiting is None else numpy.concatenate((waiting, group))
+        return counts, ejected
+
+    # Fetch the Word at an Address in some Lanes
+    def fetchWords(self, lanes, address):
+        memory = self.memory
+        return (memory[lanes, address].astype(numpy.int64) | (memory[lanes, address + 1].astype(numpy.int64) << 8)
+                | (memory[lanes, address + 2].astype(numpy.int64) << 16)
+                | (memory[lanes, address + 3].astype(numpy.int64) << 24))
+
+    # Run one Instruction in some Lanes
+    def execute(self, lanes, pc, decoded, variesWord, isCode, ejected):
+        # Returns the lanes that ran it, and their next PC, which is an int
+        # if it is the same for all of them.  Lanes that can't run it in
+        # lockstep are added to ejected before anything is changed.
+        # Signed operations view the registers as int32, and the multiplies
+        # and divides work in int64, which holds any product of two 32 bit
+        # values.
+        registers = self.registers
+        memory = self.memory
+        entry, rd, rs1, rs2, imm = decoded
+        mnemonic = entry[0]
+        format = entry[1]
+        a = registers[lanes, rs1]
+        uimm = numpy.uint32(imm & MASK)
+        nextPC = pc + 4
+        value = None
+        bad = None
+
+        if format == Decoder.R_FORMAT:
+            b = registers[lanes, rs2]
+            if mnemonic == 'ADD':
+                value = a + b
+            elif mnemonic == 'SUB':
+                value = a - b
+            elif mnemonic == 'AND':
+                value = a & b
+            elif mnemonic == 'OR':
+                value = a | b
+            elif mnemonic == 'XOR':
+                value = a ^ b
+            elif mnemonic == 'SLL':
+                value = a << (b & 31)
+            elif mnemonic == 'SRL':
+                value = a >> (b & 31)
+            elif mnemonic == 'SRA':
+                value = (a.view(numpy.int32) >> (b & 31).astype(numpy.int32)).view(numpy.uint32)
+            elif mnemonic == 'SLT':
+                value = (a.view(numpy.int32) < b.view(numpy.int32)).astype(numpy.uint32)
+            elif mnemonic == 'SLTU':
+                value = (a < b).astype(numpy.uint32)
+            elif mnemonic == 'MUL':
+                value = a * b
+            elif mnemonic == 'MULHU':
+                value = ((a.astype(numpy.uint64) * b.astype(numpy.uint64)) >> 32).astype(numpy.uint32)
+            elif mnemonic.startswith('MULH'):
+                # MULH and MULHSU, where only MULHSU's rs2 is unsigned.
+                signedA = a.view(numpy.int32).astype(numpy.int64)
+                signedB = b.view(numpy.int32).astype(numpy.int64) if mnemonic == 'MULH' else b.astype(numpy.int64)
+                value = ((signedA * signedB) >> 32).astype(numpy.uint32)
+            elif mnemonic == 'DIVU' or mnemonic == 'REMU':
+                zero = b == 0
+                safe = numpy.where(zero, 1, b)
+                if mnemonic == 'DIVU':
+                    value = numpy.where(zero, numpy.uint32(MASK), a // safe)
+                else:
+                    value = numpy.where(zero, a, a % safe)
+            else:
+                # DIV and REM round towards zero, which NumPy's // and %
+                # don't, so they work on the sizes and put the sign back.
+                signedA = a.view(numpy.int32).astype(numpy.int64)
+                signedB = b.view(numpy.int32).astype(numpy.int64)
+                zero = signedB == 0
+                sizeA = numpy.abs(signedA)
+                sizeB = numpy.abs(numpy.where(zero, 1, signedB))
+                if mnemonic == 'DIV':
+                    value = numpy.where((signedA < 0) != (signedB < 0), -(sizeA // sizeB), sizeA // sizeB)
+                    value = numpy.where(zero, -1, value)
+                else:
+                    value = numpy.where(signedA < 0, -(sizeA % sizeB), sizeA % sizeB)
+                    value = numpy.where(zero, signedA, value)
+                value = (value & MASK).astype(numpy.uint32)
+
+        elif mnemonic in LOAD_SIZES:
+            size = LOAD_SIZES[mnemonic]
+            address = (a + uimm).astype(numpy.int64)
+            bad = address > self.memorySize - size
+            address = numpy.where(bad, 0, address)
+            value = memory[lanes, address].astype(numpy.int64)
+            for i in range(1, size):
+                value |= memory[lanes, address + i].astype(numpy.int64) << (8 * i)
+            if mnemonic == 'LB':
+                value = ((value ^ 0x80) - 0x80) & MASK
+            elif mnemonic == 'LH':
+                value = ((value ^ 0x8000) - 0x8000) & MASK
+            value = value.astype(numpy.uint32)
+
+        elif format == Decoder.S_FORMAT:
+            size = STORE_SIZES[mnemonic]
+            address = (a + uimm).astype(numpy.int64)
+            bad = address > self.memorySize - size
+            safe = numpy.where(bad, 0, address)
+            bad |= isCode[safe >> 2] | isCode[(safe + size - 1) >> 2]
+            if bad.any():
+                ejected.extend(lanes[bad].tolist())
+                lanes = lanes[~bad]
+                safe = safe[~bad]
+            b = registers[lanes, rs2]
+            for i in range(size):
+                memory[lanes, safe + i] = ((b >> (8 * i)) & 0xFF).astype(numpy.uint8)
+            variesWord[safe >> 2] = True
+            variesWord[(safe + size - 1) >> 2] = True
+            return lanes, nextPC
+
+        elif format == Decoder.SB_FORMAT:
+            b = registers[lanes, rs2]
+            if mnemonic == 'BLT' or mnemonic == 'BGE':
+                a = a.view(numpy.int32)
+                b = b.view(numpy.int32)
+            if mnemonic == 'BEQ':
+                taken = a == b
+            elif mnemonic == 'BNE':
+                taken = a != b
+            elif mnemonic == 'BLT' or mnemonic == 'BLTU':
+                taken = a < b
+            else:
+                taken = a >= b
+            target = (pc + imm) & MASK
+            if taken.all():
+                nextPC = target
+            elif taken.any():
+                nextPC = numpy.where(taken, target, pc + 4)
+            return lanes, nextPC
+
+        elif mnemonic == 'JAL':
+            if rd:
+                registers[lanes, rd] = (pc + 4) & MASK
+            return lanes, (pc + imm) & MASK
+
+        elif mnemonic == 'JALR':
+            # The target first, since rd may be rs1.
+            nextPC = (a + uimm) & numpy.uint32(0xFFFFFFFE)
+            if rd:
+                registers[lanes, rd] = (pc + 4) & MASK
+            if (nextPC == nextPC[0]).all():
+                nextPC = int(nextPC[0])
+            return lanes, nextPC
+
+        elif mnemonic == 'LUI':
+            value = numpy.full(lanes.size, (imm << 12) & MASK, dtype=numpy.uint32)
+        elif mnemonic == 'AUIPC':
+            value = numpy.full(lanes.size, (pc + (imm << 12)) & MASK, dtype=numpy.uint32)
+
+        else:
+            # The rest of the I format instructions.
+            if mnemonic == 'ADDI':
+                value = a + uimm
+            elif mnemonic == 'ANDI':
+                value = a & uimm
+            elif mnemonic == 'ORI':
+                value = a | uimm
+            elif mnemonic == 'XORI':
+                value = a ^ uimm
+            elif mnemonic == 'SLTI':
+                value = (a.view(numpy.int32) < numpy.int32(imm)).astype(numpy.uint32)
+            elif mnemonic == 'SLTIU':
+                value = (a < uimm).astype(numpy.uint32)
+            elif mnemonic == 'SLLI':
+                value = a << numpy.uint32(imm & 31)
+            elif mnemonic == 'SRLI':
+                value = a >> numpy.uint32(imm & 31)
+            else:
+                # SRAI, where the imm still has its funct7.
+                value = (a.view(numpy.int32) >> numpy.int32(imm & 31)).view(numpy.uint32)
+
+        if bad is not None and bad.any():
+            ejected.extend(lanes[bad].tolist())
+            lanes = lanes[~bad]
+            value = value[~bad]
+        # Writes to x0 are thrown away.
+        if rd:
+            registers[lanes, rd] = value
+        return lanes, nextPC
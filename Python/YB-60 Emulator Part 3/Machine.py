@@ -0,0 +1,513 @@
+import os, time
+import Instructions, Decoder, Disassembler, Analysis, Translator, Trace, Loader, Memory
+
+# YB-60 Machine
+# Everything one emulated YB-60 needs lives in a Machine: its registers,
+# memory, entry point and the caches built from that memory.  Nothing is
+# shared between machines, so any number of them can be run side by side,
+# from threads, or from a process pool.
+
+# 1 MB of memory.
+MEMORY_SIZE = 1048576
+# Number of bytes written by each store, for invalidating the decode cache.
+STORE_SIZES = {Instructions.sbInt: 1, Instructions.shInt: 2, Instructions.swInt: 4}
+# Number of bytes read by each load, for watchpoints and the cache simulator.
+LOAD_SIZES = {Instructions.lbInt: 1, Instructions.lbuInt: 1, Instructions.lhInt: 2, Instructions.lhuInt: 2,
+              Instructions.lwInt: 4}
+# Registers are x0 to x31 then the PC.  Writes to x0 are pointed at one more
+# register past those, ZERO_SINK, when they are decoded, so x0 always reads
+# 0 without the instructions checking for it.
+REGISTER_COUNT = 33
+ZERO_SINK = 33
+# Counter CSRs, for rdcycle, rdtime and rdinstret.  Adding CSR_HIGH gives
+# the CSR for their top 32 bits.
+CSR_CYCLE = 0xC00
+CSR_TIME = 0xC01
+CSR_INSTRET = 0xC02
+CSR_HIGH = 0x080
+# Runs with a time limit or progress reports look at the clock after this
+# many instructions when tracing, and TRANSLATED_CHECK_INTERVAL without.
+CHECK_INTERVAL = 10000
+TRANSLATED_CHECK_INTERVAL = 100000
+# Seconds between progress reports.
+PROGRESS_INTERVAL = 1.0
+
+
+# Read the Memory Options from the Environment
+def memoryOptions():
+    # YB60_MEMORY_SIZE sets the memory size (hex with 0x), and
+    # YB60_PAGED_MEMORY=1 makes the memory paged, which it has to be for
+    # sizes up to the whole 32-bit address space, 0x100000000.  Returns the
+    # keyword arguments for Machine.
+    options = {}
+    size = os.environ.get('YB60_MEMORY_SIZE')
+    if size:
+        options['memorySize'] = int(size, 0)
+    if os.environ.get('YB60_PAGED_MEMORY', '') not in ('', '0'):
+        options['paged'] = True
+    return options
+
+
+# Run Clock
+# Watches the wall-clock time of a run, for its time limit and progress
+# reports.  progress(instructions, seconds) is called about every interval
+# seconds.
+class RunClock:
+    __slots__ = ('startTime', 'deadline', 'progress', 'interval', 'nextReport')
+
+    def __init__(self, timeLimit=None, progress=None, interval=PROGRESS_INTERVAL):
+        self.startTime = time.perf_counter()
+        self.deadline = None if timeLimit is None else self.startTime + timeLimit
+        self.progress = progress
+        self.interval = interval
+        self.nextReport = self.startTime + interval
+
+    # Whether there is anything to watch the clock for
+    def active(self):
+        return self.deadline is not None or self.progress is not None
+
+    # Check the Clock, returns False once the time limit has passed
+    def check(self, count):
+        now = time.perf_counter()
+        if self.progress is not None and now >= self.nextReport:
+            self.progress(count, now - self.startTime)
+            self.nextReport = now + self.interval
+        return self.deadline is None or now < self.deadline
+
+
+class Machine:
+    __slots__ = ('registers', 'memory', 'bus', 'entryPoint', 'decodeCache', 'translator', 'imageCache', 'lastSave',
+                 'retired', 'timedOut', 'analyses')
+
+    def __init__(self, memorySize=MEMORY_SIZE, imageCache=None, strictAlignment=False, paged=False):
+        # 33 registers, index 0 -> x0, index 1 -> x1, ... , index 31 -> x31,
+        # index 32 -> pc, then the ZERO_SINK.  Each holds 32 bits, from 0 to
+        # 0xFFFFFFFF.  The memory starts as all 0's.
+        self.registers = [0] * (REGISTER_COUNT + 1)
+        # Instructions load, store and fetch through the bus, which checks
+        # every access.  strictAlignment makes misaligned accesses an error.
+        # memory is a bytearray, or with paged on a Memory.PagedMemory that
+        # is both the memory and the bus, and can be indexed and sliced the
+        # same way.
+        if paged:
+            self.memory = Memory.PagedMemory(memorySize, strictAlignment)
+            self.bus = self.memory
+        else:
+            self.memory = bytearray(memorySize)
+            self.bus = Memory.Memory(self.memory, strictAlignment)
+        # Where commands start when no address is given, set by ELF files.
+        self.entryPoint = 0
+        # Decode Cache
+        # Maps a PC to its decoded instruction record, so each instruction
+        # word is only fetched and decoded the first time it is reached.  A
+        # record is (kind, handler, args, rs1, imm, info): the kind tells the
+        # run loop how to update the PC, the handler is called with args,
+        # rs1/imm are the integer store address operands, and info is
+        # (word, decoded) for the trace.
+        self.decodeCache = {}
+        # Translated blocks, for running without a trace.
+        self.translator = Translator.BlockTranslator(self.bus, self.invalidateDecodeCache)
+        # Control-flow graphs of the loaded image by entry point, built the
+        # first time they are asked for.  Loading, or writing over any code
+        # in a graph, throws it away.
+        self.analyses = {}
+        # Cache of parsed object files, or None to always parse them.
+        self.imageCache = imageCache
+        # (file name, state id, memory checkpoint) of the last save state
+        # saved or loaded, which the next save is a delta against.
+        self.lastSave = None
+        # Instructions retired since the registers were cleared, which the
+        # run loops only bring up to date when they finish or a CSR reads
+        # it.  Every instruction takes one cycle, so it is the cycle count
+        # too.  timedOut says the last run stopped at its time limit.
+        self.retired = 0
+        self.timedOut = False
+
+    # Clear Registers before Running Program
+    def clearRegisters(self):
+        registers = self.registers
+        for i in range(len(registers)):
+            registers[i] = 0
+        # The stack pointer starts at the top of memory.
+        registers[2] = len(self.memory) - 1
+        # Count misaligned accesses and instructions from the start of each
+        # run.
+        self.bus.misaligned = 0
+        self.retired = 0
+        self.timedOut = False
+
+    # Load an Object File
+    def load(self, fileName):
+        # ELF executables are picked out by their magic bytes, anything else
+        # is read as Intel HEX.  With an image cache, a file that has been
+        # loaded before is copied straight from its cached image instead.
+        # Raises Loader.FormatError if the file can't be loaded.
+        # The loaders write straight into memory, so what they wrote is
+        # passed on to the bus for its checkpoints.
+        key = None
+        written = []
+        if self.imageCache is not None:
+            key = self.imageCache.keyFor(fileName, len(self.memory))
+            image = self.imageCache.load(key, self.memory, written)
+            for address, length in written:
+                self.bus.markWritten(address, length)
+            if image is not None:
+                self.entryPoint, predecoded = image
+                self.registers[32] = self.entryPoint
+                self.decodeCache.clear()
+                self.translator.clear()
+                self.analyses.clear()
+                for pc, word, decoded in predecoded:
+                    self.decodeCache[pc] = self.buildRecord(word, decoded)
+                return
+
+        # The image is made from what the loader wrote too, not from
+        # memory, which may still hold an earlier program.  A file that
+        # fails part way through has still written its first records.
+        with open(fileName, 'rb') as objectFile:
+            magic = objectFile.read(len(Loader.ELF_MAGIC))
+        try:
+            if magic == Loader.ELF_MAGIC:
+                self.entryPoint = Loader.loadElf(fileName, self.memory, written)
+                self.registers[32] = self.entryPoint
+            else:
+                with open(fileName, 'r') as objectFile:
+                    Loader.loadHex(objectFile.read(), self.memory, written)
+                # Intel HEX has no entry point, so one from an earlier ELF
+                # file mustn't carry over.  Cached images keep this one too.
+                self.entryPoint = 0
+                self.registers[32] = self.entryPoint
+        finally:
+            for address, length in written:
+                self.bus.markWritten(address, length)
+        # Anything decoded before the load is stale now.
+        self.decodeCache.clear()
+        self.translator.clear()
+        self.analyses.clear()
+
+        if key is not None:
+            self.imageCache.store(key, self.memory, self.entryPoint, written)
+
+    # Fetch the 4 byte Instruction at an Address
+    def fetchWord(self, address):
+        return self.bus.fetch(address)
+
+    # Decode the Instruction at a PC into the Decode Cache
+    def decodeInstruction(self, pc):
+        opcode = self.fetchWord(pc)
+        record = self.buildRecord(opcode, Decoder.decode(opcode))
+        self.decodeCache[pc] = record
+        return record
+
+    # Build the Decode Cache Record for a Decoded Instruction
+    def buildRecord(self, opcode, decoded):
+        info = (opcode, decoded)
+        registers = self.registers
+
+        if decoded is None:
+            # EBREAK, or anything we couldn't match, which would never move
+            # the PC.  Either way we stop there.
+            return (Decoder.STOP_KIND, None, (), 0, 0, info)
+        entry, rd, rs1, rs2, imm = decoded
+        inst, format, handler, kind, signed = entry
+        if rd == 0:
+            rd = ZERO_SINK
+        if format == Decoder.R_FORMAT:
+            args = (registers, rd, rs1, rs2)
+        elif format == Decoder.SB_FORMAT:
+            args = (registers, rs1, rs2, imm)
+        elif format == Decoder.U_FORMAT or format == Decoder.UJ_FORMAT:
+            args = (registers, rd, imm)
+        elif format == Decoder.S_FORMAT:
+            args = (registers, self.bus, rs1, rs2, imm)
+        elif kind == Decoder.CSR_KIND:
+            # CSR instructions read the counters from the machine.
+            args = (registers, self, rd, rs1, imm)
+        elif inst[0] == 'L':
+            # Loads are the only I format instructions that need memory.
+            args = (registers, self.bus, rd, rs1, imm)
+        else:
+            args = (registers, rd, rs1, imm)
+        return (kind, handler, args, rs1, imm, info)
+
+    # Remove Decoded Instructions that overlap Changed Memory
+    def invalidateDecodeCache(self, address, length):
+        # An instruction starting up to 3 bytes before the address still
+        # contains the changed bytes.
+        decodeCache = self.decodeCache
+        if length + 3 > len(decodeCache):
+            # Fewer records than addresses, so check the records instead.
+            for pc in [pc for pc in decodeCache if address - 3 <= pc < address + length]:
+                del decodeCache[pc]
+        else:
+            for pc in range(address - 3, address + length):
+                decodeCache.pop(pc, None)
+        if self.translator.code:
+            self.translator.invalidate(address - 3, length + 3)
+        if self.analyses:
+            for entry in [entry for entry, graph in self.analyses.items() if graph.overlaps(address, length)]:
+                del self.analyses[entry]
+
+    # Write Bytes into Memory
+    def edit(self, address, data):
+        if address < 0 or address + len(data) > len(self.memory):
+            raise Memory.MemoryAccessError(address, len(data), 'write', 'Out of range')
+        self.memory[address:address + len(data)] = data
+        self.bus.markWritten(address, len(data))
+        self.invalidateDecodeCache(address, len(data))
+
+    # Read a Counter CSR
+    def readCsr(self, csr):
+        # cycle, time and instret all count retired instructions.  CSRs we
+        # don't have read as 0.
+        if csr & ~CSR_HIGH in (CSR_CYCLE, CSR_TIME, CSR_INSTRET):
+            if csr & CSR_HIGH:
+                return (self.retired >> 32) & 0xFFFFFFFF
+            return self.retired & 0xFFFFFFFF
+        return 0
+
+    # Take a Checkpoint
+    def checkpoint(self):
+        # Returns a checkpoint of the memory, registers and entry point to
+        # go back to with restore.  Taking one after loading a program means
+        # it can be run again and again without loading it again.  With a
+        # flat memory (the default) this copies all of memory, where a paged
+        # memory only copies its page table.
+        return (self.bus.checkpoint(), list(self.registers), self.entryPoint)
+
+    # Go back to a Checkpoint
+    def restore(self, checkpoint):
+        # Going back to the latest checkpoint only costs as much as the
+        # pages written since it was taken.  With a flat memory, going back
+        # to an older one (say after SaveState.save took a newer one)
+        # compares every page, so it costs as much as the memory is big.  A
+        # paged memory keeps that cheap too.  Anything decoded from the
+        # pages put back is thrown away, since it may have been decoded
+        # from what was written.
+        memoryCheckpoint, registers, self.entryPoint = checkpoint
+        self.registers[:] = registers
+        for address in self.bus.restore(memoryCheckpoint):
+            self.invalidateDecodeCache(address, Memory.PAGE_SIZE)
+
+    # Execute the Instruction at the PC
+    def step(self, sink):
+        # Runs a single instruction, sending it to the trace sink.
+        # Returns False once the program has stopped.
+        registers = self.registers
+        pc = registers[32]
+        record = self.decodeCache.get(pc)
+        if record is None:
+            record = self.decodeInstruction(pc)
+        kind = record[0]
+        if kind == Decoder.STOP_KIND:
+            sink.emit(pc, record[5], registers)
+            return False
+        if kind == Decoder.STORE_KIND:
+            storeAddress = (registers[record[3]] + record[4]) & 0xFFFFFFFF
+        record[1](*record[2])
+        sink.emit(pc, record[5], registers)
+        if kind == Decoder.STORE_KIND:
+            self.invalidateDecodeCache(storeAddress, STORE_SIZES[record[1]])
+        if kind != Decoder.JUMP_KIND:
+            registers[32] = pc + 4
+        self.retired += 1
+        return True
+
+    # Run a Program
+    def run(self, startAddress, sink=None, budget=None, timeLimit=None, progress=None):
+        # Clears the registers and runs from startAddress until an EBREAK,
+        # an instruction we can't decode, the end of memory, budget
+        # instructions or timeLimit seconds, sending every executed
+        # instruction to the trace sink (the screen if None).  progress is
+        # called with the instruction count and seconds so far about every
+        # PROGRESS_INTERVAL.  Returns how many instructions were run.
+        # Every instruction is only decoded the first time its PC is
+        # reached, after that the record in the decode cache is executed
+        # directly.
+        self.clearRegisters()
+        registers = self.registers
+        registers[32] = startAddress
+        if sink is None:
+            sink = Trace.TextTraceSink()
+        emit = sink.emit
+        decodeCache = self.decodeCache
+        end = len(self.memory)
+        if budget is None:
+            budget = -1
+        # The clock is only looked at every CHECK_INTERVAL instructions, and
+        # never if there is no time limit or progress to report.
+        clock = RunClock(timeLimit, progress)
+        checkAt = CHECK_INTERVAL if clock.active() else -1
+        count = 0
+        sink.start()
+
+        try:
+            while registers[32] != end and count != budget:
+                if count == checkAt:
+                    if not clock.check(count):
+                        self.timedOut = True
+                        break
+                    checkAt += CHECK_INTERVAL
+                pc = registers[32]
+                record = decodeCache.get(pc)
+                if record is None:
+                    record = self.decodeInstruction(pc)
+                kind = record[0]
+
+                if kind == Decoder.NEXT_KIND:
+                    record[1](*record[2])
+                    emit(pc, record[5], registers)
+                    registers[32] = pc + 4
+                elif kind == Decoder.JUMP_KIND:
+                    # Branches and jumps update the PC themselves.
+                    record[1](*record[2])
+                    emit(pc, record[5], registers)
+                elif kind == Decoder.STORE_KIND:
+                    # The store may have written over an instruction we
+                    # already decoded, so throw that record away before
+                    # moving on.
+                    storeAddress = (registers[record[3]] + record[4]) & 0xFFFFFFFF
+                    record[1](*record[2])
+                    emit(pc, record[5], registers)
+                    self.invalidateDecodeCache(storeAddress, STORE_SIZES[record[1]])
+                    registers[32] = pc + 4
+                elif kind == Decoder.CSR_KIND:
+                    self.retired = count
+                    record[1](*record[2])
+                    emit(pc, record[5], registers)
+                    registers[32] = pc + 4
+                else:
+                    # EBREAK or an instruction we can't decode, either way
+                    # we stop.
+                    emit(pc, record[5], registers)
+                    break
+                count += 1
+        finally:
+            self.retired = count
+            sink.close()
+        return count
+
+    # Run a Program with the Block Translator
+    def runTranslated(self, startAddress, budget=None, timeLimit=None, progress=None):
+        # Runs from startAddress without a trace, using compiled basic
+        # blocks instead of the decode cache.  Stops like run does, and
+        # returns how many instructions were run.
+        self.clearRegisters()
+        self.registers[32] = startAddress
+        return self.resume(budget, timeLimit, progress)
+
+    # Carry on Running with the Block Translator
+    def resume(self, budget=None, timeLimit=None, progress=None, stops=None):
+        # Like runTranslated, but carries on from the registers and counters
+        # as they are, for a machine loaded from a save state.  With stops,
+        # a set of PCs the translator was given with setStops, it also stops
+        # when it gets to one of them, after running at least one
+        # instruction.
+        # The translator stops before CSR instructions, which are run here
+        # with the counters brought up to date.  With a time limit or
+        # progress reports, the translator is run TRANSLATED_CHECK_INTERVAL
+        # instructions at a time, with a look at the clock in between.
+        registers = self.registers
+        end = len(self.memory)
+        clock = RunClock(timeLimit, progress)
+        chunk = TRANSLATED_CHECK_INTERVAL if clock.active() else None
+        retired = self.retired
+        self.timedOut = False
+        count = 0
+        try:
+            while True:
+                limit = None if budget is None else budget - count
+                if limit is not None and limit <= 0:
+                    break
+                chunked = chunk is not None and (limit is None or limit > chunk)
+                if chunked:
+                    limit = chunk
+                if stops:
+                    executed = self.translator.runUntil(registers, limit, stops)
+                    if executed and registers[32] in stops:
+                        count += executed
+                        break
+                else:
+                    executed = self.translator.run(registers, limit)
+                count += executed
+                if chunked and executed == limit:
+                    if not clock.check(count):
+                        self.timedOut = True
+                        break
+                    continue
+
+                pc = registers[32]
+                if pc == end or (budget is not None and count >= budget):
+                    break
+                record = self.decodeInstruction(pc)
+                if record[0] != Decoder.CSR_KIND:
+                    break
+                self.retired = retired + count
+                record[1](*record[2])
+                registers[32] = pc + 4
+                count += 1
+                if stops and pc + 4 in stops:
+                    break
+        except Memory.MemoryAccessError as error:
+            # The instructions before the fault still ran.
+            count += error.executed
+            raise
+        finally:
+            self.retired = retired + count
+            # Stores only tell the translator about code it has compiled, so
+            # anything else in the decode cache may be stale now.
+            self.decodeCache.clear()
+        return count
+
+    # Work out why a Run stopped
+    def stopReason(self, count=0, budget=None):
+        pc = self.registers[32]
+        if pc == len(self.memory):
+            return 'End of Memory'
+        elif budget is not None and count >= budget:
+            return 'Instruction Limit'
+        elif self.timedOut:
+            return 'Time Limit'
+        elif self.fetchWord(pc) == Decoder.EBREAK_WORD:
+            return 'EBREAK'
+        return 'Invalid Instruction'
+
+    # Analyze the Control Flow of the Loaded Image
+    def analyze(self, entry=None):
+        # Returns the Analysis.ControlFlowGraph of the code reachable from
+        # entry, the entry point if it isn't given.  Nothing is run.
+        if entry is None:
+            entry = self.entryPoint
+        graph = self.analyses.get(entry)
+        if graph is None:
+            graph = Analysis.analyze(self.bus, entry)
+            self.analyses[entry] = graph
+        return graph
+
+    # Disassemble Object Code
+    def disassemble(self, startAddress):
+        # Returns the RISC-V assembly code from startAddress to an EBREAK or
+        # the end of memory, one line per instruction.  Words that aren't
+        # instructions are skipped.  Nothing is run, so the registers and
+        # memory are left alone.
+        return Disassembler.disassembleFrom(self.bus, startAddress)
+
+    # Disassemble a Range of Memory
+    def disassembleRange(self, startAddress, endAddress):
+        # Yields a line with the address, word and assembly of every word
+        # from startAddress to endAddress.
+        return Disassembler.disassembleRange(self.memory, startAddress, endAddress)
+
+    # Dump a Range of Memory
+    def dump(self, startAddress, endAddress):
+        # Returns the bytes from startAddress to endAddress (inclusive) as
+        # lines of up to 8 bytes, each starting with its address.
+        lines = []
+        for lineAddress in range(startAddress, endAddress + 1, 8):
+            data = self.memory[lineAddress:min(lineAddress + 8, endAddress + 1)]
+            line = ' {:X}   '.format(lineAddress) + ' '.join('{:02X}'.format(byte) for byte in data)
+            # Short lines keep the space after their last byte.
+            if len(data) != 8:
+                line = line + ' '
+            lines.append(line)
+        return lines
@@ -0,0 +1,450 @@
+import sys, struct
+
+# Memory Access
+# Every load, store and instruction fetch goes through a Memory, which reads
+# and writes little-endian values in one go instead of a byte at a time.
+# Aligned halfwords and words go straight through memoryview casts of the
+# bytearray, and anything else through int.from_bytes/to_bytes.  Accesses
+# outside of memory raise MemoryAccessError saying what went wrong and where,
+# and misaligned ones are counted (or raise, with strict alignment on).
+#
+# The casts keep the bytearray exported, so it can't change size while a
+# Memory is using it.  Writing slices of the same length is fine, but
+# anything written straight into the bytearray has to be passed to
+# markWritten, so checkpoints see it.
+#
+# A PagedMemory does the same for a sparse memory as big as the whole 32-bit
+# address space, which only holds the 4 KiB pages that have been written.
+
+# The casts use the host's byte order, so they are only used on a
+# little-endian host.
+HOST_CASTS = sys.byteorder == 'little' and struct.calcsize('I') == 4
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+# The whole 32-bit address space.
+ADDRESS_SPACE = 1 << 32
+# Zeros to compare writes against, so writing zeros doesn't make pages.
+ZERO_PAGE = memoryview(bytes(PAGE_SIZE))
+
+
+# Raised for an access outside of memory, or a misaligned one with strict
+# alignment on.  It's an IndexError, like the bytearray used to raise.
+class MemoryAccessError(IndexError):
+
+    def __init__(self, address, size, access, reason):
+        self.address = address
+        self.size = size
+        self.access = access
+        self.reason = reason
+        # Instructions run before the fault, filled in by the block
+        # translator, which has no other way to report them.
+        self.executed = 0
+        super().__init__('{} {} of {} byte{} at {:05X}'.format(
+            reason, access, size, '' if size == 1 else 's', address))
+
+
+# Flat Memory
+# A checkpoint is a copy of the whole bytearray, so taking one costs as much
+# as the memory is big.  Every write adds its page to dirty, and going back
+# to the latest checkpoint only copies those pages back.  Going back to an
+# older one has to compare every page, so only a paged memory keeps that
+# cheap.
+class Memory:
+    __slots__ = ('data', 'size', 'halves', 'words', 'fastSize', 'strictAlignment', 'misaligned', 'current',
+                 'dirty')
+
+    def __init__(self, data, strictAlignment=False):
+        self.data = data
+        self.size = len(data)
+        self.strictAlignment = strictAlignment
+        # Number of misaligned accesses so far.
+        self.misaligned = 0
+        # The latest checkpoint, and the numbers of the pages written since
+        # it was taken.  dirty is always a set, and stays the same set, so
+        # the block translator's stores can add to it.
+        self.current = None
+        self.dirty = set()
+        # fastSize is how far the fast path reaches, and 0 turns it off.
+        if HOST_CASTS and self.size % 4 == 0:
+            view = memoryview(data)
+            self.halves = view.cast('H')
+            self.words = view.cast('I')
+            self.fastSize = self.size
+        else:
+            self.halves = None
+            self.words = None
+            self.fastSize = 0
+
+    def __len__(self):
+        return self.size
+
+    # Check an Access that can't take the Fast Path
+    def check(self, address, size, access):
+        if address < 0 or address > self.size - size:
+            raise MemoryAccessError(address, size, access, 'Out of range')
+        if address & (size - 1):
+            if self.strictAlignment:
+                raise MemoryAccessError(address, size, access, 'Misaligned')
+            self.misaligned += 1
+
+    def readU8(self, address):
+        if 0 <= address < self.size:
+            return self.data[address]
+        raise MemoryAccessError(address, 1, 'read', 'Out of range')
+
+    def readU16(self, address):
+        if not address & 1 and 0 <= address < self.fastSize:
+            return self.halves[address >> 1]
+        self.check(address, 2, 'read')
+        return int.from_bytes(self.data[address:address + 2], 'little')
+
+    def readU32(self, address):
+        if not address & 3 and 0 <= address < self.fastSize:
+            return self.words[address >> 2]
+        self.check(address, 4, 'read')
+        return int.from_bytes(self.data[address:address + 4], 'little')
+
+    # Fetch an Instruction Word
+    # Like readU32, but instruction fetches aren't data accesses, so they
+    # aren't counted as misaligned.
+    def fetch(self, address):
+        if not address & 3 and 0 <= address < self.fastSize:
+            return self.words[address >> 2]
+        if address < 0 or address > self.size - 4:
+            raise MemoryAccessError(address, 4, 'fetch', 'Out of range')
+        return int.from_bytes(self.data[address:address + 4], 'little')
+
+    # Note Bytes written straight into the bytearray
+    def markWritten(self, address, length):
+        if length > 0:
+            self.dirty.update(range(address >> PAGE_BITS, ((address + length - 1) >> PAGE_BITS) + 1))
+
+    # Take a Checkpoint
+    # A checkpoint of a flat memory is a copy of it.
+    def checkpoint(self):
+        checkpoint = bytes(self.data)
+        self.current = checkpoint
+        self.dirty.clear()
+        return checkpoint
+
+    # Find the Pages that changed since a Checkpoint
+    # For the latest checkpoint those are the dirty pages, which may have
+    # been written with what they already held.  For an older one it's every
+    # PAGE_SIZE page that differs from it.
+    def changedSince(self, checkpoint):
+        if checkpoint is self.current:
+            return sorted(number << PAGE_BITS for number in self.dirty)
+        data = self.data
+        return [address for address in range(0, self.size, PAGE_SIZE)
+                if data[address:address + PAGE_SIZE] != checkpoint[address:address + PAGE_SIZE]]
+
+    # Go back to a Checkpoint
+    # Only the pages that changed since the checkpoint are copied back, and
+    # their addresses are returned so anything decoded from them can be
+    # thrown away.
+    def restore(self, checkpoint):
+        changed = self.changedSince(checkpoint)
+        for address in changed:
+            self.data[address:address + PAGE_SIZE] = checkpoint[address:address + PAGE_SIZE]
+        self.current = checkpoint
+        self.dirty.clear()
+        return changed
+
+    # The write methods store the low bits of value, like the hardware
+    # would, and mark the pages they write.  A misaligned write can reach
+    # into the next page.
+    def writeU8(self, address, value):
+        if 0 <= address < self.size:
+            self.data[address] = value & 0xFF
+            self.dirty.add(address >> PAGE_BITS)
+        else:
+            raise MemoryAccessError(address, 1, 'write', 'Out of range')
+
+    def writeU16(self, address, value):
+        if not address & 1 and 0 <= address < self.fastSize:
+            self.halves[address >> 1] = value & 0xFFFF
+            self.dirty.add(address >> PAGE_BITS)
+        else:
+            self.check(address, 2, 'write')
+            self.data[address:address + 2] = (value & 0xFFFF).to_bytes(2, 'little')
+            self.markWritten(address, 2)
+
+    def writeU32(self, address, value):
+        if not address & 3 and 0 <= address < self.fastSize:
+            self.words[address >> 2] = value & 0xFFFFFFFF
+            self.dirty.add(address >> PAGE_BITS)
+        else:
+            self.check(address, 4, 'write')
+            self.data[address:address + 4] = (value & 0xFFFFFFFF).to_bytes(4, 'little')
+            self.markWritten(address, 4)
+
+
+# Paged Memory
+# The page table maps a page number (address >> PAGE_BITS) to its 4 KiB
+# bytearray, and a page is only made the first time something is written to
+# it.  Reading a page that was never written gives zeros, so memory use
+# follows what the program actually writes, not how big the memory is.
+# The most recently used pages are kept to one side, so runs of accesses to
+# the same page skip the page table.
+#
+# Checkpoints are copy on write.  A checkpoint is a copy of the page table,
+# sharing its pages with memory, and a shared page is copied the first time
+# it is written after that.  The pages written since the checkpoint are
+# dirty, and going back to the checkpoint only puts those back, however big
+# the memory is.
+class PagedMemory(Memory):
+    __slots__ = ('pages', 'pageHalves', 'pageWords', 'touched',
+                 'lastNumber', 'lastPage', 'lastHalves', 'lastWords', 'wordNumber',
+                 'writeNumber', 'writePage', 'writeHalves', 'writeWords', 'writeWordNumber')
+
+    def __init__(self, size=ADDRESS_SPACE, strictAlignment=False):
+        if size <= 0 or size > ADDRESS_SPACE or size % PAGE_SIZE:
+            raise ValueError('Paged memory size must be a multiple of {} up to {:X}'.format(PAGE_SIZE, ADDRESS_SPACE))
+        self.size = size
+        self.strictAlignment = strictAlignment
+        self.misaligned = 0
+        # There is no one bytearray to take the Memory fast path through.
+        self.data = None
+        self.halves = None
+        self.words = None
+        self.fastSize = 0
+        # Page table, and the halfword and word casts of each page.
+        self.pages = {}
+        self.pageHalves = {}
+        self.pageWords = {}
+        # Numbers of every page read or written, for instrumentation.
+        self.touched = set()
+        # The latest checkpoint, and the numbers of the pages written since
+        # it was taken (None without a checkpoint).
+        self.current = None
+        self.dirty = None
+        self.forget()
+
+    # Forget the most recently used Pages
+    def forget(self):
+        # The most recently read page, and the most recently written one,
+        # which is never shared with a checkpoint.  wordNumber and
+        # writeWordNumber are their numbers when their casts can be used,
+        # and None when they can't.
+        self.lastNumber = None
+        self.lastPage = None
+        self.lastHalves = None
+        self.lastWords = None
+        self.wordNumber = None
+        self.writeNumber = None
+        self.writePage = None
+        self.writeHalves = None
+        self.writeWords = None
+        self.writeWordNumber = None
+
+    # Number of Pages that have been Read or Written
+    def pagesTouched(self):
+        return len(self.touched)
+
+    # Bytes held by the Pages that have been Written
+    def residentBytes(self):
+        return len(self.pages) * PAGE_SIZE
+
+    # Make a Page the most recently read one
+    def use(self, number, page):
+        self.lastNumber = number
+        self.lastPage = page
+        if HOST_CASTS:
+            self.lastHalves = self.pageHalves[number]
+            self.lastWords = self.pageWords[number]
+            self.wordNumber = number
+
+    # Make a Page the most recently written one
+    def useForWrite(self, number, page):
+        self.use(number, page)
+        self.writeNumber = number
+        self.writePage = page
+        if HOST_CASTS:
+            self.writeHalves = self.lastHalves
+            self.writeWords = self.lastWords
+            self.writeWordNumber = number
+
+    # Find the Page to read, or None if it was never written
+    def find(self, number):
+        page = self.pages.get(number)
+        if page is None:
+            self.touched.add(number)
+        else:
+            self.use(number, page)
+        return page
+
+    # Find the Page to write, making it on first touch
+    # A page still shared with the checkpoint is copied first.
+    def allocate(self, number):
+        page = self.pages.get(number)
+        dirty = self.dirty
+        if page is None or (dirty is not None and number not in dirty):
+            page = bytearray(PAGE_SIZE) if page is None else bytearray(page)
+            self.pages[number] = page
+            if HOST_CASTS:
+                view = memoryview(page)
+                self.pageHalves[number] = view.cast('H')
+                self.pageWords[number] = view.cast('I')
+            self.touched.add(number)
+            if dirty is not None:
+                dirty.add(number)
+        self.useForWrite(number, page)
+        return page
+
+    # Writes straight into a paged memory go through its pages, which
+    # already marks them.
+    def markWritten(self, address, length):
+        pass
+
+    # Take a Checkpoint
+    def checkpoint(self):
+        # Every page is shared with the checkpoint from now on, so the most
+        # recently written one can't be written in place any more.
+        checkpoint = (dict(self.pages), dict(self.pageHalves), dict(self.pageWords))
+        self.current = checkpoint
+        self.dirty = set()
+        self.forget()
+        return checkpoint
+
+    # Find the Pages that changed since a Checkpoint
+    # For the latest checkpoint those are just the dirty pages.  For an older
+    # one it's every page that isn't the same page in both, since pages are
+    # never written while they are shared.
+    def changedSince(self, checkpoint):
+        if checkpoint is self.current:
+            numbers = self.dirty
+        else:
+            pages = checkpoint[0]
+            numbers = [number for number in self.pages.keys() | pages.keys()
+                       if self.pages.get(number) is not pages.get(number)]
+        return sorted(number << PAGE_BITS for number in numbers)
+
+    # Go back to a Checkpoint
+    # Returns the addresses of the pages that were put back.
+    def restore(self, checkpoint):
+        pages, pageHalves, pageWords = checkpoint
+        changed = self.changedSince(checkpoint)
+        for address in changed:
+            number = address >> PAGE_BITS
+            if number in pages:
+                self.pages[number] = pages[number]
+                if HOST_CASTS:
+                    self.pageHalves[number] = pageHalves[number]
+                    self.pageWords[number] = pageWords[number]
+            else:
+                del self.pages[number]
+                self.pageHalves.pop(number, None)
+                self.pageWords.pop(number, None)
+        self.current = checkpoint
+        self.dirty = set()
+        self.forget()
+        return changed
+
+    # Read an Access that can't take the Fast Path
+    def slowRead(self, address, size):
+        offset = address & PAGE_MASK
+        if offset + size <= PAGE_SIZE:
+            page = self.find(address >> PAGE_BITS)
+            if page is None:
+                return 0
+            return int.from_bytes(page[offset:offset + size], 'little')
+        # Misaligned across two pages.
+        return int.from_bytes(self[address:address + size], 'little')
+
+    # Write an Access that can't take the Fast Path
+    def slowWrite(self, address, size, value):
+        offset = address & PAGE_MASK
+        data = value.to_bytes(size, 'little')
+        if offset + size <= PAGE_SIZE:
+            self.allocate(address >> PAGE_BITS)[offset:offset + size] = data
+        else:
+            self[address:address + size] = data
+
+    def readU8(self, address):
+        if address >> PAGE_BITS == self.lastNumber:
+            return self.lastPage[address & PAGE_MASK]
+        if 0 <= address < self.size:
+            page = self.find(address >> PAGE_BITS)
+            return 0 if page is None else page[address & PAGE_MASK]
+        raise MemoryAccessError(address, 1, 'read', 'Out of range')
+
+    def readU16(self, address):
+        if not address & 1 and address >> PAGE_BITS == self.wordNumber:
+            return self.lastHalves[(address & PAGE_MASK) >> 1]
+        self.check(address, 2, 'read')
+        return self.slowRead(address, 2)
+
+    def readU32(self, address):
+        if not address & 3 and address >> PAGE_BITS == self.wordNumber:
+            return self.lastWords[(address & PAGE_MASK) >> 2]
+        self.check(address, 4, 'read')
+        return self.slowRead(address, 4)
+
+    def fetch(self, address):
+        if not address & 3 and address >> PAGE_BITS == self.wordNumber:
+            return self.lastWords[(address & PAGE_MASK) >> 2]
+        if address < 0 or address > self.size - 4:
+            raise MemoryAccessError(address, 4, 'fetch', 'Out of range')
+        return self.slowRead(address, 4)
+
+    def writeU8(self, address, value):
+        if address >> PAGE_BITS == self.writeNumber:
+            self.writePage[address & PAGE_MASK] = value & 0xFF
+        elif 0 <= address < self.size:
+            self.allocate(address >> PAGE_BITS)[address & PAGE_MASK] = value & 0xFF
+        else:
+            raise MemoryAccessError(address, 1, 'write', 'Out of range')
+
+    def writeU16(self, address, value):
+        if not address & 1 and address >> PAGE_BITS == self.writeWordNumber:
+            self.writeHalves[(address & PAGE_MASK) >> 1] = value & 0xFFFF
+        else:
+            self.check(address, 2, 'write')
+            self.slowWrite(address, 2, value & 0xFFFF)
+
+    def writeU32(self, address, value):
+        if not address & 3 and address >> PAGE_BITS == self.writeWordNumber:
+            self.writeWords[(address & PAGE_MASK) >> 2] = value & 0xFFFFFFFF
+        else:
+            self.check(address, 4, 'write')
+            self.slowWrite(address, 4, value & 0xFFFFFFFF)
+
+    # Index and Slice like a bytearray
+    # So the loaders, dumps and edits that work on a bytearray work on a
+    # PagedMemory too.  Slices can't change the size of memory.
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self.readU8(index)
+        start, stop, step = index.indices(self.size)
+        if step != 1:
+            raise ValueError('Paged memory slices must have a step of 1')
+        result = bytearray(max(0, stop - start))
+        address = start
+        while address < stop:
+            offset = address & PAGE_MASK
+            length = min(PAGE_SIZE - offset, stop - address)
+            page = self.pages.get(address >> PAGE_BITS)
+            if page is not None:
+                result[address - start:address - start + length] = page[offset:offset + length]
+            address += length
+        return bytes(result)
+
+    def __setitem__(self, index, value):
+        if not isinstance(index, slice):
+            self.writeU8(index, value)
+            return
+        start, stop, step = index.indices(self.size)
+        view = memoryview(value).cast('B')
+        if step != 1 or len(view) != max(0, stop - start):
+            raise ValueError('Paged memory slices must have a step of 1 and keep their length')
+        address = start
+        while address < stop:
+            number = address >> PAGE_BITS
+            offset = address & PAGE_MASK
+            length = min(PAGE_SIZE - offset, stop - address)
+            chunk = view[address - start:address - start + length]
+            if number in self.pages or chunk != ZERO_PAGE[:length]:
+                self.allocate(number)[offset:offset + length] = chunk
+            address += length
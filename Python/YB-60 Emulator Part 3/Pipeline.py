@@ -0,0 +1,237 @@
+import sys
+import Decoder, Trace
+
+# Pipeline Timing Model
+# Estimates how many cycles a program would take on a classic 5-stage
+# IF/ID/EX/MEM/WB pipeline, from the instructions it executed.  The emulator
+# itself only ever takes one cycle per instruction, this is a layer on top
+# of its trace.
+#
+# The pipeline is in order and forwards results to EX, so most instructions
+# take one cycle once it is full.  The cycles it loses are:
+#   - load-use: a load's value is only ready after MEM, so an instruction
+#     that needs it in EX straight after waits a cycle.  A store's data
+#     isn't needed until MEM, so storing a loaded value doesn't wait.
+#   - branch: branches are resolved in EX, so a mispredicted branch throws
+#     away the instructions fetched after it.  They are predicted not
+#     taken, or by a BranchPredictor given to the pipeline, which also gets
+#     the outcome of every branch.
+#   - jump: jal knows its target in ID, and jalr only in EX.
+#   - mul and div: the multiplier and divider hold EX for their latency,
+#     and everything behind them waits.
+#
+# A Pipeline is a trace sink, so a live run times itself by being given
+# one, and a recorded trace is timed by feeding it the trace's words.
+
+# Stages, the first instruction only leaves WB this many cycles after it
+# was fetched.
+STAGES = 5
+# Default cycles lost to each hazard, and taken by mul and div in EX.
+LOAD_USE_PENALTY = 1
+BRANCH_PENALTY = 2
+JAL_PENALTY = 1
+MUL_LATENCY = 3
+DIV_LATENCY = 34
+# Kinds of stall.
+LOAD_USE = 'load-use'
+BRANCH = 'branch'
+JUMP = 'jump'
+MUL = 'mul'
+DIV = 'div'
+STALL_KINDS = (LOAD_USE, BRANCH, JUMP, MUL, DIV)
+
+# Instruction classes, for the timing.
+OTHER_CLASS = 0
+LOAD_CLASS = 1
+BRANCH_CLASS = 2
+JAL_CLASS = 3
+JALR_CLASS = 4
+MUL_CLASS = 5
+DIV_CLASS = 6
+MULTIPLIES = ('MUL', 'MULH', 'MULHSU', 'MULHU')
+DIVIDES = ('DIV', 'DIVU', 'REM', 'REMU')
+
+
+# Classify an Instruction for the Timing
+def classify(word, decoded):
+    # Returns (class, rd, sources), where sources are the registers it
+    # needs in EX, leaving out x0, and rd is 0 if it writes nothing.
+    if decoded is None:
+        return (OTHER_CLASS, 0, ())
+    entry, rd, rs1, rs2, imm = decoded
+    mnemonic, format = entry[0], entry[1]
+    major = (word >> 2) & 0x1F
+    if format == Decoder.R_FORMAT or format == Decoder.SB_FORMAT:
+        sources = (rs1, rs2)
+    elif format == Decoder.U_FORMAT or format == Decoder.UJ_FORMAT:
+        sources = ()
+    else:
+        sources = (rs1,)
+    sources = tuple(register for register in sources if register)
+    if format == Decoder.S_FORMAT or format == Decoder.SB_FORMAT:
+        rd = 0
+
+    if major == Decoder.LOAD:
+        kind = LOAD_CLASS
+    elif major == Decoder.BRANCH:
+        kind = BRANCH_CLASS
+    elif major == Decoder.JAL:
+        kind = JAL_CLASS
+    elif major == Decoder.JALR:
+        kind = JALR_CLASS
+    elif mnemonic in MULTIPLIES:
+        kind = MUL_CLASS
+    elif mnemonic in DIVIDES:
+        kind = DIV_CLASS
+    else:
+        kind = OTHER_CLASS
+    return (kind, rd, sources)
+
+
+# Parse Pipeline Options
+def parseOptions(words):
+    # "mul=5", "div=20", "branch=3", "jal=2" and "loaduse=2" turn into
+    # keyword arguments for Pipeline.  Raises ValueError for anything else.
+    names = {'mul': 'mulLatency', 'div': 'divLatency', 'branch': 'branchPenalty', 'jal': 'jalPenalty',
+             'loaduse': 'loadUsePenalty'}
+    options = {}
+    for word in words:
+        name, _, value = word.lower().partition('=')
+        if name not in names or not value:
+            raise ValueError('Bad pipeline option: ' + word)
+        options[names[name]] = int(value, 0)
+    return options
+
+
+class Pipeline:
+
+    def __init__(self, mulLatency=MUL_LATENCY, divLatency=DIV_LATENCY, branchPenalty=BRANCH_PENALTY,
+                 jalPenalty=JAL_PENALTY, loadUsePenalty=LOAD_USE_PENALTY, predictor=None):
+        # The penalties are cycles lost, the latencies are cycles in EX.
+        # predictor is a BranchPredictor.Predictor, or None to predict
+        # every branch not taken.
+        self.mulStall = mulLatency - 1
+        self.divStall = divLatency - 1
+        self.branchPenalty = branchPenalty
+        self.jalPenalty = jalPenalty
+        self.loadUsePenalty = loadUsePenalty
+        self.predictor = predictor
+        self.instructions = 0
+        # Stall cycles by kind, and {pc: {kind: cycles}} for the
+        # instructions they were lost at.
+        self.stalls = dict.fromkeys(STALL_KINDS, 0)
+        self.pcStalls = {}
+        # word -> classify's tuple, since loops run the same words.
+        self.classes = {}
+        # (pc, class tuple) of the last instruction, which is only timed
+        # once the next one shows where it went.
+        self.previous = None
+
+    # Count Stall Cycles at a PC
+    def stall(self, pc, kind, cycles):
+        if cycles <= 0:
+            return
+        self.stalls[kind] += cycles
+        counts = self.pcStalls.get(pc)
+        if counts is None:
+            counts = self.pcStalls[pc] = {}
+        counts[kind] = counts.get(kind, 0) + cycles
+
+    # Time one Executed Instruction
+    def feed(self, pc, word, decoded):
+        current = self.classes.get(word)
+        if current is None:
+            current = self.classes[word] = classify(word, decoded)
+        previous = self.previous
+        if previous is not None:
+            lastPC, (kind, rd, sources) = previous
+            if kind == LOAD_CLASS:
+                if rd and rd in current[2]:
+                    self.stall(pc, LOAD_USE, self.loadUsePenalty)
+            elif kind == BRANCH_CLASS:
+                taken = pc != lastPC + 4
+                if self.predictor is None:
+                    mispredicted = taken
+                else:
+                    mispredicted = not self.predictor.observe(lastPC, taken)
+                if mispredicted:
+                    self.stall(lastPC, BRANCH, self.branchPenalty)
+            elif kind == JAL_CLASS:
+                self.stall(lastPC, JUMP, self.jalPenalty)
+            elif kind == JALR_CLASS:
+                self.stall(lastPC, JUMP, self.branchPenalty)
+
+        if current[0] == MUL_CLASS:
+            self.stall(pc, MUL, self.mulStall)
+        elif current[0] == DIV_CLASS:
+            self.stall(pc, DIV, self.divStall)
+        self.instructions += 1
+        self.previous = (pc, current)
+
+    # Trace Sink Interface
+    # Every instruction the run sends the sink is timed.  The EBREAK or
+    # invalid instruction that stops the run isn't an instruction.
+    def start(self):
+        pass
+
+    def emit(self, pc, info, registers):
+        if info[1] is not None:
+            self.feed(pc, info[0], info[1])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    # Time a Recorded Trace
+    def feedTrace(self, fileName):
+        # Reads any format Trace.readTrace does.  Returns how many
+        # instructions were timed.
+        count = self.instructions
+        decodedWords = {}
+        for pc, word in Trace.readTrace(fileName):
+            decoded = decodedWords.get(word, False)
+            if decoded is False:
+                decoded = decodedWords[word] = Decoder.decode(word)
+            if decoded is not None:
+                self.feed(pc, word, decoded)
+        return self.instructions - count
+
+    # Total Cycles
+    def cycles(self):
+        # One per instruction once the pipeline is full, the cycles to fill
+        # it, and every stall.
+        if not self.instructions:
+            return 0
+        return self.instructions + STAGES - 1 + sum(self.stalls.values())
+
+    # Report the Timing
+    def report(self, top=20):
+        # Returns the report as lines: the cycles and CPI, the stalls of
+        # each kind, and the PCs that lost the most cycles.
+        cycles = self.cycles()
+        lines = ['Instructions: {}  Cycles: {}  CPI: {:.3f}'.format(
+            self.instructions, cycles, cycles / (self.instructions or 1))]
+        lines.append('Stalls: ' + '  '.join('{} {}'.format(kind, self.stalls[kind]) for kind in STALL_KINDS))
+
+        lines.append('')
+        lines.append('     PC      Stalls  Kinds')
+        totals = sorted(((sum(counts.values()), pc) for pc, counts in self.pcStalls.items()),
+                        key=lambda item: (-item[0], item[1]))
+        for total, pc in totals[:top]:
+            counts = self.pcStalls[pc]
+            kinds = ', '.join('{} {}'.format(kind, counts[kind]) for kind in STALL_KINDS if kind in counts)
+            lines.append('  {:05X}  {:10d}  {}'.format(pc, total, kinds))
+        return lines
+
+
+if __name__ == '__main__':
+    # python Pipeline.py trace.bin [mul=N div=N ...] times a recorded trace.
+    if len(sys.argv) < 2:
+        print("Usage: python Pipeline.py <trace> [mul=N] [div=N] [branch=N] [jal=N] [loaduse=N]")
+        sys.exit()
+    pipeline = Pipeline(**parseOptions(sys.argv[2:]))
+    pipeline.feedTrace(sys.argv[1])
+    for line in pipeline.report():
+        print(line)
@@ -0,0 +1,169 @@
+import Decoder, Instructions, Machine, Analysis
+
+# Execution Profiler
+# Runs a program the way Machine.run does, but counts every instruction it
+# executes: by PC, by mnemonic, and by the stack of functions it was in.
+# The profiler has its own copy of the run loop, so running without it
+# costs nothing.
+#
+# Functions are found with a shadow stack.  A jal or jalr that links into
+# ra (x1) or t0 (x5) is a call, and pushes its target.  A jalr x0 through
+# ra or t0 is a return, and pops.  Every other jump stays in the same
+# function.  Functions are named by their start address, since object
+# files have no symbols.
+
+# Registers the calling convention links through.
+LINK_REGISTERS = Analysis.LINK_REGISTERS
+
+
+class Profiler:
+
+    def __init__(self):
+        # Executions per PC, and per mnemonic.
+        self.pcCounts = {}
+        self.mnemonicCounts = {}
+        # Executions per call stack, a tuple of function start addresses
+        # from the outermost function in.
+        self.stackCounts = {}
+        # Number of instructions run, and calls and returns seen.
+        self.instructions = 0
+        self.calls = 0
+        self.returns = 0
+
+    # Run a Program under the Profiler
+    def run(self, machine, startAddress, budget=None):
+        # Clears the registers and runs from startAddress until an EBREAK,
+        # an instruction we can't decode, the end of memory, or budget
+        # instructions.  Returns the number of instructions run, which are
+        # added to the profile.
+        machine.clearRegisters()
+        registers = machine.registers
+        registers[32] = startAddress
+        decodeCache = machine.decodeCache
+        end = len(machine.memory)
+        if budget is None:
+            budget = -1
+        pcCounts = self.pcCounts
+        mnemonicCounts = self.mnemonicCounts
+        stackCounts = self.stackCounts
+        jalInt = Instructions.jalInt
+        jalrInt = Instructions.jalrInt
+        stack = (startAddress,)
+        retired = machine.retired
+        count = 0
+
+        try:
+            while registers[32] != end and count != budget:
+                pc = registers[32]
+                record = decodeCache.get(pc)
+                if record is None:
+                    record = machine.decodeInstruction(pc)
+                kind = record[0]
+                if kind == Decoder.STOP_KIND:
+                    break
+
+                # A call or return is counted in the function it left.
+                current = stack
+                if kind == Decoder.NEXT_KIND:
+                    record[1](*record[2])
+                    registers[32] = pc + 4
+                elif kind == Decoder.JUMP_KIND:
+                    handler = record[1]
+                    handler(*record[2])
+                    if handler is jalInt or handler is jalrInt:
+                        # The decoded fields, since the handler's rd for x0
+                        # is the Machine's ZERO_SINK.
+                        decoded = record[5][1]
+                        rd = decoded[1]
+                        if rd in LINK_REGISTERS:
+                            stack = stack + (registers[32],)
+                            self.calls += 1
+                        elif handler is jalrInt and rd == 0 and decoded[2] in LINK_REGISTERS:
+                            # Returning from the outermost function leaves
+                            # it where it is, there is nothing to go back to.
+                            if len(stack) > 1:
+                                stack = stack[:-1]
+                            self.returns += 1
+                elif kind == Decoder.STORE_KIND:
+                    storeAddress = (registers[record[3]] + record[4]) & 0xFFFFFFFF
+                    record[1](*record[2])
+                    machine.invalidateDecodeCache(storeAddress, Machine.STORE_SIZES[record[1]])
+                    registers[32] = pc + 4
+                else:
+                    # A CSR read sees the instructions before this one.
+                    machine.retired = retired + count
+                    record[1](*record[2])
+                    registers[32] = pc + 4
+
+                # Only counted once the handler is done, since a load or
+                # store that raises never ran, like in Machine.run.
+                count += 1
+                pcCounts[pc] = pcCounts.get(pc, 0) + 1
+                mnemonic = record[5][1][0][0]
+                mnemonicCounts[mnemonic] = mnemonicCounts.get(mnemonic, 0) + 1
+                stackCounts[current] = stackCounts.get(current, 0) + 1
+        finally:
+            machine.retired = retired + count
+            self.instructions += count
+        return count
+
+    # Executions of each Function
+    def functionCounts(self):
+        # Returns {function: (inclusive, exclusive)}.  Exclusive counts the
+        # instructions run in the function itself, inclusive adds the
+        # functions it called.  A recursive function is only counted once
+        # per stack.
+        counts = {}
+        for stack, count in self.stackCounts.items():
+            for function in set(stack):
+                inclusive, exclusive = counts.get(function, (0, 0))
+                counts[function] = (inclusive + count, exclusive)
+            inclusive, exclusive = counts[stack[-1]]
+            counts[stack[-1]] = (inclusive, exclusive + count)
+        return counts
+
+    # Executions of each Function in a Control-Flow Graph
+    def staticFunctionCounts(self, graph):
+        # Returns {function: count}, adding up the PCs by the function the
+        # graph puts them in, so code reached by jumps and tail calls counts
+        # towards the function it is really part of.  PCs the graph doesn't
+        # have count towards None.
+        counts = {}
+        for pc, count in self.pcCounts.items():
+            function = graph.functionOf(pc)
+            counts[function] = counts.get(function, 0) + count
+        return counts
+
+    # Report the Profile
+    def report(self, top=20):
+        # Returns the report as lines: the top PCs, every mnemonic, and
+        # every function, each sorted by count.
+        total = self.instructions or 1
+        lines = ['Instructions: {}  Calls: {}  Returns: {}'.format(self.instructions, self.calls, self.returns)]
+
+        lines.append('')
+        lines.append('     PC       Count       %')
+        pcs = sorted(self.pcCounts.items(), key=lambda item: (-item[1], item[0]))
+        for pc, count in pcs[:top]:
+            lines.append('  {:05X}  {:10d}  {:6.2f}'.format(pc, count, 100 * count / total))
+
+        lines.append('')
+        lines.append('  Mnemonic      Count       %')
+        mnemonics = sorted(self.mnemonicCounts.items(), key=lambda item: (-item[1], item[0]))
+        for mnemonic, count in mnemonics:
+            lines.append('  {:<8}  {:10d}  {:6.2f}'.format(mnemonic.lower(), count, 100 * count / total))
+
+        lines.append('')
+        lines.append('  Function   Inclusive       %   Exclusive       %')
+        functions = sorted(self.functionCounts().items(), key=lambda item: (-item[1][0], item[0]))
+        for function, (inclusive, exclusive) in functions:
+            lines.append('  {:05X}     {:10d}  {:6.2f}  {:10d}  {:6.2f}'.format(
+                function, inclusive, 100 * inclusive / total, exclusive, 100 * exclusive / total))
+        return lines
+
+    # Collapsed Stacks
+    def collapsed(self):
+        # Returns one "outer;inner count" line per stack, the format
+        # flamegraph.pl and speedscope read.
+        return ['{} {}'.format(';'.join('{:05X}'.format(function) for function in stack), count)
+                for stack, count in sorted(self.stackCounts.items())]
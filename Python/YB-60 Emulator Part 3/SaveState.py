@@ -0,0 +1,197 @@
+import os, mmap, struct, tempfile
+import Loader, Machine, Memory
+
+# Save States
+# A save state is everything needed to carry on running a machine later, or
+# somewhere else: its registers (the PC included), entry point, memory
+# options and memory.  There are no devices to save yet.
+#
+# The first save of a machine is a base, holding every page of memory that
+# isn't all zeros.  Later saves of the same machine are deltas, holding only
+# the pages that changed since the save before, and naming that save as
+# their parent.  Loading a delta loads its parent first, back to the base.
+#
+# A state file is a header, the parent's file name (for a delta, relative to
+# the delta's directory), the registers, then PAGE records: a page number
+# and the PAGE_SIZE bytes of the page.  Files are memory-mapped to load, so
+# only the pages are read, straight into memory.
+
+STATE_MAGIC = b'YB60SAV1'
+VERSION = 1
+BASE_KIND = 0
+DELTA_KIND = 1
+# Flags
+PAGED_FLAG = 1
+STRICT_ALIGNMENT_FLAG = 2
+# magic, version, kind, flags, page size, memory size, entry point,
+# misaligned count, parent name length, page count, state id, parent id
+HEADER = struct.Struct('<8sHBBIQIIII16s16s')
+# Each register is saved as a byte count then that many bytes, signed.
+# Registers are 32 bits now, but states saved before they were masked can
+# hold bigger or negative values, so every register is masked to 32 bits
+# on load.  The Machine's ZERO_SINK isn't saved.
+REGISTER = struct.Struct('<I')
+PAGE = struct.Struct('<I')
+# Most files a chain of deltas can go back through to its base.
+MAX_CHAIN = 4096
+
+
+# Save a Machine's State
+def save(machine, fileName, full=False):
+    # Saves a delta against the machine's last save or load, if it has one
+    # and its file is still there, otherwise (or with full) a base.
+    lastSave = machine.lastSave
+    if lastSave is not None and not full and os.path.exists(lastSave[0]):
+        kind = DELTA_KIND
+        parentName, parentId, lastCheckpoint = lastSave
+        addresses = machine.bus.changedSince(lastCheckpoint)
+        parentName = os.path.relpath(os.path.abspath(parentName), os.path.dirname(os.path.abspath(fileName)))
+    else:
+        kind = BASE_KIND
+        parentName = ''
+        parentId = bytes(16)
+        if isinstance(machine.memory, Memory.PagedMemory):
+            addresses = [number << Memory.PAGE_BITS for number in sorted(machine.memory.pages)]
+        else:
+            addresses = range(0, len(machine.memory), Memory.PAGE_SIZE)
+
+    pages = []
+    pageCount = 0
+    for address in addresses:
+        page = machine.memory[address:address + Memory.PAGE_SIZE]
+        # A base doesn't need pages of zeros, but a delta does, since they
+        # may have been something else before.
+        if kind == DELTA_KIND or page.count(0) != len(page):
+            pages.append(PAGE.pack(address >> Memory.PAGE_BITS))
+            pages.append(bytes(page).ljust(Memory.PAGE_SIZE, b'\0'))
+            pageCount += 1
+
+    flags = 0
+    if isinstance(machine.memory, Memory.PagedMemory):
+        flags |= PAGED_FLAG
+    if machine.bus.strictAlignment:
+        flags |= STRICT_ALIGNMENT_FLAG
+    stateId = os.urandom(16)
+    name = parentName.encode('utf-8')
+    parts = [HEADER.pack(STATE_MAGIC, VERSION, kind, flags, Memory.PAGE_SIZE, len(machine.memory),
+                         machine.entryPoint, min(machine.bus.misaligned, 0xFFFFFFFF), len(name), pageCount,
+                         stateId, parentId), name]
+    for register in machine.registers[:Machine.REGISTER_COUNT]:
+        data = register.to_bytes((register.bit_length() + 8) // 8, 'little', signed=True)
+        parts.append(REGISTER.pack(len(data)))
+        parts.append(data)
+    parts.extend(pages)
+
+    # Write to a temporary file and rename it into place, so a crash never
+    # leaves half a state behind.
+    directory = os.path.dirname(os.path.abspath(fileName))
+    handle, temporaryPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as stateFile:
+            stateFile.write(b''.join(parts))
+        os.replace(temporaryPath, fileName)
+    except OSError:
+        try:
+            os.remove(temporaryPath)
+        except OSError:
+            pass
+        raise
+    machine.lastSave = (fileName, stateId, machine.bus.checkpoint())
+
+
+# Read a State File's Header
+def readHeader(image, fileName):
+    # Returns the header fields, the parent's file name, the registers and
+    # the offset of the first page.
+    if len(image) < HEADER.size:
+        raise Loader.FormatError('File is too short for a state header: ' + fileName)
+    header = HEADER.unpack_from(image, 0)
+    (magic, version, kind, flags, pageSize, memorySize, entryPoint, misaligned,
+     nameLength, pageCount, stateId, parentId) = header
+    if magic != STATE_MAGIC:
+        raise Loader.FormatError('Not a save state: ' + fileName)
+    if version != VERSION or pageSize != Memory.PAGE_SIZE or kind not in (BASE_KIND, DELTA_KIND):
+        raise Loader.FormatError('Unsupported save state version: ' + fileName)
+    offset = HEADER.size
+    parentName = bytes(image[offset:offset + nameLength]).decode('utf-8', 'replace')
+    offset += nameLength
+
+    registers = []
+    for i in range(Machine.REGISTER_COUNT):
+        if offset + REGISTER.size > len(image):
+            raise Loader.FormatError('Registers are outside of the file: ' + fileName)
+        length, = REGISTER.unpack_from(image, offset)
+        offset += REGISTER.size
+        registers.append(int.from_bytes(image[offset:offset + length], 'little', signed=True) & 0xFFFFFFFF)
+        offset += length
+    if offset + pageCount * (PAGE.size + pageSize) != len(image):
+        raise Loader.FormatError('Pages do not match the file size: ' + fileName)
+    return header, parentName, registers, offset
+
+
+# Load a Machine from a Saved State
+def load(fileName, imageCache=None):
+    # Returns a new Machine, ready to resume.  Raises Loader.FormatError if
+    # the file, or any of the saves it depends on, can't be loaded.
+    # chain holds (path, image, header, registers, first page offset) from
+    # fileName back to its base.
+    chain = []
+    path = fileName
+    expectedId = None
+    try:
+        while True:
+            if len(chain) >= MAX_CHAIN:
+                raise Loader.FormatError('Too many deltas: ' + fileName)
+            try:
+                stateFile = open(path, 'rb')
+            except OSError:
+                raise Loader.FormatError('Can not open save state: ' + path)
+            with stateFile:
+                try:
+                    image = mmap.mmap(stateFile.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    raise Loader.FormatError('File is empty: ' + path)
+            try:
+                header, parentName, registers, offset = readHeader(image, path)
+            except Loader.FormatError:
+                image.close()
+                raise
+            chain.append((path, image, header, registers, offset))
+            if expectedId is not None and header[10] != expectedId:
+                raise Loader.FormatError('Save state does not match its delta: ' + path)
+            if header[2] == BASE_KIND:
+                break
+            expectedId = header[11]
+            path = os.path.join(os.path.dirname(path), parentName)
+
+        # The base decides the memory options, and the newest save the
+        # registers.  Pages are copied in from the base forwards.
+        flags, memorySize = chain[-1][2][3], chain[-1][2][5]
+        machine = Machine.Machine(memorySize, imageCache, bool(flags & STRICT_ALIGNMENT_FLAG),
+                                  bool(flags & PAGED_FLAG))
+        for path, image, header, registers, offset in reversed(chain):
+            if header[5] != memorySize:
+                raise Loader.FormatError('Save state memory size does not match its base: ' + path)
+            view = memoryview(image)
+            try:
+                for i in range(header[9]):
+                    number, = PAGE.unpack_from(image, offset)
+                    offset += PAGE.size
+                    address = number << Memory.PAGE_BITS
+                    if address >= memorySize:
+                        raise Loader.FormatError('Page is outside of memory: ' + path)
+                    length = min(Memory.PAGE_SIZE, memorySize - address)
+                    machine.memory[address:address + length] = view[offset:offset + length]
+                    offset += Memory.PAGE_SIZE
+            finally:
+                view.release()
+    finally:
+        for entry in chain:
+            entry[1].close()
+
+    path, image, header, registers, offset = chain[0]
+    machine.registers[:Machine.REGISTER_COUNT] = registers
+    machine.entryPoint = header[6]
+    machine.bus.misaligned = header[7]
+    machine.lastSave = (fileName, header[10], machine.bus.checkpoint())
+    return machine
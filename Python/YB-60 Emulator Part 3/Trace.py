@@ -0,0 +1,241 @@
+import sys, json, struct
+import Decoder
+
+# Trace Output
+# The run loop hands each executed instruction to a trace sink as
+# (pc, info, registers), where info is (word, decoded) from the decode cache
+# and decoded is Decoder.decode(word), or None for EBREAK and invalid words.
+# Nothing is formatted until a sink actually needs text.
+
+# Labels for when you run the program.
+labels = "    PC      OPC   INST  rd    rs1  rs2/imm"
+
+# Binary traces start with this, then hold one fixed-width record per
+# instruction: pc, word, the register written back (NO_WRITEBACK if none)
+# and the value written to it.
+BINARY_MAGIC = b'YB60TRC1'
+BINARY_RECORD = struct.Struct('<IIBI')
+NO_WRITEBACK = 0xFF
+
+
+# Format the Register and imm Fields of a Trace Line
+def traceFields(format, rd, rs1, rs2, imm):
+    # Fields are printed in binary, with the imm at its full width.
+    imm = imm & ((1 << Decoder.IMM_BITS[format]) - 1)
+    if format == Decoder.R_FORMAT:
+        return ' {:05b} {:05b} {:05b}'.format(rd, rs1, rs2)
+    elif format == Decoder.I_FORMAT:
+        return ' {:05b} {:05b} {:012b}'.format(rd, rs1, imm)
+    elif format == Decoder.S_FORMAT:
+        return '       {:05b} {:05b} {:012b}'.format(rs1, rs2, imm)
+    elif format == Decoder.SB_FORMAT:
+        return '       {:05b} {:05b} {:013b}'.format(rs1, rs2, imm)
+    elif format == Decoder.U_FORMAT:
+        return ' {:05b}       {:020b}'.format(rd, imm)
+    else:
+        return ' {:05b}       {:021b}'.format(rd, imm)
+
+
+# Format a whole Trace Line
+def formatTraceLine(pc, word, decoded):
+    start = ' {:05X} {:08X}'.format(pc, word)
+    if decoded is None:
+        if word == Decoder.EBREAK_WORD:
+            return start + ' EBREAK'
+        return start + ' Error: Invalid Instruction'
+    entry, rd, rs1, rs2, imm = decoded
+    return start + entry[0].rjust(7) + traceFields(entry[1], rd, rs1, rs2, imm)
+
+
+# Find the Register an Instruction writes back, or None
+def writebackRegister(decoded):
+    if decoded is None or decoded[0][1] in (Decoder.S_FORMAT, Decoder.SB_FORMAT):
+        return None
+    return decoded[1]
+
+
+# Text Trace
+class TextTraceSink:
+    # Writes the same lines runProgram has always printed, but collects them
+    # and writes them out in batches instead of one print per instruction.
+
+    def __init__(self, stream=None, bufferLines=4096):
+        self.stream = stream if stream is not None else sys.stdout
+        self.bufferLines = bufferLines
+        self.lines = []
+        # Finished lines, by (pc, word), since loops trace the same
+        # instructions over and over.
+        self.formatted = {}
+
+    def start(self):
+        self.lines.append(labels)
+
+    def emit(self, pc, info, registers):
+        key = (pc, info[0])
+        line = self.formatted.get(key)
+        if line is None:
+            line = formatTraceLine(pc, info[0], info[1])
+            self.formatted[key] = line
+        self.lines.append(line)
+        if len(self.lines) >= self.bufferLines:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.stream.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+# JSON Lines Trace
+class JsonTraceSink:
+    # One JSON object per instruction, with the operands the format uses
+    # and the value written back to rd.
+
+    def __init__(self, stream, bufferLines=4096):
+        self.stream = stream
+        self.bufferLines = bufferLines
+        self.lines = []
+
+    def start(self):
+        pass
+
+    def emit(self, pc, info, registers):
+        word, decoded = info
+        event = {'pc': pc, 'word': word}
+        if decoded is None:
+            event['inst'] = 'EBREAK' if word == Decoder.EBREAK_WORD else None
+        else:
+            entry, rd, rs1, rs2, imm = decoded
+            format = entry[1]
+            event['inst'] = entry[0]
+            if format not in (Decoder.S_FORMAT, Decoder.SB_FORMAT):
+                event['rd'] = rd
+            if format not in (Decoder.U_FORMAT, Decoder.UJ_FORMAT):
+                event['rs1'] = rs1
+            if format in (Decoder.R_FORMAT, Decoder.S_FORMAT, Decoder.SB_FORMAT):
+                event['rs2'] = rs2
+            if format != Decoder.R_FORMAT:
+                event['imm'] = imm
+            rd = writebackRegister(decoded)
+            if rd is not None:
+                event['writeback'] = [rd, registers[rd]]
+        self.lines.append(json.dumps(event))
+        if len(self.lines) >= self.bufferLines:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.stream.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+
+# Binary Trace
+class BinaryTraceSink:
+    # Fixed-width records, see BINARY_RECORD.  The word is enough to decode
+    # the instruction again later, so no text is made while running.
+
+    def __init__(self, stream, bufferRecords=65536):
+        self.stream = stream
+        self.limit = bufferRecords * BINARY_RECORD.size
+        self.buffer = bytearray(BINARY_MAGIC)
+
+    def start(self):
+        pass
+
+    def emit(self, pc, info, registers):
+        word, decoded = info
+        rd = writebackRegister(decoded)
+        if rd is None:
+            self.buffer += BINARY_RECORD.pack(pc, word, NO_WRITEBACK, 0)
+        else:
+            self.buffer += BINARY_RECORD.pack(pc, word, rd, registers[rd] & 0xFFFFFFFF)
+        if len(self.buffer) >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(self.buffer)
+            self.buffer = bytearray()
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+
+# Open a Trace Sink for a File
+def openTraceSink(fileName):
+    # The extension picks the format: .jsonl for JSON lines, .bin for the
+    # binary format, and anything else gets the text format.
+    if fileName.endswith('.jsonl'):
+        return JsonTraceSink(open(fileName, 'w'))
+    elif fileName.endswith('.bin'):
+        return BinaryTraceSink(open(fileName, 'wb'))
+    return TextTraceSink(open(fileName, 'w'))
+
+
+# Read a Binary Trace
+def readBinaryTrace(fileName):
+    # Yields (pc, word, rd, value) for every record, rd is None if the
+    # instruction didn't write a register.
+    with open(fileName, 'rb') as traceFile:
+        data = traceFile.read()
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError('Not a binary trace: ' + fileName)
+    for pc, word, rd, value in BINARY_RECORD.iter_unpack(memoryview(data)[len(BINARY_MAGIC):]):
+        yield pc, word, (None if rd == NO_WRITEBACK else rd), value
+
+
+# Read the Instructions of any Trace
+def readTrace(fileName):
+    # Yields (pc, word) for every instruction in a trace file, picking the
+    # format by the extension like openTraceSink does.  Text traces skip
+    # their label lines.
+    if fileName.endswith('.bin'):
+        for pc, word, rd, value in readBinaryTrace(fileName):
+            yield pc, word
+        return
+    with open(fileName, 'r') as traceFile:
+        if fileName.endswith('.jsonl'):
+            for line in traceFile:
+                if line.strip():
+                    event = json.loads(line)
+                    yield event['pc'], event['word']
+            return
+        for line in traceFile:
+            fields = line.split()
+            if len(fields) >= 2 and fields[0] != 'PC':
+                yield int(fields[0], 16), int(fields[1], 16)
+
+
+# Turn a Binary Trace back into the Text Format
+def decodeBinaryTrace(fileName, stream=None):
+    sink = TextTraceSink(stream)
+    sink.start()
+    decodedWords = {}
+    for pc, word, rd, value in readBinaryTrace(fileName):
+        decoded = decodedWords.get(word)
+        if decoded is None:
+            decoded = (word, Decoder.decode(word))
+            decodedWords[word] = decoded
+        sink.emit(pc, decoded, None)
+    sink.flush()
+
+
+if __name__ == '__main__':
+    # python Trace.py trace.bin prints the trace in the text format.
+    if len(sys.argv) != 2:
+        print("Usage: python Trace.py <trace.bin>")
+        sys.exit()
+    decodeBinaryTrace(sys.argv[1])
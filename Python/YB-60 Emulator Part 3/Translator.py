@@ -0,0 +1,418 @@
+import sys
+import Decoder, Instructions, Memory
+
+# Basic Block Translator
+# Instead of going around the run loop once per instruction, straight-line
+# runs of instructions (basic blocks) are turned into Python source, compiled
+# once, and cached by their start PC.  Inside a block the registers live in
+# local variables, and are only written back to the register list when the
+# block finishes.  A block ends at a branch, jal or jalr (which are included),
+# or just before an ebreak or anything that can't be decoded.  It also ends
+# just before a CSR instruction, which needs the instruction count, so the
+# Machine runs those itself.
+#
+# Debuggers can give the translator stops, PCs that must start a block.
+# Blocks end just before a stop and never loop back to one on their own, so
+# runUntil only has to look at the PC between blocks.
+#
+# A load or store that faults part way through a block leaves things as
+# the interpreter would: the registers written so far go back to the
+# register list, the PC is left at the faulting instruction, and the
+# MemoryAccessError's executed says how many instructions ran before it.
+
+# Longest block we will translate, to keep compile times small.
+MAX_BLOCK_LENGTH = 64
+
+# Python source for each instruction.  {rd}, {rs1} and {rs2} are the local
+# names of the registers, {imm} is the decoded immediate and {pc} is the
+# instruction's address.  {uimm} is the imm as 32 bits, {simm} is that with
+# the sign bit flipped (for signed compares), {shamt} is the shift amount,
+# and {upper} is the value of a lui or auipc, all worked out when
+# translating.  These must do exactly what Instructions.*Int do, registers
+# are always masked to 32 bits.
+# Loads and stores use the Memory's fast path inline (data, halves, words,
+# size and fast are its bytearray, casts, size and fastSize), and call its
+# methods (read8, write32, ...) for anything else.  Stores on the fast path
+# add their page to the Memory's dirty set ({pageBits} is PAGE_BITS), like
+# its write methods do.
+TEMPLATES = {
+    'ADD': '{rd} = ({rs1} + {rs2}) & 0xFFFFFFFF',
+    'SUB': '{rd} = ({rs1} - {rs2}) & 0xFFFFFFFF',
+    'AND': '{rd} = {rs1} & {rs2}',
+    'OR': '{rd} = {rs1} | {rs2}',
+    'XOR': '{rd} = {rs1} ^ {rs2}',
+    'SLL': '{rd} = ({rs1} << ({rs2} & 31)) & 0xFFFFFFFF',
+    'SRL': '{rd} = {rs1} >> ({rs2} & 31)',
+    'SRA': '{rd} = ((({rs1} ^ 0x80000000) - 0x80000000) >> ({rs2} & 31)) & 0xFFFFFFFF',
+    'SLT': '{rd} = 1 if {rs1} ^ 0x80000000 < {rs2} ^ 0x80000000 else 0',
+    'SLTU': '{rd} = 1 if {rs1} < {rs2} else 0',
+    'MUL': '{rd} = ({rs1} * {rs2}) & 0xFFFFFFFF',
+    'MULH': '{rd} = (((({rs1} ^ 0x80000000) - 0x80000000) * (({rs2} ^ 0x80000000) - 0x80000000)) >> 32) & 0xFFFFFFFF',
+    'MULHSU': '{rd} = (((({rs1} ^ 0x80000000) - 0x80000000) * {rs2}) >> 32) & 0xFFFFFFFF',
+    'MULHU': '{rd} = ({rs1} * {rs2}) >> 32',
+    'DIV': '{rd} = divide({rs1}, {rs2})',
+    'DIVU': '{rd} = {rs1} // {rs2} if {rs2} else 0xFFFFFFFF',
+    'REM': '{rd} = remainder({rs1}, {rs2})',
+    'REMU': '{rd} = {rs1} % {rs2} if {rs2} else {rs1}',
+    'ADDI': '{rd} = ({rs1} + {imm}) & 0xFFFFFFFF',
+    'ANDI': '{rd} = {rs1} & {uimm}',
+    'ORI': '{rd} = {rs1} | {uimm}',
+    'XORI': '{rd} = {rs1} ^ {uimm}',
+    'SLLI': '{rd} = ({rs1} << {shamt}) & 0xFFFFFFFF',
+    'SRLI': '{rd} = {rs1} >> {shamt}',
+    'SRAI': '{rd} = ((({rs1} ^ 0x80000000) - 0x80000000) >> {shamt}) & 0xFFFFFFFF',
+    'SLTI': '{rd} = 1 if {rs1} ^ 0x80000000 < {simm} else 0',
+    'SLTIU': '{rd} = 1 if {rs1} < {uimm} else 0',
+    'LUI': '{rd} = {upper}',
+    'AUIPC': '{rd} = {upper}',
+    'LB': ('a = ({rs1} + {imm}) & 0xFFFFFFFF\n{rd} = data[a] if a < size else read8(a)\n'
+           '{rd} = (({rd} ^ 0x80) - 0x80) & 0xFFFFFFFF'),
+    'LBU': 'a = ({rs1} + {imm}) & 0xFFFFFFFF\n{rd} = data[a] if a < size else read8(a)',
+    'LH': ('a = ({rs1} + {imm}) & 0xFFFFFFFF\n{rd} = halves[a >> 1] if not a & 1 and a < fast else read16(a)\n'
+           '{rd} = (({rd} ^ 0x8000) - 0x8000) & 0xFFFFFFFF'),
+    'LHU': 'a = ({rs1} + {imm}) & 0xFFFFFFFF\n{rd} = halves[a >> 1] if not a & 1 and a < fast else read16(a)',
+    'LW': 'a = ({rs1} + {imm}) & 0xFFFFFFFF\n{rd} = words[a >> 2] if not a & 3 and a < fast else read32(a)',
+    'SB': ('a = ({rs1} + {imm}) & 0xFFFFFFFF\nif a < size:\n    data[a] = {rs2} & 0xFF\n'
+           '    dirty.add(a >> {pageBits})\nelse:\n    write8(a, {rs2})'),
+    'SH': ('a = ({rs1} + {imm}) & 0xFFFFFFFF\nif not a & 1 and a < fast:\n    halves[a >> 1] = {rs2} & 0xFFFF\n'
+           '    dirty.add(a >> {pageBits})\nelse:\n    write16(a, {rs2})'),
+    'SW': ('a = ({rs1} + {imm}) & 0xFFFFFFFF\nif not a & 3 and a < fast:\n    words[a >> 2] = {rs2}\n'
+           '    dirty.add(a >> {pageBits})\nelse:\n    write32(a, {rs2})'),
+}
+
+# Branch conditions, for the instruction that ends a block.
+CONDITIONS = {
+    'BEQ': '{rs1} == {rs2}',
+    'BNE': '{rs1} != {rs2}',
+    'BLT': '{rs1} ^ 0x80000000 < {rs2} ^ 0x80000000',
+    'BGE': '{rs1} ^ 0x80000000 >= {rs2} ^ 0x80000000',
+    'BLTU': '{rs1} < {rs2}',
+    'BGEU': '{rs1} >= {rs2}',
+}
+
+STORE_SIZES = {'SB': 1, 'SH': 2, 'SW': 4}
+# Instructions that can raise a MemoryAccessError.
+LOAD_STORES = ('LB', 'LBU', 'LH', 'LHU', 'LW', 'SB', 'SH', 'SW')
+
+
+# A Translated Block
+class Block:
+    __slots__ = ('start', 'end', 'length', 'run', 'links')
+
+    def __init__(self, start, end, length, run):
+        # The block covers the bytes start to end - 1, and run(regs, budget)
+        # executes it, returning how many instructions it ran.  links chains
+        # a next PC to the block there.
+        self.start = start
+        self.end = end
+        self.length = length
+        self.run = run
+        self.links = {}
+
+
+# Basic Block Translator
+class BlockTranslator:
+
+    def __init__(self, memory, written=None):
+        # memory is the Memory.Memory the blocks run on.  blocks maps start
+        # PC -> Block, singles holds one instruction blocks for when there
+        # isn't enough budget left to run a whole block.  code holds every
+        # word index (address >> 2) that is part of a translated block, so
+        # stores can tell when they hit code.  written(address, length) is
+        # called when a block stores into code.
+        self.memory = memory
+        self.blocks = {}
+        self.singles = {}
+        self.code = set()
+        self.written = written if written is not None else self.invalidate
+        self.stops = frozenset()
+        # The names translated blocks see as globals.  A paged memory has no
+        # bytearray, so its size is left out and every access calls it.
+        self.namespace = {
+            'data': memory.data, 'halves': memory.halves, 'words': memory.words,
+            'size': memory.size if memory.data is not None else 0, 'fast': memory.fastSize, 'dirty': memory.dirty,
+            'read8': memory.readU8, 'read16': memory.readU16, 'read32': memory.readU32,
+            'write8': memory.writeU8, 'write16': memory.writeU16, 'write32': memory.writeU32,
+            'code': self.code, 'written': self.written,
+            'divide': Instructions.divide, 'remainder': Instructions.remainder,
+            'MemoryAccessError': Memory.MemoryAccessError,
+        }
+
+    # Forget every translated block
+    def clear(self):
+        self.blocks.clear()
+        self.singles.clear()
+        self.code.clear()
+
+    # Pick the PCs Blocks must start at
+    def setStops(self, stops):
+        # Blocks translated for the old stops may run straight through a
+        # new one, so changing them starts over.
+        stops = frozenset(stops)
+        if stops != self.stops:
+            self.stops = stops
+            self.clear()
+
+    # Forget the blocks overlapping changed memory
+    def invalidate(self, address, length):
+        end = address + length
+        stale = False
+        for cache in (self.blocks, self.singles):
+            for start, block in list(cache.items()):
+                if block.start < end and address < block.end:
+                    del cache[start]
+                    stale = True
+        if stale:
+            # Chains may point at a removed block, so drop them all, and
+            # rebuild the set of code words from what is left.
+            self.code.clear()
+            for cache in (self.blocks, self.singles):
+                for block in cache.values():
+                    block.links.clear()
+                    self.code.update(range(block.start >> 2, ((block.end - 1) >> 2) + 1))
+
+    # Run translated blocks from the PC in registers[32]
+    def run(self, registers, budget=None):
+        # Runs until an ebreak or undecodable instruction, the end of
+        # memory, or budget instructions.  Returns the instruction count,
+        # and leaves registers[32] at the next instruction to run.  A
+        # MemoryAccessError's executed counts every instruction run before
+        # it.
+        if budget is None:
+            budget = sys.maxsize
+        end = self.memory.size
+        executed = 0
+        pc = registers[32]
+        try:
+            block = self.lookup(pc)
+            while block is not None and pc != end:
+                remaining = budget - executed
+                if remaining < block.length:
+                    if remaining <= 0:
+                        break
+                    block = self.lookupSingle(pc)
+                executed += block.run(registers, remaining)
+                pc = registers[32]
+                nextBlock = block.links.get(pc)
+                if nextBlock is None:
+                    nextBlock = self.lookup(pc)
+                    if nextBlock is not None:
+                        block.links[pc] = nextBlock
+                block = nextBlock
+        except Memory.MemoryAccessError as error:
+            error.executed += executed
+            raise
+        return executed
+
+    # Run translated blocks until a Stop
+    def runUntil(self, registers, budget, stops):
+        # Like run, but also stops when the PC reaches one of stops, which
+        # must be in self.stops.  The instruction it starts at is always
+        # run, so a debugger can carry on from a breakpoint.
+        if budget is None:
+            budget = sys.maxsize
+        end = self.memory.size
+        executed = 0
+        pc = registers[32]
+        try:
+            while pc != end:
+                block = self.lookup(pc)
+                if block is None:
+                    break
+                remaining = budget - executed
+                if remaining < block.length:
+                    if remaining <= 0:
+                        break
+                    block = self.lookupSingle(pc)
+                executed += block.run(registers, remaining)
+                pc = registers[32]
+                if pc in stops:
+                    break
+        except Memory.MemoryAccessError as error:
+            error.executed += executed
+            raise
+        return executed
+
+    # Find or translate the block at a PC
+    def lookup(self, pc):
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.translate(pc, MAX_BLOCK_LENGTH)
+            if block is not None:
+                self.blocks[pc] = block
+        return block
+
+    # Find or translate a one instruction block at a PC
+    def lookupSingle(self, pc):
+        block = self.singles.get(pc)
+        if block is None:
+            block = self.translate(pc, 1)
+            self.singles[pc] = block
+        return block
+
+    # Translate the block starting at a PC
+    def translate(self, start, maxLength):
+        end = self.memory.size
+        instructions = []
+        pc = start
+        terminator = None
+        while len(instructions) < maxLength and pc != end:
+            # A fetch from outside of memory raises, but only once the
+            # instructions before it have run.  A stop starts a new block.
+            if instructions and (not 0 <= pc <= end - 4 or pc in self.stops):
+                break
+            word = self.memory.fetch(pc)
+            if word == Decoder.EBREAK_WORD:
+                break
+            decoded = Decoder.decode(word)
+            if decoded is None or decoded[0][3] == Decoder.CSR_KIND:
+                break
+            instructions.append((pc, decoded))
+            pc += 4
+            if decoded[0][3] == Decoder.JUMP_KIND:
+                terminator = instructions[-1]
+                break
+            if pc == end:
+                break
+        if not instructions:
+            return None
+
+        source = generateSource(start, instructions, terminator, start not in self.stops)
+        namespace = self.namespace
+        exec(compile(source, '<block {:05X}>'.format(start), 'exec'), namespace)
+        block = Block(start, pc, len(instructions), namespace.pop('block'))
+        self.code.update(range(start >> 2, ((pc - 1) >> 2) + 1))
+        return block
+
+
+# Generate the Python Source for a Block
+def generateSource(start, instructions, terminator, canLoop=True):
+    # x0 is read as a literal 0, and written to a local that is never
+    # written back, so it stays 0.  i is set to the index of each load and
+    # store, for when it faults.
+    used = set()
+    body = []
+    faults = False
+    # Everything but the terminator is straight-line code.
+    straight = instructions[:-1] if terminator is not None else instructions
+    for index, (pc, decoded) in enumerate(straight):
+        entry, rd, rs1, rs2, imm = decoded
+        mnemonic = entry[0]
+        uimm = imm & 0xFFFFFFFF
+        upper = (imm << 12) + (pc if mnemonic == 'AUIPC' else 0)
+        names = {'rd': sourceName(rd, 'z'), 'rs1': sourceName(rs1), 'rs2': sourceName(rs2), 'imm': imm, 'pc': pc,
+                 'uimm': uimm, 'simm': uimm ^ 0x80000000, 'shamt': imm & 31, 'upper': upper & 0xFFFFFFFF,
+                 'pageBits': Memory.PAGE_BITS}
+        if mnemonic in LOAD_STORES:
+            body.append('i = %d' % index)
+            faults = True
+        body.extend(TEMPLATES[mnemonic].format(**names).split('\n'))
+        if entry[1] == Decoder.S_FORMAT:
+            used.update((rs1, rs2))
+            # A store into translated code leaves the block straight away,
+            # so the changed instructions get translated again.
+            size = STORE_SIZES[mnemonic]
+            check = 'a >> 2 in code' if size == 1 else 'a >> 2 in code or (a + %d) >> 2 in code' % (size - 1)
+            body.append('if %s:' % check)
+            body.append('    written(a, %d)' % size)
+            body.append('    EXIT %d %d' % (pc + 4, index + 1))
+        elif entry[1] == Decoder.R_FORMAT:
+            used.update((rd, rs1, rs2))
+        elif entry[1] == Decoder.I_FORMAT:
+            used.update((rd, rs1))
+        else:
+            used.add(rd)
+
+    # The terminator decides the next PC: a condition (None means always
+    # taken), the taken target, and the not taken address.
+    condition = None
+    target = None
+    after = None
+    count = len(instructions)
+    if terminator is not None:
+        pc, (entry, rd, rs1, rs2, imm) = terminator
+        mnemonic = entry[0]
+        after = pc + 4
+        if mnemonic == 'JAL':
+            used.add(rd)
+            if rd:
+                body.append('x%d = %d' % (rd, (pc + 4) & 0xFFFFFFFF))
+            target = (pc + imm) & 0xFFFFFFFF
+        elif mnemonic == 'JALR':
+            # The target first, since rd may be rs1.
+            used.update((rd, rs1))
+            body.append('nextPC = (%s + %d) & 0xFFFFFFFE' % (sourceName(rs1), imm))
+            if rd:
+                body.append('x%d = %d' % (rd, (pc + 4) & 0xFFFFFFFF))
+        else:
+            used.update((rs1, rs2))
+            condition = CONDITIONS[mnemonic].format(rs1=sourceName(rs1), rs2=sourceName(rs2))
+            target = (pc + imm) & 0xFFFFFFFF
+    else:
+        after = instructions[-1][0] + 4
+
+    loops = canLoop and target == start
+    registers = sorted(used - {0})
+    writeBack = ['regs[%d] = x%d' % (r, r) for r in registers]
+
+    lines = ['def block(regs, budget):']
+    lines.extend('    x%d = regs[%d]' % (r, r) for r in registers)
+    code = []
+    indent = '    '
+    if loops:
+        # A block that jumps back to its own start runs as a Python loop
+        # for as long as the budget allows.
+        code.append('    n = 0')
+        code.append('    while True:')
+        indent = '        '
+    for line in body:
+        if line.lstrip().startswith('EXIT '):
+            # Leave the block early, after the given number of instructions.
+            pad = line[:len(line) - len(line.lstrip())]
+            nextPC, done = line.split()[1:]
+            for write in writeBack:
+                code.append(indent + pad + write)
+            code.append(indent + pad + 'regs[32] = %s' % nextPC)
+            code.append(indent + pad + ('return n + %s' % done if loops else 'return %s' % done))
+        else:
+            code.append(indent + line)
+
+    if loops:
+        code.append(indent + 'n += %d' % count)
+        if condition is not None:
+            code.append(indent + 'if not (%s):' % condition)
+            code.append(indent + '    nextPC = %d' % after)
+            code.append(indent + '    break')
+        code.append(indent + 'if n + %d > budget:' % count)
+        code.append(indent + '    nextPC = %d' % start)
+        code.append(indent + '    break')
+        count = 'n'
+    elif condition is not None:
+        code.append('    nextPC = %d if %s else %d' % (target, condition, after))
+    elif target is not None:
+        code.append('    nextPC = %d' % target)
+    elif terminator is None:
+        code.append('    nextPC = %d' % after)
+    code.extend('    ' + write for write in writeBack)
+    code.append('    regs[32] = nextPC')
+    code.append('    return %s' % count)
+
+    if not faults:
+        lines.extend(code)
+    else:
+        # A fault writes back what the block did before it, and leaves the
+        # PC at the instruction that faulted.
+        lines.append('    try:')
+        lines.extend('    ' + line for line in code)
+        lines.append('    except MemoryAccessError as error:')
+        lines.extend('        ' + write for write in writeBack)
+        lines.append('        regs[32] = %d + 4 * i' % start)
+        lines.append('        error.executed = %s' % ('n + i' if loops else 'i'))
+        lines.append('        raise')
+    return '\n'.join(lines) + '\n'
+
+
+# The Local Name of a Register in a Block
+def sourceName(register, zero='0'):
+    # Reading x0 is a literal 0, and writing it goes to the zero name.
+    return 'x%d' % register if register else zero
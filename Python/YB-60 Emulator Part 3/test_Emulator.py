@@ -0,0 +1,254 @@
+import io, os, random
+import pytest
+import Benchmarks, Loader, Machine, Memory, Trace
+
+# Emulator Tests
+# Run with "python -m pytest" from this directory.  Every engine has to
+# leave a machine in exactly the state Machine.run, the interpreter, does,
+# so most of these run the same program both ways and compare registers,
+# memory and instruction counts.
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+# Path of an Object File next to the Tests
+def objectFile(name):
+    return os.path.join(DIRECTORY, name)
+
+
+# Instruction Encoders
+def encodeR(funct7, rs2, rs1, funct3, rd, opcode=0x33):
+    return (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+
+def encodeI(imm, rs1, funct3, rd, opcode=0x13):
+    return ((imm & 0xFFF) << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+
+def encodeS(imm, rs2, rs1, funct3):
+    imm &= 0xFFF
+    return ((imm >> 5) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | ((imm & 0x1F) << 7) | 0x23
+
+
+def encodeB(imm, rs2, rs1, funct3):
+    imm &= 0x1FFF
+    return (((imm >> 12) & 1) << 31) | (((imm >> 5) & 0x3F) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) \
+        | (((imm >> 1) & 0xF) << 8) | (((imm >> 11) & 1) << 7) | 0x63
+
+
+def encodeJ(imm, rd):
+    imm &= 0x1FFFFF
+    return (((imm >> 20) & 1) << 31) | (((imm >> 1) & 0x3FF) << 21) | (((imm >> 11) & 1) << 20) \
+        | (((imm >> 12) & 0xFF) << 12) | (rd << 7) | 0x6F
+
+
+EBREAK = 0x00100073
+
+
+# Make a Machine holding a Program
+def makeMachine(words, address=0x300, **options):
+    machine = Machine.Machine(**options)
+    machine.edit(address, b''.join(word.to_bytes(4, 'little') for word in words))
+    return machine
+
+
+# Run a Machine one of the ways it can be Run
+def runMachine(machine, startAddress, budget, translated):
+    # Returns the machine's state afterwards: its registers, instruction
+    # count, memory, and the error it stopped with, if any.
+    error = None
+    try:
+        if translated:
+            machine.runTranslated(startAddress, budget)
+        else:
+            machine.run(startAddress, Trace.TextTraceSink(io.StringIO()), budget)
+    except Memory.MemoryAccessError as raised:
+        error = str(raised)
+    return (machine.registers[:Machine.REGISTER_COUNT], machine.retired, bytes(machine.memory[0:len(machine.memory)]),
+            error)
+
+
+# Run a Program with the Interpreter and the Block Translator
+def runBothWays(makeOne, startAddress=0x300, budget=None):
+    # makeOne() returns a fresh machine.  Asserts both ways end in the
+    # same state, and returns it.
+    interpreted = runMachine(makeOne(), startAddress, budget, False)
+    translated = runMachine(makeOne(), startAddress, budget, True)
+    assert translated[0] == interpreted[0]
+    assert translated[1] == interpreted[1]
+    assert translated[2] == interpreted[2]
+    assert translated[3] == interpreted[3]
+    return translated
+
+
+# Collatz over an Input
+def collatzMachine(value, **options):
+    machine = Machine.Machine(**options)
+    machine.load(objectFile('collatz.obj'))
+    machine.edit(0x400, value.to_bytes(4, 'little'))
+    return machine
+
+
+# Block Translator
+
+def testTranslatedCollatz():
+    registers, retired, memory, error = runBothWays(lambda: collatzMachine(27))
+    assert error is None
+    # 111 steps, stored at 0x404.
+    assert int.from_bytes(memory[0x404:0x408], 'little') == 111
+    assert registers[32] == 0x338
+
+
+@pytest.mark.parametrize('budget', [0, 1, 2, 3, 7, 10, 11, 64, 65, 500])
+def testTranslatedBudget(budget):
+    registers, retired, memory, error = runBothWays(lambda: collatzMachine(27), budget=budget)
+    assert retired == budget
+
+
+def testTranslatedFault():
+    # A load from outside of memory after two instructions of the same
+    # block stops at the load, with the two before it run and counted.
+    program = [
+        encodeI(7, 0, 0, 5),  # addi x5, x0, 7
+        encodeI(1, 5, 0, 5),  # addi x5, x5, 1
+        encodeI(-4, 0, 2, 6, 0x03),  # lw x6, -4(x0)
+    ]
+    registers, retired, memory, error = runBothWays(lambda: makeMachine(program))
+    assert error is not None
+    assert registers[32] == 0x308
+    assert registers[5] == 8
+    assert retired == 2
+
+
+@pytest.mark.parametrize('paged', [False, True])
+def testTranslatedFaultInLoop(paged):
+    # Stores walking up to the end of memory, so the fault comes part way
+    # through a block that loops on itself.
+    program = [
+        0x000FF2B7,  # lui x5, 0xFF
+        encodeI(1, 6, 0, 6),  # addi x6, x6, 1
+        encodeS(0, 6, 5, 2),  # sw x6, 0(x5)
+        encodeI(24, 5, 0, 5),  # addi x5, x5, 24
+        encodeJ(-12, 0),  # jal x0, -12
+    ]
+    registers, retired, memory, error = runBothWays(lambda: makeMachine(program, paged=paged,
+                                                                       memorySize=Machine.MEMORY_SIZE))
+    assert error is not None
+    assert registers[32] == 0x308
+    assert registers[5] == 0x100000 + 8
+
+
+def testTranslatedSelfModifyingCode():
+    # The store rewrites the addi after it, which has to run as stored.
+    program = [
+        0x00128137,  # lui x2, 0x128
+        encodeI(0x293, 2, 0, 2),  # addi x2, x2, 0x293 (x2 is "addi x5, x5, 1")
+        encodeS(0x30C, 2, 0, 2),  # sw x2, 0x30C(x0)
+        encodeI(1, 6, 0, 6),  # addi x6, x6, 1
+        EBREAK,
+    ]
+    registers, retired, memory, error = runBothWays(lambda: makeMachine(program))
+    assert registers[5] == 1
+    assert registers[6] == 0
+
+
+# A Random Loop of Loads, Stores and Arithmetic
+def randomLoop(rng):
+    words = [encodeI(rng.randrange(0, 2048), 0, 0, 10)]
+    body = []
+    for i in range(rng.randrange(1, 10)):
+        choice = rng.random()
+        rd = rng.choice([5, 6, 7, 10])
+        rs = rng.choice([5, 6, 7, 10])
+        if choice < 0.3:
+            body.append(encodeI(rng.randrange(-50, 50), rs, 0, rd))
+        elif choice < 0.5:
+            body.append(encodeI(rng.randrange(-8, 8), 10, rng.choice([0, 1, 2, 4, 5]), rd, 0x03))
+        elif choice < 0.7:
+            body.append(encodeS(rng.randrange(-8, 8), rs, 10, rng.choice([0, 1, 2])))
+        else:
+            body.append(encodeR(0, rs, rd, 0, rd))
+    body.append(encodeI(rng.choice([64, 256, -256, 1000]), 10, 0, 10))
+    if rng.random() < 0.5:
+        body.append(encodeB(-4 * len(body), 0, 0, 0))
+    else:
+        body.append(encodeJ(-4 * len(body), 0))
+    return words + body
+
+
+@pytest.mark.parametrize('seed', range(40))
+def testTranslatedRandomLoops(seed):
+    # Most of these run off one end of memory, part way through a block.
+    rng = random.Random(seed)
+    program = randomLoop(rng)
+    size = rng.choice([4096, 8192])
+    for paged in (False, True):
+        runBothWays(lambda: makeMachine(program, 0x100, memorySize=size, paged=paged), 0x100, 100000)
+
+
+# Intel HEX Loader
+
+# Make an Intel HEX Record, with its Checksum
+def hexRecord(address, recordType, data=b'', checksum=None):
+    record = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, recordType]) + bytes(data)
+    if checksum is None:
+        checksum = -sum(record) & 0xFF
+    return ':' + (record + bytes([checksum])).hex().upper()
+
+
+def testHexRecords():
+    text = '\n'.join([
+        hexRecord(0x0300, 0x00, b'\x13\x05\x10\x00'),
+        hexRecord(0x0000, 0x02, b'\x10\x00'),  # extended address 0x1000 * 16
+        hexRecord(0x0010, 0x00, b'\xAA\xBB'),
+        hexRecord(0x0000, 0x01),
+        hexRecord(0x0400, 0x00, b'\xFF'),  # after EOF, never loaded
+    ])
+    memory = bytearray(Machine.MEMORY_SIZE)
+    written = []
+    Loader.loadHex(text, memory, written)
+    assert memory[0x300:0x304] == b'\x13\x05\x10\x00'
+    assert memory[0x10010:0x10012] == b'\xAA\xBB'
+    assert memory[0x400] == 0
+    assert written == [(0x300, 4), (0x10010, 2)]
+    memory[0x300:0x304] = bytes(4)
+    memory[0x10010:0x10012] = bytes(2)
+    assert memory.count(0) == len(memory)
+
+
+def testHexSkipsOtherLines():
+    text = 'a comment\r\n\r\n   ' + hexRecord(0x0020, 0x00, b'\x01\x02') + '  \r\n' + hexRecord(0, 0x01) + '\r\n'
+    memory = bytearray(0x100)
+    Loader.loadHex(text, memory)
+    assert memory[0x20:0x22] == b'\x01\x02'
+
+
+@pytest.mark.parametrize('line', [
+    hexRecord(0x0300, 0x00, b'\x13\x05', checksum=0x00),  # bad checksum
+    ':0203000013',  # too short for its byte count
+    ':0103000013' + '05' + 'E4' + '00',  # too long for its byte count
+    ':02030000ZZ05D4',  # not hex
+    hexRecord(0x0000, 0x04, b'\x00\x00'),  # unknown record type
+    hexRecord(0xFFFF, 0x00, b'\x01\x02'),  # runs off the end of memory
+])
+def testHexErrors(line):
+    with pytest.raises(Loader.FormatError):
+        Loader.loadHex(line + '\n' + hexRecord(0, 0x01), bytearray(0x10000))
+
+
+def testHexMatchesLegacyLoader():
+    text = Benchmarks.makeHexImage(65536)
+    memory = bytearray(Machine.MEMORY_SIZE)
+    legacyMemory = bytearray(Machine.MEMORY_SIZE)
+    Loader.loadHex(text, memory)
+    Benchmarks.legacyLoadProgram(io.StringIO(text), legacyMemory)
+    assert memory == legacyMemory
+    assert memory.count(0) != len(memory)
+
+
+def testLegacyLoaderAgreesOnBadChecksums():
+    line = hexRecord(0x0300, 0x00, b'\x13\x05', checksum=0x42)
+    with pytest.raises(Loader.FormatError):
+        Benchmarks.legacyLoadProgram(io.StringIO(line + '\n'), bytearray(0x1000))
+    with pytest.raises(Loader.FormatError):
+        Loader.loadHex(line, bytearray(0x1000))